@@ -14,3 +14,15 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'API.settings')
 
 application = get_asgi_application()
+
+# Served by gunicorn with uvicorn workers (see entrypoint.sh). Async views such
+# as the job progress stream run on the event loop; regular sync views, and
+# with them all image decoding and processing, run in Django's per-request
+# worker threads, so Pillow and the models never block the loop.
+from django.conf import settings  # noqa: E402
+
+# With `gunicorn --preload` this runs once in the master, so the forked
+# workers share the model weights copy-on-write.
+if settings.AI_PRELOAD_MODELS:
+    from Ai_processing.registry import preload_models
+    preload_models()
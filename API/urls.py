@@ -18,21 +18,27 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include, re_path
-from django.views.static import serve
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
+from Ai_processing.media import serve_media
+from Ai_processing.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/users/', include('users.urls')),
     path('api/processing/', include('Ai_processing.urls')),
     path('api/history/', include('user_history.urls')),
 
+    # Prometheus scrape endpoint
+    path('metrics', metrics_view, name='metrics'),
+
     # Swagger / OpenAPI
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
 
-    # Serve media files (uploaded/processed images) in all environments
-    re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
+    # Serve media files (uploaded/processed images) in all environments, with
+    # validators, ranges and optional hand-off to the front proxy
+    re_path(r'^media/(?P<path>.*)$', serve_media, name='media'),
 ]
 
 # Serve static files during development
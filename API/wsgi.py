@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'API.settings')
 
 application = get_wsgi_application()
+
+# With `gunicorn --preload` this runs once in the master, so the forked
+# workers share the model weights copy-on-write.
+from django.conf import settings  # noqa: E402
+
+if settings.AI_PRELOAD_MODELS:
+    from Ai_processing.registry import preload_models
+    preload_models()
@@ -1,4 +1,8 @@
 from django.contrib import admin
-from .models import Ai_feature
+from .models import Ai_feature, IdempotencyKey, ProcessedResult, ProcessingJob, UploadSession
 # Register your models here.
-admin.site.register(Ai_feature)
\ No newline at end of file
+admin.site.register(Ai_feature)
+admin.site.register(ProcessingJob)
+admin.site.register(ProcessedResult)
+admin.site.register(UploadSession)
+admin.site.register(IdempotencyKey)
@@ -0,0 +1,173 @@
+"""
+Admission control for the inference path, shared by every process on a node.
+
+At most AI_ADMISSION_SLOTS requests decode and process images at once on a
+node. Others wait in a bounded queue (AI_ADMISSION_QUEUE_SIZE places) for at
+most AI_ADMISSION_QUEUE_TIMEOUT seconds. If the queue is full, or the wait
+runs out, ``AdmissionRejected`` is raised and the view answers 503 with
+Retry-After, instead of piling more work onto a saturated node.
+
+Slots and queue places are lock files under AI_ADMISSION_DIR held with
+``flock``, so the limits hold across all gunicorn workers and threads, and
+the kernel releases them when a worker dies. Users with an active PREMIUM
+subscription queue in their own places (AI_ADMISSION_PREMIUM_QUEUE_SIZE);
+others only take a free slot while no premium user is waiting. Waiters poll
+for a slot, so the order among them is not strictly first come, first served.
+"""
+
+import fcntl
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+from subscriptions.models import Subscription
+
+from .deadlines import check
+from .timing import stage
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.02  # seconds between slot attempts while queued
+
+
+class AdmissionRejected(Exception):
+    """The node is saturated; ``reason`` is 'queue_full' or 'timeout'."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def is_premium(user) -> bool:
+    return Subscription.objects.filter(
+        user=user,
+        plan='PREMIUM',
+        active=True,
+        end_date__gt=timezone.now(),
+    ).exists()
+
+
+def _paths(kind: str, count: int) -> list:
+    directory = settings.AI_ADMISSION_DIR
+    os.makedirs(directory, exist_ok=True)
+    return [os.path.join(directory, f"{kind}-{index}.lock") for index in range(count)]
+
+
+def _try_lock(path):
+    """Take the lock on ``path`` without blocking; return its fd, or None if held."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _release(fd) -> None:
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def _lock_any(paths):
+    for path in paths:
+        fd = _try_lock(path)
+        if fd is not None:
+            return fd
+    return None
+
+
+def _premium_waiting() -> bool:
+    for path in _paths('premium-queue', settings.AI_ADMISSION_PREMIUM_QUEUE_SIZE):
+        fd = _try_lock(path)
+        if fd is None:
+            return True
+        _release(fd)
+    return False
+
+
+def _try_slot(premium: bool):
+    if not premium and _premium_waiting():
+        return None
+    return _lock_any(_paths('slot', settings.AI_ADMISSION_SLOTS))
+
+
+def stats() -> dict:
+    """How many slots and queue places are taken on this node right now."""
+    def taken(kind, count):
+        busy = 0
+        for path in _paths(kind, count):
+            fd = _try_lock(path)
+            if fd is None:
+                busy += 1
+            else:
+                _release(fd)
+        return busy
+
+    return {
+        'slots': settings.AI_ADMISSION_SLOTS,
+        'running': taken('slot', settings.AI_ADMISSION_SLOTS),
+        'queued': taken('queue', settings.AI_ADMISSION_QUEUE_SIZE),
+        'queued_premium': taken('premium-queue', settings.AI_ADMISSION_PREMIUM_QUEUE_SIZE),
+    }
+
+
+@contextmanager
+def admission(user, slots: int = 1):
+    """
+    Hold an inference slot for the duration of the ``with`` block.
+
+    Work that fans out over several processes (a batch) asks for up to
+    ``slots``: the first is waited for as usual, the others are only taken
+    if they are free right away. Yields how many slots are held, and
+    ``slots`` when AI_ADMISSION_SLOTS is 0 (no limit).
+
+    Raises:
+        AdmissionRejected: If the queue is full or the wait for a slot ran out.
+        DeadlineExceeded: If the request's deadline passes while it waits.
+    """
+    if settings.AI_ADMISSION_SLOTS <= 0:
+        yield slots
+        return
+
+    premium = is_premium(user)
+    slot = _try_slot(premium)
+    if slot is None:
+        if premium:
+            queue = _paths('premium-queue', settings.AI_ADMISSION_PREMIUM_QUEUE_SIZE)
+        else:
+            queue = _paths('queue', settings.AI_ADMISSION_QUEUE_SIZE)
+        place = _lock_any(queue)
+        if place is None:
+            logger.warning("Admission rejected: queue full (premium=%s)", premium)
+            raise AdmissionRejected('queue_full', settings.AI_ADMISSION_RETRY_AFTER)
+        try:
+            deadline = time.monotonic() + settings.AI_ADMISSION_QUEUE_TIMEOUT
+            with stage('queue'):
+                while slot is None:
+                    # No point waiting past the request's own deadline
+                    check('queue')
+                    if time.monotonic() >= deadline:
+                        logger.warning("Admission rejected: queue timeout (premium=%s)", premium)
+                        raise AdmissionRejected('timeout', settings.AI_ADMISSION_RETRY_AFTER)
+                    time.sleep(POLL_INTERVAL)
+                    slot = _try_slot(premium)
+        finally:
+            _release(place)
+
+    held = [slot]
+    while len(held) < slots:
+        extra = _try_slot(premium)
+        if extra is None:
+            break
+        held.append(extra)
+    try:
+        yield len(held)
+    finally:
+        for fd in held:
+            _release(fd)
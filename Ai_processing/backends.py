@@ -0,0 +1,219 @@
+"""
+Inference backends: what a feature's model actually runs on.
+
+AI_INFERENCE_BACKEND picks the backend for the model features
+(SUPER_RESOLUTION, DE_NOISE, DE_BLUR, SHADOW_REMOVAL):
+
+- ``python``: the Python callables in ``utils.MODEL_LOADERS``.
+- ``onnx``: ONNX Runtime on the CPU. A feature uses
+  ``AI_ONNX_MODEL_DIR/<feature>.onnx`` (e.g. ``de_noise.onnx``), or
+  ``<feature>.int8.onnx`` when AI_ONNX_INT8 is on and a quantized copy exists
+  (``manage.py quantize_models`` writes one with ``quantize``). Features
+  without a model file keep their Python callable.
+
+A quality tier can have a model of its own, e.g. a smaller
+``de_noise.fast.onnx`` or a larger ``de_noise.best.onnx``. It is registered
+as ``<FEATURE>:<tier>`` and only used when that file exists (see
+``utils.model_name``); otherwise the tier runs the feature's usual model.
+
+An ONNX model takes a float32 NCHW RGB tensor in 0..1 and returns one the
+same way (possibly larger, for super-resolution). When its batch dimension
+is dynamic it also gets ``predict_batch``, so ``microbatch`` batches
+concurrent calls into one run.
+
+Each process builds one InferenceSession per model, the first time the
+model runs in that process. ORT's thread pools don't survive a fork, so a
+model preloaded in the gunicorn master only gets its session in the worker.
+A session uses AI_ONNX_INTRA_OP_THREADS threads. The default is the CPU
+count divided by AI_ADMISSION_SLOTS: admission control already caps how
+many inferences run on the node at once, so together they fill the cores
+without oversubscribing them.
+"""
+
+import logging
+import os
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('python', 'onnx')
+
+
+def model_path(name: str, tier: str = None):
+    """The ONNX file the ``onnx`` backend runs for feature ``name`` (at quality ``tier``), or None."""
+    directory = Path(settings.AI_ONNX_MODEL_DIR)
+    if tier is not None:
+        path = directory / f"{name.lower()}.{tier}.onnx"
+        return path if path.is_file() else None
+    candidates = [directory / f"{name.lower()}.onnx"]
+    if settings.AI_ONNX_INT8:
+        candidates.insert(0, directory / f"{name.lower()}.int8.onnx")
+    return next((path for path in candidates if path.is_file()), None)
+
+
+@lru_cache(maxsize=None)
+def has_tier_model(name: str, tier: str) -> bool:
+    """Whether feature ``name`` has a model of its own for quality ``tier``."""
+    return settings.AI_INFERENCE_BACKEND == 'onnx' and model_path(name, tier) is not None
+
+
+@lru_cache(maxsize=None)
+def model_variant(name: str) -> str:
+    """
+    What feature ``name`` runs on: ``python``, ``onnx`` or ``onnx-int8``.
+
+    Part of the result cache's model version, so switching backends does
+    not serve results produced by the other one.
+    """
+    if settings.AI_INFERENCE_BACKEND != 'onnx':
+        return 'python'
+    path = model_path(name)
+    if path is None:
+        return 'python'
+    return 'onnx-int8' if path.name.endswith('.int8.onnx') else 'onnx'
+
+
+def session_options():
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = settings.AI_ONNX_INTRA_OP_THREADS
+    options.inter_op_num_threads = settings.AI_ONNX_INTER_OP_THREADS
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # Threads spinning between runs only steal CPU from the other workers
+    options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+    options.add_session_config_entry('session.inter_op.allow_spinning', '0')
+    return options
+
+
+def to_tensor(images) -> np.ndarray:
+    """PIL images of one size -> float32 NCHW batch in 0..1."""
+    batch = np.stack([np.asarray(image.convert('RGB'), dtype=np.float32) for image in images])
+    batch *= 1 / 255
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+
+def from_tensor(batch: np.ndarray, sources) -> list:
+    """Float32 NCHW batch in 0..1 -> PIL images, keeping each source's alpha."""
+    pixels = np.clip(batch.transpose(0, 2, 3, 1) * 255 + 0.5, 0, 255).astype(np.uint8)
+    images = []
+    for array, source in zip(pixels, sources):
+        image = Image.fromarray(array, 'RGB')
+        if source.mode in ('RGBA', 'LA', 'PA'):
+            image.putalpha(source.getchannel('A').resize(image.size, Image.BICUBIC))
+        images.append(image)
+    return images
+
+
+class OnnxModel:
+    """One ONNX model; its session is built in (and belongs to) the calling process."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.nbytes = path.stat().st_size
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    import onnxruntime as ort
+
+                    self._session = ort.InferenceSession(
+                        str(self.path), sess_options=session_options(), providers=['CPUExecutionProvider']
+                    )
+                    self._input = self._session.get_inputs()[0].name
+                    self._pid = os.getpid()
+        return self._session
+
+    def run(self, images) -> list:
+        session = self.session()
+        (output,) = session.run(None, {self._input: to_tensor(images)})
+        return from_tensor(output, images)
+
+    def __call__(self, image: Image.Image) -> Image.Image:
+        return self.run([image])[0]
+
+
+class BatchedOnnxModel(OnnxModel):
+    """An ONNX model with a dynamic batch dimension."""
+
+    def predict_batch(self, images) -> list:
+        return self.run(images)
+
+
+def load_onnx_model(path: Path) -> OnnxModel:
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        raise ImproperlyConfigured("AI_INFERENCE_BACKEND=onnx needs the onnxruntime package.")
+    # Check the model loads and whether its batch dimension is dynamic, with a
+    # single-threaded throwaway session (this may run before a fork)
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = 1
+    options.inter_op_num_threads = 1
+    probe = ort.InferenceSession(str(path), sess_options=options, providers=['CPUExecutionProvider'])
+    batched = not isinstance(probe.get_inputs()[0].shape[0], int)
+    del probe
+    return (BatchedOnnxModel if batched else OnnxModel)(path)
+
+
+def quantize(source: Path, target: Path, calibration_images, quant_format: str = 'qoperator') -> None:
+    """
+    Write an int8 copy of the model at ``source`` to ``target``.
+
+    Static quantization: activation ranges come from running
+    ``calibration_images`` (PIL images) through the model, so the int8
+    graph uses ORT's fused QLinearConv kernels. Dynamic quantization would
+    turn convolutions into ConvInteger, which is several times slower on CPU.
+    Whether int8 beats fp32 depends on the CPU (VNNI/AMX); measure with
+    ``manage.py benchmark_inference``.
+    """
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self, model_input: str):
+            self._feeds = ({model_input: to_tensor([image])} for image in calibration_images)
+
+        def get_next(self):
+            return next(self._feeds, None)
+
+    import onnxruntime as ort
+
+    model_input = ort.InferenceSession(str(source), providers=['CPUExecutionProvider']).get_inputs()[0].name
+    quantize_static(
+        source,
+        target,
+        _Reader(model_input),
+        quant_format=QuantFormat.QOperator if quant_format == 'qoperator' else QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+
+
+def loader(name: str, python_loader, tier: str = None):
+    """The model loader for feature ``name`` (at quality ``tier``); it picks the backend when the model loads."""
+    def load():
+        if settings.AI_INFERENCE_BACKEND not in BACKENDS:
+            raise ImproperlyConfigured(
+                f"AI_INFERENCE_BACKEND must be one of {', '.join(BACKENDS)}, "
+                f"not {settings.AI_INFERENCE_BACKEND!r}."
+            )
+        if settings.AI_INFERENCE_BACKEND == 'onnx':
+            path = model_path(name, tier)
+            if path is not None:
+                return load_onnx_model(path)
+            logger.info("No ONNX model for %s in %s; using the Python model", name, settings.AI_ONNX_MODEL_DIR)
+        return python_loader()
+    return load
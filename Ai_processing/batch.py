@@ -0,0 +1,79 @@
+"""
+Process pool for batch requests.
+
+Images in a batch are independent, so each one is decoded, processed and
+encoded in its own worker process. The pool is created lazily, once per
+web worker, and sized from ``AI_BATCH_WORKERS`` (defaults to the CPU count).
+A batch only keeps as many images in flight as it holds admission slots.
+
+Web workers run threads (request threads, the upload pool, uvicorn's loop),
+and forking a threaded process can leave locks held in the child, so the
+pool's processes come from a fork server started clean, and set up Django
+themselves.
+"""
+
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.conf import settings
+
+from . import shm
+from .utils import process_image_bytes
+
+_pool = None
+
+
+def _start_worker():
+    # Started from the fork server, not the web worker: nothing is set up yet
+    django.setup()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _pool
+    # A pool whose worker died (e.g. killed for memory) refuses all new work; replace it
+    if _pool is None or getattr(_pool, '_broken', False):
+        # Segments of a previous worker that crashed before its lease was closed
+        shm.sweep_dead()
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.AI_BATCH_WORKERS,
+            mp_context=multiprocessing.get_context(method),
+            initializer=_start_worker,
+        )
+    return _pool
+
+
+def process_batch(items, output=None, quality=None, concurrency=None):
+    """
+    Run ``process_image_bytes`` for every ``(bytes, steps)`` pair concurrently.
+
+    Every image runs at the same ``quality`` tier and is encoded with the
+    same ``output`` spec. At most ``concurrency`` images (by default the
+    pool size) are in the pool at once. Returns a list in the same order as
+    ``items``; each entry is either the encoded bytes or the exception
+    raised for that item, so one bad image does not fail the others.
+    """
+    pool = get_process_pool()
+    concurrency = max(1, concurrency or settings.AI_BATCH_WORKERS)
+    queued = iter(enumerate(items))
+    running = {}
+    results = [None] * len(items)
+
+    def submit_next():
+        for index, (data, steps) in queued:
+            running[pool.submit(process_image_bytes, data, steps, None, output, quality)] = index
+            return
+
+    for _ in range(concurrency):
+        submit_next()
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = running.pop(future)
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                results[index] = e
+            submit_next()
+    return results
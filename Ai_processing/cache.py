@@ -0,0 +1,164 @@
+"""
+Content-addressed result cache for processed images.
+
+Entries live in the ProcessedResult table so every web and job worker
+shares them. Hits and misses are counted in a Prometheus counter, which
+every process on the node writes to (see Ai_processing.metrics); ``stats``
+merges them, so they cover the node since its metrics were last reset.
+
+Eviction counts the whole table, so each process only runs it every
+EVICT_INTERVAL stores; in between, the table may grow past
+AI_RESULT_CACHE_MAX_ENTRIES by up to that many entries per process.
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, Q
+from django.utils import timezone
+from prometheus_client import multiprocess
+
+from .backends import model_variant
+from .metrics import RESULT_CACHE_LOOKUPS
+from .models import ProcessedResult
+from .utils import MODEL_LOADERS, MODEL_VERSIONS
+
+LOOKUPS_COUNTER = 'api_pix_result_cache_lookups'
+EVICT_INTERVAL = 100
+
+_stores_since_evict = 0
+
+
+def pipeline_name(steps) -> str:
+    return '+'.join(steps)
+
+
+def _feature_version(feature: str) -> str:
+    version = MODEL_VERSIONS.get(feature, '0')
+    if feature in MODEL_LOADERS and model_variant(feature) != 'python':
+        # Results from the ONNX models are not interchangeable with the Python ones
+        version += f"-{model_variant(feature)}"
+    return version
+
+
+def model_version(steps) -> str:
+    return '+'.join(_feature_version(feature) for feature in steps)
+
+
+def cache_key(upload, steps, params=None) -> str:
+    """
+    SHA-256 over the image bytes, pipeline steps, parameters and model versions.
+
+    ``upload`` is a Django File (or bytes); files are hashed chunk by chunk.
+    """
+    digest = hashlib.sha256()
+    if isinstance(upload, bytes):
+        digest.update(upload)
+    else:
+        for chunk in upload.chunks():
+            digest.update(chunk)
+    digest.update(pipeline_name(steps).encode())
+    digest.update(model_version(steps).encode())
+    digest.update(json.dumps(params or {}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def lookup(key: str):
+    """Return the ProcessedResult for ``key`` and mark it as recently used, or None."""
+    if not settings.AI_RESULT_CACHE_ENABLED:
+        return None
+    entry = ProcessedResult.objects.filter(key=key).first()
+    if entry is None:
+        RESULT_CACHE_LOOKUPS.labels('miss').inc()
+        return None
+    ProcessedResult.objects.filter(pk=entry.pk).update(
+        hits=F('hits') + 1,
+        last_used_at=timezone.now(),
+    )
+    RESULT_CACHE_LOOKUPS.labels('hit').inc()
+    return entry
+
+
+def store(key: str, steps, original_name: str, processed_name: str, derivatives=()) -> None:
+    """
+    Remember the stored files (and renditions) for ``key``.
+
+    Every EVICT_INTERVAL stores, the oldest entries over budget are evicted.
+    """
+    global _stores_since_evict
+    if not settings.AI_RESULT_CACHE_ENABLED:
+        return
+    try:
+        ProcessedResult.objects.create(
+            key=key,
+            feature=pipeline_name(steps),
+            model_version=model_version(steps),
+            original_image=original_name,
+            processed_image=processed_name,
+            derivatives=list(derivatives),
+        )
+    except IntegrityError:
+        # A concurrent request stored the same result first
+        return
+    _stores_since_evict += 1
+    if _stores_since_evict >= EVICT_INTERVAL:
+        _stores_since_evict = 0
+        evict(settings.AI_RESULT_CACHE_MAX_ENTRIES)
+
+
+def evict(max_entries: int) -> int:
+    """Delete least-recently-used entries beyond ``max_entries``."""
+    excess = ProcessedResult.objects.count() - max_entries
+    if excess <= 0:
+        return 0
+    stale = ProcessedResult.objects.order_by('last_used_at').values_list('pk', flat=True)[:excess]
+    deleted, _ = ProcessedResult.objects.filter(pk__in=list(stale)).delete()
+    return deleted
+
+
+def invalidate(feature=None) -> int:
+    """
+    Drop cached results made by an outdated model version.
+
+    With ``feature`` given, drop every entry whose pipeline has that exact
+    step instead.
+    """
+    if feature is not None:
+        deleted, _ = ProcessedResult.objects.filter(
+            Q(feature=feature)
+            | Q(feature__startswith=f"{feature}+")
+            | Q(feature__endswith=f"+{feature}")
+            | Q(feature__contains=f"+{feature}+")
+        ).delete()
+        return deleted
+    deleted = 0
+    pipelines = ProcessedResult.objects.values_list('feature', flat=True).distinct()
+    for name in list(pipelines):
+        current = model_version(name.split('+'))
+        count, _ = ProcessedResult.objects.filter(feature=name).exclude(model_version=current).delete()
+        deleted += count
+    return deleted
+
+
+def _lookups() -> dict:
+    """Lookups by result, summed over every process on the node."""
+    counts = {'hit': 0, 'miss': 0}
+    for metric in multiprocess.MultiProcessCollector(None).collect():
+        if metric.name != LOOKUPS_COUNTER:
+            continue
+        for sample in metric.samples:
+            if sample.name.endswith('_total'):
+                counts[sample.labels['result']] += int(sample.value)
+    return counts
+
+
+def stats() -> dict:
+    lookups = _lookups()
+    return {
+        'hits': lookups['hit'],
+        'misses': lookups['miss'],
+        'entries': ProcessedResult.objects.count(),
+        'max_entries': settings.AI_RESULT_CACHE_MAX_ENTRIES,
+    }
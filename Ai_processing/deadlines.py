@@ -0,0 +1,73 @@
+"""
+Deadlines for synchronous processing requests.
+
+A client that gives up after N seconds can say so: the ``X-Deadline-Ms``
+header or the ``deadline_ms`` field, in milliseconds from when the view
+starts handling the request (AI_DEFAULT_DEADLINE_MS when neither is sent; 0
+means no deadline). The deadline travels in a context variable, like the
+stage timer, so the pipeline doesn't need an extra argument.
+
+``check(stage)`` is called between stages, pipeline steps and tiles; once
+the deadline has passed it raises ``DeadlineExceeded`` and the request
+stops there, before anything is stored. Work already running (one model
+call, tiles a pool worker has started) finishes first; tiles not yet
+started are cancelled. Outside a request with a deadline, e.g. in job
+workers, ``check`` does nothing.
+
+Before inference, ``quality.plan`` uses ``remaining`` to drop to a cheaper
+quality tier when the requested one would not finish in time.
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+HEADER = 'X-Deadline-Ms'
+
+_current = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed; ``stage`` is where the work stopped."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        super().__init__(f"Deadline exceeded ({stage}).")
+
+
+def parse_header(value):
+    """Milliseconds from an ``X-Deadline-Ms`` header, or None when absent."""
+    if value is None:
+        return None
+    milliseconds = int(value)
+    if milliseconds <= 0:
+        raise ValueError(value)
+    return milliseconds
+
+
+@contextmanager
+def deadline(milliseconds):
+    """Give the ``with`` block a deadline ``milliseconds`` from now (none if falsy)."""
+    if not milliseconds:
+        yield
+        return
+    token = _current.set(time.monotonic() + milliseconds / 1000)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def remaining():
+    """Seconds until the current deadline (negative once passed), or None without one."""
+    expires = _current.get()
+    if expires is None:
+        return None
+    return expires - time.monotonic()
+
+
+def check(stage: str) -> None:
+    """Raise DeadlineExceeded if the current deadline has passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(stage)
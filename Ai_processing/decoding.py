@@ -0,0 +1,68 @@
+"""
+Single-pass upload validation and decoding.
+
+``open_upload`` checks the byte size, then reads only the image header to
+check the format and pixel count, so oversized or bogus uploads are rejected
+before any pixel data is decoded. ``decode_image`` does the one full decode,
+using JPEG draft mode to decode at a reduced scale when the pipeline does not
+need full resolution. The upload object itself is later handed to storage,
+so the original bytes are never copied in Python.
+"""
+
+from django.conf import settings
+from PIL import Image
+
+
+class UploadRejected(ValueError):
+    """The upload is not an acceptable image; ``code`` says why."""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+def open_upload(upload, max_bytes=None, max_pixels=None) -> Image.Image:
+    """
+    Open an uploaded file lazily and enforce the size limits.
+
+    Returns a PIL Image whose pixels are not decoded yet.
+
+    Raises:
+        UploadRejected: If the file is too big, not an image, or has too many pixels.
+    """
+    max_bytes = settings.AI_MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    max_pixels = settings.AI_MAX_IMAGE_PIXELS if max_pixels is None else max_pixels
+
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadRejected('too_large', f"Image file is too large (max {max_bytes} bytes).")
+
+    upload.seek(0)
+    try:
+        image = Image.open(upload)  # reads the header only
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        raise UploadRejected(
+            'invalid_image',
+            "Upload a valid image. The file you uploaded was either not an image or a corrupted image.",
+        )
+
+    if image.width * image.height > max_pixels:
+        raise UploadRejected('too_many_pixels', f"Image has too many pixels (max {max_pixels}).")
+    return image
+
+
+def decode_image(image: Image.Image, max_side=None) -> Image.Image:
+    """
+    Fully decode an image opened by ``open_upload``.
+
+    For JPEG, when ``max_side`` is smaller than the image, the decoder's draft
+    mode scales by 1/2, 1/4 or 1/8 while decoding (never below ``max_side``),
+    which is much cheaper than decoding everything and resizing afterwards.
+
+    Raises:
+        OSError: If the pixel data is truncated or corrupt.
+    """
+    if max_side and image.format == 'JPEG' and max(image.size) > max_side:
+        ratio = max_side / max(image.size)
+        image.draft(image.mode, (max(1, int(image.width * ratio)), max(1, int(image.height * ratio))))
+    image.load()
+    return image
@@ -0,0 +1,145 @@
+"""
+Thumbnail renditions ("derivatives") of processed images.
+
+Every size in AI_DERIVATIVE_SIZES is a bound on the long side, in pixels.
+All renditions come from one decoded image: the largest is resized from the
+source and each smaller one from the previous rendition, so the source is
+decoded once and the full-size pixels are walked only once. They are
+encoded as WebP and listed on ``User_History.derivatives``.
+
+With AI_DERIVATIVES_EAGER, renditions are made while the image is processed,
+in parallel with the main encode, and uploaded together with the result.
+Rows without them (older rows, tiled results, batch items) get them lazily:
+serializing the row schedules ``generate_for_history`` in the background,
+and ``manage.py backfill_derivatives`` fills in existing rows. A cached
+result keeps its renditions, so rows made from a cache hit share them.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from user_history.models import User_History
+
+from .encoding import encode_image
+from .models import ProcessedResult
+from .storage import run_in_background, upload_files
+
+DERIVATIVES_DIR = 'user_history/derivatives/'
+# Lazy generation is scheduled at most once per row in this window (seconds)
+PENDING_TIMEOUT = 600
+
+_pool = None
+
+
+def render_derivatives(image: Image.Image) -> list:
+    """
+    Render every configured size smaller than ``image``.
+
+    An image smaller than the largest size gets that slot at its own size,
+    so every image has at least one rendition.
+
+    Returns ``[(size, (width, height), webp bytes)]``, smallest first.
+    """
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    output = {'format': 'webp', 'quality': settings.AI_DERIVATIVE_QUALITY}
+
+    renditions = []
+    current = image
+    for size in sorted(settings.AI_DERIVATIVE_SIZES, reverse=True):
+        if size >= max(current.size):
+            if not renditions:
+                renditions.append((size, current.size, encode_image(current, output)))
+            continue
+        scale = size / max(current.size)
+        target = (max(1, round(current.width * scale)), max(1, round(current.height * scale)))
+        current = current.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        renditions.append((size, current.size, encode_image(current, output)))
+    return renditions[::-1]
+
+
+def derivative_uploads(storage, base_name: str, renditions):
+    """
+    ``upload_files`` items and the matching ``User_History.derivatives`` entries.
+
+    The stored names are filled into the entries by ``with_names`` once the
+    uploads are done.
+    """
+    items, entries = [], []
+    for size, (width, height), data in renditions:
+        name = f"{DERIVATIVES_DIR}{base_name}_{size}.webp"
+        items.append((storage, name, ContentFile(data, name=name)))
+        entries.append({'size': size, 'width': width, 'height': height})
+    return items, entries
+
+
+def with_names(entries, names) -> list:
+    return [{**entry, 'name': name} for entry, name in zip(entries, names)]
+
+
+def generate_for_history(history_pk) -> bool:
+    """
+    Make, upload and record the renditions of one row's processed image.
+
+    Returns False when the row is gone, already has renditions or has no
+    processed image.
+    """
+    history = User_History.objects.filter(pk=history_pk).first()
+    if history is None or history.derivatives or not history.restored_image:
+        return False
+
+    largest = max(settings.AI_DERIVATIVE_SIZES)
+    with history.restored_image.open('rb') as stored:
+        image = Image.open(stored)
+        # JPEG results can be decoded straight at a reduced scale
+        image.draft(image.mode, (largest, largest))
+        image.load()
+    renditions = render_derivatives(image)
+
+    storage = history.restored_image.storage
+    base_name = os.path.splitext(os.path.basename(history.restored_image.name))[0]
+    items, entries = derivative_uploads(storage, base_name, renditions)
+    derivatives = with_names(entries, upload_files(items))
+    User_History.objects.filter(pk=history_pk).update(derivatives=derivatives)
+    # Later cache hits on this result reuse them
+    ProcessedResult.objects.filter(processed_image=history.restored_image.name, derivatives=[]).update(
+        derivatives=derivatives
+    )
+    history.derivatives = derivatives
+    return True
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='derivatives')
+    return _pool
+
+
+def request_derivatives(history) -> None:
+    """Schedule lazy generation for a row that has no renditions yet."""
+    if history.derivatives or not history.restored_image:
+        return
+    if not cache.add(f"derivatives-pending:{history.pk}", 1, timeout=PENDING_TIMEOUT):
+        return
+    # Not on the upload pool: generate_for_history waits on uploads itself
+    run_in_background(generate_for_history, history.pk, pool=_get_pool())
+
+
+def srcset(history, request=None):
+    """``srcset``-style string for the row's renditions, or None."""
+    if not history.derivatives:
+        return None
+    storage = history.restored_image.storage
+    candidates = []
+    for entry in history.derivatives:
+        url = storage.url(entry['name'])
+        if not url.startswith('http') and request is not None:
+            url = request.build_absolute_uri(url)
+        candidates.append(f"{url} {entry['width']}w")
+    return ', '.join(candidates)
@@ -0,0 +1,158 @@
+"""
+Direct-to-storage uploads.
+
+Instead of sending the image through a worker, a client asks for a ticket
+(``issue_ticket``), POSTs the file straight to the media storage as the
+ticket describes (see ``storage.presigned_upload``), and then queues a
+processing job with the ticket's ``reference``. The web tier only handles
+the small JSON requests; a job worker reads the object from storage, and
+the object stays there as the history entry's original, so it is never
+uploaded twice.
+
+Tickets are valid for AI_DIRECT_UPLOAD_TTL seconds and references for
+AI_DIRECT_UPLOAD_REFERENCE_TTL. A reference is signed for the user it was
+issued to and names one storage object, under ``direct/<user id>/``. It
+queues one job; another is only accepted after that one failed.
+
+When the file name's extension is one of FORMATS, the ticket and the
+reference carry that ``format``: Cloudinary stores the upload converted to
+it (its object names never have an extension), and the local stand-in,
+whose names do, only accepts a file in that format.
+
+The ticket only accepts FORMATS, and the local stand-in also rejects files
+over AI_MAX_UPLOAD_BYTES. Cloudinary can't limit the size of a signed
+upload, and a client could upload anything before the signature is
+checked, so both are checked again on the stored object: its size when the
+reference is resolved, size and format once more before it is decoded. An
+object over the limit is deleted.
+"""
+
+import os
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+
+from .decoding import UploadRejected, open_upload
+from .storage import presigned_upload
+
+REFERENCE_SALT = 'Ai_processing.direct_uploads.reference'
+# Formats a direct upload may have: Cloudinary's name -> Pillow's
+FORMATS = {
+    'jpg': 'JPEG',
+    'png': 'PNG',
+    'webp': 'WEBP',
+    'avif': 'AVIF',
+    'gif': 'GIF',
+    'bmp': 'BMP',
+    'tiff': 'TIFF',
+}
+# Other spellings of FORMATS' extensions
+EXTENSION_ALIASES = {'jpeg': 'jpg', 'tif': 'tiff'}
+
+
+class DirectUploadError(ValueError):
+    """
+    A reference or its object can't be used; ``code`` says why.
+
+    ``invalid`` (bad, expired or someone else's reference), ``missing``
+    (nothing uploaded), ``too_large``, ``format``, or the other codes of
+    ``decoding.UploadRejected``.
+    """
+
+    def __init__(self, message: str, code: str = 'invalid'):
+        super().__init__(message)
+        self.code = code
+
+
+def _too_large(name: str) -> DirectUploadError:
+    default_storage.delete(name)
+    return DirectUploadError(
+        f"Image file is too large (max {settings.AI_MAX_UPLOAD_BYTES} bytes).", 'too_large'
+    )
+
+
+def format_of(filename: str):
+    """The FORMATS key for ``filename``'s extension, or None."""
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    extension = EXTENSION_ALIASES.get(extension, extension)
+    return extension if extension in FORMATS else None
+
+
+def issue_ticket(user, filename: str) -> dict:
+    """An upload ticket for ``filename`` plus the reference to process it with."""
+    image_format = format_of(filename)
+    extension = f".{image_format}" if image_format else os.path.splitext(filename)[1].lower()
+    upload = presigned_upload(
+        default_storage,
+        f"direct/{user.pk}/{uuid.uuid4().hex}{extension}",
+        settings.AI_DIRECT_UPLOAD_TTL,
+        settings.AI_MAX_UPLOAD_BYTES,
+        FORMATS,
+        image_format,
+    )
+    reference = signing.dumps(
+        {'user': str(user.pk), 'name': upload.pop('name'), 'filename': filename, 'format': image_format},
+        salt=REFERENCE_SALT,
+    )
+    return {'upload': upload, 'reference': reference, 'expires_in': settings.AI_DIRECT_UPLOAD_TTL}
+
+
+def resolve(user, reference: str) -> dict:
+    """
+    The stored object behind ``reference``: ``{'name', 'filename', 'format'}``.
+
+    Raises:
+        DirectUploadError: If the reference is not valid for ``user``, nothing
+            was uploaded for it or the object is too large.
+    """
+    try:
+        payload = signing.loads(
+            reference, salt=REFERENCE_SALT, max_age=settings.AI_DIRECT_UPLOAD_REFERENCE_TTL
+        )
+    except signing.SignatureExpired:
+        raise DirectUploadError("This upload reference has expired.")
+    except signing.BadSignature:
+        raise DirectUploadError("Invalid upload reference.")
+    if payload['user'] != str(user.pk):
+        raise DirectUploadError("Invalid upload reference.")
+
+    try:
+        size = default_storage.size(payload['name'])
+    except OSError:
+        size = None
+    if size is None:
+        raise DirectUploadError("Nothing has been uploaded for this reference.", 'missing')
+    if size > settings.AI_MAX_UPLOAD_BYTES:
+        raise _too_large(payload['name'])
+    return payload
+
+
+def open_object(name: str) -> File:
+    """
+    The uploaded object ``name``, opened for reading after checking its size and format.
+
+    Raises:
+        DirectUploadError: If nothing was uploaded, or the object is too
+            large or not an image in one of FORMATS.
+    """
+    try:
+        stored = File(default_storage.open(name, 'rb'), name=name)
+    except (OSError, ValueError):
+        raise DirectUploadError("Nothing has been uploaded for this reference.", 'missing')
+    try:
+        image = open_upload(stored)
+    except UploadRejected as e:
+        stored.close()
+        if e.code == 'too_large':
+            raise _too_large(name)
+        raise DirectUploadError(str(e), e.code)
+    if image.format not in FORMATS.values():
+        stored.close()
+        raise DirectUploadError(
+            f"Upload an image in one of these formats: {', '.join(FORMATS)}.", 'format'
+        )
+    stored.seek(0)
+    return stored
@@ -0,0 +1,134 @@
+"""
+Output encoding for processed images.
+
+An output spec is a small dict, for example::
+
+    {"format": "webp", "quality": 80, "compress_level": 1}
+
+``format`` is one of OUTPUT_FORMATS. ``quality`` (1-100) applies to the
+lossy formats and ``compress_level`` (0-9, zlib level) to PNG. JPEG is
+written progressive, and WebP/AVIF keep transparency.
+
+Encoding runs on a shared thread pool rather than on the request thread.
+Pillow releases the GIL while encoding, so several encodes run in parallel
+and the number running at once stays bounded by ``AI_ENCODE_WORKERS``.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, features
+
+# name -> (PIL format, content type, file extension)
+OUTPUT_FORMATS = {
+    'png': ('PNG', 'image/png', 'png'),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'avif': ('AVIF', 'image/avif', 'avif'),
+}
+
+# Tie-break order for Accept negotiation: smallest files that encode quickly first
+NEGOTIATION_ORDER = ['webp', 'avif', 'jpeg', 'png']
+
+_pool = None
+
+
+def available_formats() -> list:
+    """Formats this Pillow build can write (AVIF and WebP need their codecs)."""
+    return [
+        name for name in OUTPUT_FORMATS
+        if name not in ('webp', 'avif') or features.check(name)
+    ]
+
+
+def default_output() -> dict:
+    return {
+        'format': settings.AI_OUTPUT_FORMAT,
+        'quality': settings.AI_OUTPUT_QUALITY,
+        'compress_level': settings.AI_PNG_COMPRESS_LEVEL,
+    }
+
+
+def negotiate_format(accept: str):
+    """
+    Pick an output format from an ``Accept`` header, or None.
+
+    Only explicit image types count (``image/*`` and ``*/*`` say nothing
+    about a preference); the highest q-value wins and ties go by
+    NEGOTIATION_ORDER. Types with q=0 are excluded.
+    """
+    by_type = {content_type: name for name, (_, content_type, _) in OUTPUT_FORMATS.items()}
+    available = available_formats()
+    candidates = []
+    for media_range in (accept or '').split(','):
+        content_type, _, params = media_range.strip().partition(';')
+        name = by_type.get(content_type.strip().lower())
+        if name is None or name not in available:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            candidates.append((-q, NEGOTIATION_ORDER.index(name), name))
+    return min(candidates)[2] if candidates else None
+
+
+def extension(output: dict) -> str:
+    return OUTPUT_FORMATS[output['format']][2]
+
+
+def format_from_name(name: str):
+    """Output format of a stored file, from its extension."""
+    suffix = name.rsplit('.', 1)[-1].lower()
+    return next((fmt for fmt, (_, _, ext) in OUTPUT_FORMATS.items() if ext == suffix), None)
+
+
+def encode_image(image: Image.Image, output=None) -> bytes:
+    """Encode a PIL Image according to an output spec and return the bytes."""
+    output = {**default_output(), **(output or {})}
+    name = output['format']
+    pil_format = OUTPUT_FORMATS[name][0]
+    has_alpha = 'A' in image.getbands()
+    buffer = BytesIO()
+
+    if name == 'png':
+        image.save(buffer, format=pil_format, compress_level=output['compress_level'])
+    elif name == 'jpeg':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(buffer, format=pil_format, quality=output['quality'], progressive=True, optimize=True)
+    else:
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        image.save(buffer, format=pil_format, quality=output['quality'])
+    return buffer.getvalue()
+
+
+def get_encode_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=settings.AI_ENCODE_WORKERS, thread_name_prefix='encode')
+    return _pool
+
+
+def _timed_encode(image, output):
+    started = time.perf_counter()
+    data = encode_image(image, output)
+    return data, time.perf_counter() - started
+
+
+def encode_in_pool(image: Image.Image, output=None):
+    """
+    Encode on the shared encode pool and wait for the result.
+
+    Returns ``(bytes, seconds)``; the time covers the encode only, not
+    the wait for a free pool thread.
+    """
+    return get_encode_pool().submit(_timed_encode, image, output).result()
@@ -0,0 +1,97 @@
+"""
+BASIC_FILTER engine.
+
+A filter spec is a dict of adjustments, for example::
+
+    {"brightness": 0.1, "contrast": 1.2, "gamma": 0.9,
+     "saturation": 1.3, "sharpen": 0.5, "white_balance": -0.2}
+
+All per-channel point operations (white balance, brightness, contrast,
+gamma) are folded into a single 256-entry lookup table per channel and
+applied in one pass with ``Image.point``. Saturation and sharpening depend on
+neighbouring channels or pixels, so they run as NumPy array operations over
+horizontal strips, which keeps float32 temporaries small on large images.
+"""
+
+import numpy as np
+from PIL import Image
+
+# name -> (neutral value, min, max)
+FILTER_RANGES = {
+    'brightness': (0.0, -1.0, 1.0),     # added to every channel, in 0..1 units
+    'contrast': (1.0, 0.0, 3.0),        # scale around mid-gray
+    'gamma': (1.0, 0.1, 5.0),           # > 1 brightens shadows
+    'saturation': (1.0, 0.0, 3.0),      # 0 = grayscale
+    'sharpen': (0.0, 0.0, 3.0),         # unsharp-mask amount
+    'white_balance': (0.0, -1.0, 1.0),  # negative = cooler, positive = warmer
+}
+
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+STRIP_ROWS = 256
+
+
+def normalize_spec(spec) -> dict:
+    """Fill in neutral values for missing adjustments."""
+    spec = spec or {}
+    return {name: float(spec.get(name, neutral)) for name, (neutral, _, _) in FILTER_RANGES.items()}
+
+
+def build_lut(spec: dict) -> np.ndarray:
+    """Fold the point operations into a (3, 256) uint8 lookup table."""
+    x = np.tile(np.arange(256, dtype=np.float32) / 255.0, (3, 1))
+
+    warmth = spec['white_balance'] * 0.2
+    x *= np.array([1 + warmth, 1.0, 1 - warmth], dtype=np.float32)[:, None]
+    x += spec['brightness']
+    x = (x - 0.5) * spec['contrast'] + 0.5
+    x = np.clip(x, 0.0, 1.0) ** (1.0 / spec['gamma'])
+
+    return np.rint(x * 255.0).astype(np.uint8)
+
+
+def _box_blur(strip: np.ndarray) -> np.ndarray:
+    """3x3 box blur of a float32 (rows, width, 3) array, edges replicated."""
+    padded = np.pad(strip, ((0, 0), (1, 1), (0, 0)), mode='edge')
+    horizontal = padded[:, :-2] + padded[:, 1:-1] + padded[:, 2:]
+    padded = np.pad(horizontal, ((1, 1), (0, 0), (0, 0)), mode='edge')
+    return (padded[:-2] + padded[1:-1] + padded[2:]) / 9.0
+
+
+def _apply_strip(pixels: np.ndarray, spec: dict) -> np.ndarray:
+    """Run saturation and sharpening on a (rows, width, 3) uint8 strip."""
+    saturation, sharpen = spec['saturation'], spec['sharpen']
+    values = pixels.astype(np.float32)
+    if saturation != 1.0:
+        gray = (values @ LUMA)[..., None]
+        values = gray + saturation * (values - gray)
+    if sharpen != 0.0:
+        values += sharpen * (values - _box_blur(values))
+    np.clip(values, 0.0, 255.0, out=values)
+    return np.rint(values).astype(np.uint8)
+
+
+def apply_filters(image: Image.Image, spec) -> Image.Image:
+    """Apply a filter spec to a PIL Image and return a new image."""
+    spec = normalize_spec(spec)
+
+    alpha = image.getchannel('A') if 'A' in image.getbands() else None
+    # All point operations in one table lookup per pixel
+    result = image.convert('RGB').point(build_lut(spec).ravel().tolist())
+
+    if spec['saturation'] != 1.0 or spec['sharpen'] != 0.0:
+        pixels = np.asarray(result)
+        height = pixels.shape[0]
+        halo = 1 if spec['sharpen'] else 0
+
+        out = np.empty_like(pixels)
+        for top in range(0, height, STRIP_ROWS):
+            bottom = min(height, top + STRIP_ROWS)
+            # Sharpening reads one row above and below; process the halo and drop it
+            start, end = max(0, top - halo), min(height, bottom + halo)
+            strip = _apply_strip(pixels[start:end], spec)
+            out[top:bottom] = strip[top - start:top - start + (bottom - top)]
+        result = Image.fromarray(out, 'RGB')
+
+    if alpha is not None:
+        result.putalpha(alpha)
+    return result
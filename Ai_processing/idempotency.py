@@ -0,0 +1,205 @@
+"""
+Idempotency keys for processing requests.
+
+A client that may retry a request (e.g. a phone after a network blip)
+sends the same ``Idempotency-Key`` header each time. The first request
+with a key claims it: it inserts an ``IdempotencyKey`` row, unique per user
+and key, and runs. When it succeeds its response is stored on the row. A
+retry with that key then gets the stored response back, marked
+``Idempotent-Replayed: true``, without processing again or creating
+another history entry or stored file.
+
+A duplicate that arrives while the first request is still running polls
+the row for AI_IDEMPOTENCY_WAIT seconds (1 by default), enough for a retry
+that raced a fast request. After that it gets 409 with Retry-After rather
+than holding a web worker while the first one finishes. A claim whose
+request died (e.g. its worker was killed) is taken over after
+AI_IDEMPOTENCY_LOCK_TIMEOUT.
+Reusing a key with a different request (other path, fields or file) is 422.
+
+Only successful responses are kept. After an error (busy node, deadline
+passed, invalid input) the key is released, so a retry runs again.
+
+Keys expire AI_IDEMPOTENCY_TTL seconds after they are claimed. Expired rows
+are removed by one DELETE on the indexed ``expires_at``, run when a key is
+claimed but at most every PURGE_INTERVAL seconds per process.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.2
+PURGE_INTERVAL = 60
+
+_next_purge = 0.0
+
+
+class IdempotencyError(Exception):
+    """The request can't run under its key; ``status_code`` says why (409 or 422)."""
+
+    def __init__(self, status_code: int, message: str, retry_after: int = None):
+        self.status_code = status_code
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+def _file_digest(upload) -> str:
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+def fingerprint(request) -> str:
+    """SHA-256 of the request's method, path and fields, including the contents of uploaded files."""
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    data = request.data
+    if hasattr(data, 'lists'):
+        items = data.lists()
+    else:
+        items = ((name, value if isinstance(value, list) else [value]) for name, value in data.items())
+    for name, values in sorted(items, key=lambda item: item[0]):
+        for value in values:
+            if hasattr(value, 'read'):
+                part = f"file:{value.name}:{_file_digest(value)}"
+            else:
+                part = json.dumps(value, sort_keys=True, default=str)
+            digest.update(f"{name}={part}\n".encode())
+    return digest.hexdigest()
+
+
+def purge_expired() -> int:
+    """Delete expired keys; return how many."""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+def _maybe_purge() -> None:
+    global _next_purge
+    if time.monotonic() >= _next_purge:
+        _next_purge = time.monotonic() + PURGE_INTERVAL
+        purge_expired()
+
+
+def claim(user, key: str, request_fingerprint: str):
+    """
+    Claim ``key`` for a new run, or find the response of an earlier one.
+
+    Returns:
+        (row, replay): ``replay`` is True when ``row`` holds a stored response.
+
+    Raises:
+        IdempotencyError: If the key belongs to another request (422), or
+            its request is still running after AI_IDEMPOTENCY_WAIT (409).
+    """
+    _maybe_purge()
+    give_up = time.monotonic() + settings.AI_IDEMPOTENCY_WAIT
+    while True:
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                row = IdempotencyKey.objects.create(
+                    user=user,
+                    key=key,
+                    fingerprint=request_fingerprint,
+                    locked_at=now,
+                    expires_at=now + timedelta(seconds=settings.AI_IDEMPOTENCY_TTL),
+                )
+            return row, False
+        except IntegrityError:
+            pass
+
+        row = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if row is None:
+            # Released or purged in the meantime; claim it again
+            continue
+        if row.expires_at <= now:
+            IdempotencyKey.objects.filter(pk=row.pk, expires_at__lte=now).delete()
+            continue
+        if row.fingerprint != request_fingerprint:
+            raise IdempotencyError(
+                status.HTTP_422_UNPROCESSABLE_ENTITY,
+                f"This {HEADER} was already used with a different request.",
+            )
+        if row.status_code is not None:
+            return row, True
+
+        stale = now - timedelta(seconds=settings.AI_IDEMPOTENCY_LOCK_TIMEOUT)
+        if row.locked_at < stale:
+            # Only one of several waiters wins the takeover
+            taken = IdempotencyKey.objects.filter(
+                pk=row.pk, status_code__isnull=True, locked_at=row.locked_at
+            ).update(locked_at=now)
+            if taken:
+                logger.warning("Took over idempotency key %s abandoned since %s", row.pk, row.locked_at)
+                row.locked_at = now
+                return row, False
+            continue
+
+        if time.monotonic() >= give_up:
+            raise IdempotencyError(
+                status.HTTP_409_CONFLICT,
+                f"A request with this {HEADER} is still being processed.",
+                retry_after=settings.AI_ADMISSION_RETRY_AFTER,
+            )
+        time.sleep(POLL_INTERVAL)
+
+
+def complete(row: IdempotencyKey, response) -> None:
+    """Store a successful response for replay; release the key after anything else."""
+    if status.is_success(response.status_code) and getattr(response, 'data', None) is not None:
+        IdempotencyKey.objects.filter(pk=row.pk).update(status_code=response.status_code, response=response.data)
+    else:
+        release(row)
+
+
+def release(row: IdempotencyKey) -> None:
+    IdempotencyKey.objects.filter(pk=row.pk, status_code__isnull=True).delete()
+
+
+def idempotent(method):
+    """Decorate a view's ``post`` to honor the ``Idempotency-Key`` header."""
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"{HEADER} can be at most {MAX_KEY_LENGTH} characters."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            row, replay = claim(request.user, key, fingerprint(request))
+        except IdempotencyError as e:
+            headers = {'Retry-After': str(e.retry_after)} if e.retry_after else None
+            return Response({"error": str(e)}, status=e.status_code, headers=headers)
+        if replay:
+            return Response(row.response, status=row.status_code, headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = method(self, request, *args, **kwargs)
+        except BaseException:
+            release(row)
+            raise
+        complete(row, response)
+        return response
+    return wrapper
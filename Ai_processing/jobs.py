@@ -0,0 +1,186 @@
+"""
+Background processing jobs backed by the database.
+
+The web process calls ``enqueue_job`` and returns straight away. Worker
+processes started by ``python manage.py run_processing_workers`` call
+``claim_next_job`` / ``run_job`` in a loop. No broker other than the
+database and the local job spool directory is needed.
+"""
+
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import File
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import direct_uploads
+from .decoding import decode_image, open_upload
+from .encoding import extension
+from .models import ProcessingJob
+from .services import render_output, save_history
+from .utils import input_max_side
+
+logger = logging.getLogger(__name__)
+
+# Percent shown when each stage starts; 'processing' advances with tiles done
+STAGE_PROGRESS = {'decoding': 5, 'decoded': 10, 'processing': 15, 'encoding': 80, 'uploading': 85}
+# Tile counts are written at most this often (seconds), first and last tile always
+TILE_PROGRESS_INTERVAL = 0.5
+# How often each worker looks for RUNNING jobs whose worker died (seconds)
+REQUEUE_INTERVAL = 60
+
+
+def enqueue_job(user, uploaded_image, steps, options=None, output=None, quality=None,
+                source_name='') -> ProcessingJob:
+    """
+    Spool the upload to local disk and create a PENDING job for the pipeline steps.
+
+    With ``source_name`` (an object already in media storage, e.g. a direct
+    upload) pass no ``uploaded_image``: nothing is spooled, the worker reads
+    that object and it becomes the history entry's original as it is.
+    """
+    if uploaded_image is not None:
+        uploaded_image.seek(0)
+    return ProcessingJob.objects.create(
+        user=user,
+        feature=steps[-1],
+        pipeline=steps,
+        options=options or {},
+        output=output or {},
+        quality_tier=quality or settings.AI_DEFAULT_QUALITY_TIER,
+        image=uploaded_image,
+        source_name=source_name,
+    )
+
+
+def _set_stage(job: ProcessingJob, stage: str, progress: int, tiles_done: int = 0, tiles_total: int = 0) -> None:
+    job.stage = stage
+    job.progress = progress
+    ProcessingJob.objects.filter(pk=job.pk).update(
+        stage=stage,
+        progress=progress,
+        tiles_done=tiles_done,
+        tiles_total=tiles_total,
+    )
+
+
+def _stage_reporter(job: ProcessingJob):
+    """``progress`` callback for ``render_output`` that records the stage and tile counts."""
+    last_write = 0.0
+
+    def report(stage, done=0, total=0):
+        nonlocal last_write
+        now = time.monotonic()
+        if total and 1 < done < total and now - last_write < TILE_PROGRESS_INTERVAL:
+            return
+        last_write = now
+        progress = STAGE_PROGRESS[stage]
+        if total:
+            progress += (STAGE_PROGRESS['encoding'] - progress) * done // total
+        _set_stage(job, stage, progress, done, total)
+
+    return report
+
+
+def claim_next_job():
+    """
+    Atomically move the oldest PENDING job to RUNNING and return it.
+
+    The conditional UPDATE makes the claim safe when several workers race
+    for the same row, on both SQLite and PostgreSQL.
+    """
+    for job in ProcessingJob.objects.filter(status='PENDING').order_by('created_at')[:10]:
+        claimed = ProcessingJob.objects.filter(pk=job.pk, status='PENDING').update(
+            status='RUNNING',
+            started_at=timezone.now(),
+            stage='queued',
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job: ProcessingJob) -> None:
+    """Run the PROCESSING_FUNCTIONS pipeline for a claimed job and record the outcome."""
+    try:
+        steps = job.pipeline or [job.feature]
+        source = direct_uploads.open_object(job.source_name) if job.source_name else job.image.open('rb')
+        with source as spooled:
+            _set_stage(job, 'decoding', STAGE_PROGRESS['decoding'])
+            pil_image = decode_image(open_upload(File(spooled)), input_max_side(steps))
+            _set_stage(job, 'decoded', STAGE_PROGRESS['decoded'])
+
+            # Reports 'processing' (tile by tile when tiled) and 'encoding'
+            processed_file, report, renditions = render_output(
+                pil_image, steps, job.options, job.output,
+                progress=_stage_reporter(job), quality=job.quality_tier,
+            )
+
+            _set_stage(job, 'uploading', STAGE_PROGRESS['uploading'])
+            spooled.seek(0)
+            history = save_history(
+                job.user, File(spooled), processed_file, steps, extension(report),
+                renditions=renditions, quality=job.quality_tier,
+                stored_original=job.source_name or None,
+            )
+    except Exception as e:
+        logger.exception("Processing job %s failed", job.pk)
+        ProcessingJob.objects.filter(pk=job.pk).update(
+            status='FAILED',
+            error=str(e) or e.__class__.__name__,
+            finished_at=timezone.now(),
+        )
+        # A failed job is not retried, so nothing will read its input again
+        job.image.delete(save=False)
+        return
+
+    ProcessingJob.objects.filter(pk=job.pk).update(
+        status='COMPLETED',
+        stage='done',
+        progress=100,
+        output={**job.output, **report},
+        history=history,
+        finished_at=timezone.now(),
+    )
+    # The original now lives in permanent storage, drop the spooled copy
+    job.image.delete(save=False)
+
+
+def requeue_stale_jobs(timeout_seconds: int) -> int:
+    """Put RUNNING jobs whose worker died back in the queue."""
+    cutoff = timezone.now() - timedelta(seconds=timeout_seconds)
+    return ProcessingJob.objects.filter(status='RUNNING', started_at__lt=cutoff).update(
+        status='PENDING',
+        stage='',
+        progress=0,
+        tiles_done=0,
+        tiles_total=0,
+        started_at=None,
+    )
+
+
+def work_forever(poll_interval: float, stop_event=None) -> None:
+    """
+    Worker loop: claim and run jobs until ``stop_event`` is set.
+
+    Every REQUEUE_INTERVAL seconds it also requeues jobs that have been
+    RUNNING for longer than AI_JOB_TIMEOUT, so the job of a worker that
+    died mid-run is picked up again without a restart.
+    """
+    next_requeue = 0.0
+    while stop_event is None or not stop_event.is_set():
+        close_old_connections()
+        if time.monotonic() >= next_requeue:
+            next_requeue = time.monotonic() + REQUEUE_INTERVAL
+            requeued = requeue_stale_jobs(settings.AI_JOB_TIMEOUT)
+            if requeued:
+                logger.warning("Requeued %d stale job(s)", requeued)
+        job = claim_next_job()
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
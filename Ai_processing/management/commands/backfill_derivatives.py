@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from Ai_processing.derivatives import generate_for_history
+from user_history.models import User_History
+
+
+def _generate(history_pk):
+    try:
+        return generate_for_history(history_pk), None
+    except Exception as e:
+        return False, e
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnail renditions for history entries that have none."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help="Rows fetched from the database at a time.",
+        )
+        parser.add_argument('--workers', type=int, default=4, help="Rows processed in parallel.")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many rows.")
+
+    def handle(self, *args, **options):
+        generated = failed = seen = 0
+        last_pk = 0
+        limit = options['limit']
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            while limit is None or seen < limit:
+                # Keyset pagination: one small query per chunk, never the whole table
+                size = options['chunk_size'] if limit is None else min(options['chunk_size'], limit - seen)
+                chunk = list(
+                    User_History.objects
+                    .filter(pk__gt=last_pk, derivatives=[])
+                    .exclude(restored_image='')
+                    .order_by('pk')
+                    .values_list('pk', flat=True)[:size]
+                )
+                if not chunk:
+                    break
+                last_pk = chunk[-1]
+                seen += len(chunk)
+
+                for history_pk, (done, error) in zip(chunk, pool.map(_generate, chunk)):
+                    if error is not None:
+                        failed += 1
+                        self.stderr.write(f"History {history_pk}: {error}")
+                    elif done:
+                        generated += 1
+                self.stdout.write(f"Up to id {last_pk}: {generated} generated, {failed} failed")
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {generated} generated, {failed} failed"))
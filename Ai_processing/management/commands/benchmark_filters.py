@@ -0,0 +1,55 @@
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from Ai_processing.filters import apply_filters
+
+FILTER_CHAINS = {
+    'point (lut only)': {'brightness': 0.05, 'contrast': 1.2, 'gamma': 0.9, 'white_balance': 0.3},
+    'saturation': {'saturation': 1.4},
+    'sharpen': {'sharpen': 0.8},
+    'full chain': {
+        'brightness': 0.05, 'contrast': 1.2, 'gamma': 0.9, 'white_balance': 0.3,
+        'saturation': 1.4, 'sharpen': 0.8,
+    },
+}
+
+
+class Command(BaseCommand):
+    help = "Measure BASIC_FILTER throughput (megapixels per second) for several filter chains."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--megapixels',
+            type=float,
+            nargs='+',
+            default=[1, 4, 12],
+            help="Synthetic image sizes to test, in megapixels.",
+        )
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per chain and size.")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        self.stdout.write(f"{'chain':<20} {'size':>8} {'median ms':>10} {'MP/s':>8}")
+
+        for megapixels in options['megapixels']:
+            # 4:3 RGB noise image, the worst case for any compression-like shortcut
+            width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+            height = int(width * 3 / 4)
+            image = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), 'RGB')
+            actual_mp = width * height / 1_000_000
+
+            for name, spec in FILTER_CHAINS.items():
+                apply_filters(image, spec)  # warm-up
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    apply_filters(image, spec)
+                    timings.append(time.perf_counter() - started)
+                median = statistics.median(timings)
+                self.stdout.write(
+                    f"{name:<20} {actual_mp:>6.1f}MP {median * 1000:>10.1f} {actual_mp / median:>8.1f}"
+                )
@@ -0,0 +1,177 @@
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+
+from Ai_processing.backends import load_onnx_model, quantize
+from Ai_processing.management.commands.benchmark_pipeline import synthetic_image
+from Ai_processing.utils import MODEL_LOADERS
+
+# Channels of the synthetic residual CNN: 3 -> 16 -> 16 -> 3, 3x3 convolutions
+SYNTHETIC_CHANNELS = (3, 16, 16, 3)
+
+
+def synthetic_weights(seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    layers = []
+    for index, (inputs, outputs) in enumerate(zip(SYNTHETIC_CHANNELS, SYNTHETIC_CHANNELS[1:])):
+        scale = np.sqrt(2 / (inputs * 9))
+        if index == len(SYNTHETIC_CHANNELS) - 2:
+            # Keep the residual small so outputs stay near the input
+            scale *= 0.1
+        weight = (rng.standard_normal((outputs, inputs, 3, 3)) * scale).astype(np.float32)
+        bias = (rng.standard_normal(outputs) * 0.01).astype(np.float32)
+        layers.append((weight, bias))
+    return layers
+
+
+def _conv3x3(x: np.ndarray, weight: np.ndarray, bias: np.ndarray) -> np.ndarray:
+    padded = np.pad(x, ((0, 0), (0, 0), (1, 1), (1, 1)))
+    windows = sliding_window_view(padded, (3, 3), axis=(2, 3))
+    return np.einsum('nchwij,ocij->nohw', windows, weight, optimize=True) + bias[None, :, None, None]
+
+
+class NumpyResidualCNN:
+    """The synthetic network as plain NumPy: the Python path the ONNX model is compared with."""
+
+    def __init__(self, layers):
+        self.layers = layers
+
+    def __call__(self, image: Image.Image) -> Image.Image:
+        x = np.asarray(image.convert('RGB'), dtype=np.float32).transpose(2, 0, 1)[None] / 255
+        y = x
+        for index, (weight, bias) in enumerate(self.layers):
+            y = _conv3x3(y, weight, bias)
+            if index < len(self.layers) - 1:
+                y = np.maximum(y, 0)
+        y = np.clip((x + y)[0].transpose(1, 2, 0) * 255 + 0.5, 0, 255).astype(np.uint8)
+        return Image.fromarray(y, 'RGB')
+
+
+def write_synthetic_onnx(layers, path: Path) -> None:
+    """The same network as an ONNX graph with dynamic batch, height and width."""
+    from onnx import TensorProto, helper, numpy_helper, save
+
+    nodes, initializers = [], []
+    current = 'input'
+    for index, (weight, bias) in enumerate(layers):
+        initializers += [numpy_helper.from_array(weight, f'w{index}'), numpy_helper.from_array(bias, f'b{index}')]
+        output = f'conv{index}'
+        nodes.append(helper.make_node('Conv', [current, f'w{index}', f'b{index}'], [output], pads=[1, 1, 1, 1]))
+        if index < len(layers) - 1:
+            nodes.append(helper.make_node('Relu', [output], [f'relu{index}']))
+            output = f'relu{index}'
+        current = output
+    nodes.append(helper.make_node('Add', ['input', current], ['output']))
+
+    shape = ['batch', 3, 'height', 'width']
+    graph = helper.make_graph(
+        nodes,
+        'synthetic_residual_cnn',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, shape)],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, shape)],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 17)])
+    model.ir_version = 8
+    save(model, str(path))
+
+
+def _time(func, image, repeat: int) -> tuple:
+    output = func(image)  # warm-up; builds the ONNX session
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(image)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), output
+
+
+def _max_diff(output: Image.Image, reference: Image.Image) -> int:
+    if output.size != reference.size:
+        return -1
+    a = np.asarray(output.convert('RGB'), dtype=np.int16)
+    b = np.asarray(reference.convert('RGB'), dtype=np.int16)
+    return int(np.abs(a - b).max())
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare ONNX Runtime (fp32 and int8, at several thread counts) with the plain "
+        "Python path for one model: a feature's configured models, or a synthetic CNN."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--feature',
+            choices=sorted(MODEL_LOADERS),
+            help="Benchmark this feature's Python model against its files in AI_ONNX_MODEL_DIR. "
+                 "Without it, a synthetic residual CNN runs in NumPy and as ONNX.",
+        )
+        parser.add_argument('--size', type=int, nargs=2, default=[512, 384], metavar=('WIDTH', 'HEIGHT'))
+        parser.add_argument('--repeat', type=int, default=10, help="Timed runs per case.")
+        parser.add_argument(
+            '--threads',
+            type=int,
+            nargs='+',
+            help="intra-op thread counts to try (default: 1, AI_ONNX_INTRA_OP_THREADS and the CPU count).",
+        )
+
+    def handle(self, *args, **options):
+        threads = options['threads'] or sorted({1, settings.AI_ONNX_INTRA_OP_THREADS, os.cpu_count() or 1})
+        width, height = options['size']
+        image = synthetic_image(width, height, seed=0)
+        megapixels = width * height / 1_000_000
+
+        with tempfile.TemporaryDirectory() as scratch:
+            python_model, onnx_paths = self._models(options['feature'], Path(scratch))
+            self.stdout.write(
+                f"{width}x{height}, {os.cpu_count()} CPUs, AI_ONNX_INTRA_OP_THREADS={settings.AI_ONNX_INTRA_OP_THREADS}"
+            )
+            self.stdout.write(f"{'path':<14} {'threads':>7} {'median ms':>10} {'MP/s':>8} {'max diff':>9}")
+
+            median, reference = _time(python_model, image, options['repeat'])
+            self.stdout.write(f"{'python':<14} {'-':>7} {median * 1000:>10.1f} {megapixels / median:>8.2f} {0:>9}")
+
+            for label, path in onnx_paths:
+                for count in threads:
+                    with override_settings(AI_ONNX_INTRA_OP_THREADS=count):
+                        model = load_onnx_model(path)
+                        median, output = _time(model, image, options['repeat'])
+                    self.stdout.write(
+                        f"{label:<14} {count:>7} {median * 1000:>10.1f} {megapixels / median:>8.2f} "
+                        f"{_max_diff(output, reference):>9}"
+                    )
+
+    def _models(self, feature, scratch: Path):
+        """The Python model and ``(label, path)`` of each ONNX model to compare."""
+        if feature:
+            directory = Path(settings.AI_ONNX_MODEL_DIR)
+            paths = [
+                (label, directory / f"{feature.lower()}{suffix}")
+                for label, suffix in (('onnx fp32', '.onnx'), ('onnx int8', '.int8.onnx'))
+            ]
+            paths = [(label, path) for label, path in paths if path.is_file()]
+            if not paths:
+                raise CommandError(f"No ONNX model for {feature} in {directory}.")
+            return MODEL_LOADERS[feature](), paths
+
+        try:
+            import onnx  # noqa: F401
+            import onnxruntime.quantization  # noqa: F401
+        except ImportError:
+            raise CommandError("The synthetic benchmark needs the onnxruntime and onnx packages.")
+        layers = synthetic_weights()
+        fp32 = scratch / 'synthetic.onnx'
+        int8 = scratch / 'synthetic.int8.onnx'
+        write_synthetic_onnx(layers, fp32)
+        quantize(fp32, int8, [synthetic_image(256, 192, seed=seed) for seed in range(1, 9)])
+        return NumpyResidualCNN(layers), [('onnx fp32', fp32), ('onnx int8', int8)]
@@ -0,0 +1,269 @@
+import json
+import platform
+import resource
+import shutil
+import time
+from io import BytesIO
+
+import django
+import numpy as np
+import PIL
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from Ai_processing.decoding import decode_image
+from Ai_processing.encoding import encode_image
+from Ai_processing.utils import PROCESSING_FUNCTIONS, process_image
+
+# Synthetic inputs are saved in these formats: name -> (PIL format, extension)
+INPUT_FORMATS = {
+    'jpeg': ('JPEG', 'jpg'),
+    'png': ('PNG', 'png'),
+    'webp': ('WEBP', 'webp'),
+}
+
+# BASIC_FILTER is a no-op without a spec, so benchmark a full chain
+FEATURE_OPTIONS = {
+    'BASIC_FILTER': {
+        'filters': {
+            'brightness': 0.05, 'contrast': 1.2, 'gamma': 0.9, 'white_balance': 0.3,
+            'saturation': 1.4, 'sharpen': 0.8,
+        },
+    },
+}
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def synthetic_image(width: int, height: int, seed: int) -> Image.Image:
+    """Smooth gradients plus sensor-like noise, so codecs see something photo-like."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        x / max(width - 1, 1),
+        y / max(height - 1, 1),
+        0.5 + 0.5 * np.sin((x + y) / 37.0),
+    ], axis=-1) * 200
+    noise = rng.normal(0, 12, (height, width, 3)).astype(np.float32)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), 'RGB')
+
+
+def _percentile(ordered, q: float) -> float:
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(timings, megapixels: float) -> dict:
+    ordered = sorted(timings)
+    total = sum(ordered)
+    summary = {
+        'runs': len(ordered),
+        'mean_ms': total / len(ordered) * 1000,
+        'min_ms': ordered[0] * 1000,
+        'max_ms': ordered[-1] * 1000,
+        'ops_per_s': len(ordered) / total if total else None,
+        'megapixels_per_s': megapixels * len(ordered) / total if total else None,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+    for q in PERCENTILES:
+        summary[f'p{q}_ms'] = _percentile(ordered, q) * 1000
+    return summary
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark decode, every processing feature, encode and the end-to-end "
+        "process view on synthetic images; optionally compare with a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            nargs='+',
+            default=['640x480', '1920x1080', '3840x2160'],
+            help="Synthetic image resolutions, as WIDTHxHEIGHT.",
+        )
+        parser.add_argument(
+            '--formats',
+            nargs='+',
+            default=list(INPUT_FORMATS),
+            choices=list(INPUT_FORMATS),
+            help="Formats the synthetic inputs are saved in (and encoded back to).",
+        )
+        parser.add_argument(
+            '--features',
+            nargs='+',
+            default=list(PROCESSING_FUNCTIONS),
+            choices=list(PROCESSING_FUNCTIONS),
+            help="Features to time one by one.",
+        )
+        parser.add_argument(
+            '--view-feature',
+            default='BASIC_FILTER',
+            choices=list(PROCESSING_FUNCTIONS),
+            help="Feature requested from the process view in the end-to-end runs.",
+        )
+        parser.add_argument('--repeat', type=int, default=10, help="Timed runs per case.")
+        parser.add_argument('--warmup', type=int, default=2, help="Untimed runs per case first.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic images.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--baseline', help="Compare against results saved earlier with --output.")
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.15,
+            help="Allowed p50 slowdown against the baseline before failing (0.15 = 15%%).",
+        )
+        parser.add_argument(
+            '--min-ms',
+            type=float,
+            default=1.0,
+            help="Cases faster than this in the baseline are shown but never fail (timer noise).",
+        )
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'AI_BENCHMARK', False):
+            raise CommandError(
+                "Run with DJANGO_SETTINGS_MODULE=API.settings_benchmark "
+                "(SQLite and local media storage in a scratch directory)."
+            )
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1.")
+        sizes = []
+        for size in options['sizes']:
+            try:
+                width, height = (int(side) for side in size.lower().split('x'))
+            except ValueError:
+                raise CommandError(f"Invalid size {size!r}, expected WIDTHxHEIGHT.")
+            sizes.append((width, height))
+
+        self.repeat = options['repeat']
+        self.warmup = options['warmup']
+        self.client = self._prepare_environment()
+        results = {}
+
+        self.stdout.write(f"{'case':<44} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>8} {'RSS MB':>8}")
+        for index, (width, height) in enumerate(sizes):
+            image = synthetic_image(width, height, options['seed'] + index)
+            megapixels = width * height / 1_000_000
+            label = f"{width}x{height}"
+
+            for name in options['formats']:
+                pil_format, ext = INPUT_FORMATS[name]
+                buffer = BytesIO()
+                image.save(buffer, pil_format)
+                data = buffer.getvalue()
+
+                self._record(results, f"decode {label} {name}", megapixels,
+                             lambda: decode_image(Image.open(BytesIO(data))))
+                self._record(results, f"encode {label} {name}", megapixels,
+                             lambda: encode_image(image, {'format': name}))
+                self._record(results, f"view {options['view_feature']} {label} {name}", megapixels,
+                             lambda: self._post(data, ext, options['view_feature'], name))
+
+            for feature in options['features']:
+                feature_options = FEATURE_OPTIONS.get(feature, {})
+                self._record(results, f"feature {feature} {label}", megapixels,
+                             lambda: process_image(image, feature, **feature_options))
+
+        report = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'pillow': PIL.__version__,
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'repeat': self.repeat,
+                'warmup': self.warmup,
+                'seed': options['seed'],
+            },
+            'peak_rss_mb': _peak_rss_mb(),
+            'results': results,
+        }
+        self.stdout.write(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['baseline']:
+            self._compare(results, options['baseline'], options['tolerance'], options['min_ms'])
+
+    def _prepare_environment(self) -> APIClient:
+        # Fresh scratch database and media directory on every run
+        shutil.rmtree(settings.AI_BENCHMARK_DIR, ignore_errors=True)
+        settings.AI_BENCHMARK_DIR.mkdir(parents=True)
+        call_command('migrate', run_syncdb=True, verbosity=0)
+
+        from users.models import User
+        user = User.objects.create_user(email='benchmark@example.com', username='benchmark', password=None)
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def _post(self, data: bytes, ext: str, feature: str, output_format: str):
+        payload = {
+            'image': SimpleUploadedFile(f"benchmark.{ext}", data),
+            'feature': feature,
+            'output_format': output_format,
+        }
+        if feature in FEATURE_OPTIONS:
+            payload['filters'] = json.dumps(FEATURE_OPTIONS[feature]['filters'])
+        response = self.client.post('/api/processing/process/', payload, format='multipart')
+        if response.status_code != 200:
+            raise CommandError(f"Process view returned {response.status_code}: {response.content[:200]!r}")
+
+    def _record(self, results: dict, case: str, megapixels: float, func) -> None:
+        for _ in range(self.warmup):
+            func()
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        summary = results[case] = summarize(timings, megapixels)
+        self.stdout.write(
+            f"{case:<44} {summary['p50_ms']:>9.1f} {summary['p95_ms']:>9.1f} {summary['p99_ms']:>9.1f} "
+            f"{summary['ops_per_s']:>8.1f} {summary['peak_rss_mb']:>8.1f}"
+        )
+
+    def _compare(self, results: dict, path: str, tolerance: float, min_ms: float) -> None:
+        with open(path) as f:
+            baseline = json.load(f)['results']
+
+        self.stdout.write(f"\n{'case':<44} {'base p50':>9} {'now p50':>9} {'change':>8}")
+        regressions = []
+        for case, current in results.items():
+            before = baseline.get(case)
+            if before is None:
+                self.stdout.write(f"{case:<44} {'-':>9} {current['p50_ms']:>9.1f} {'new':>8}")
+                continue
+            change = current['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0.0
+            line = f"{case:<44} {before['p50_ms']:>9.1f} {current['p50_ms']:>9.1f} {change:>+8.1%}"
+            if change > tolerance and before['p50_ms'] >= min_ms:
+                regressions.append(case)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        for case in baseline.keys() - results.keys():
+            self.stdout.write(f"{case:<44} (not measured in this run)")
+
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} case(s) slower than the baseline by more than {tolerance:.0%}: "
+                + ', '.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS(f"No p50 regressions beyond {tolerance:.0%}"))
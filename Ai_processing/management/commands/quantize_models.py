@@ -0,0 +1,82 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from Ai_processing.backends import quantize
+from Ai_processing.management.commands.benchmark_pipeline import synthetic_image
+from Ai_processing.utils import MODEL_LOADERS
+
+CALIBRATION_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Write an int8-quantized copy (<feature>.int8.onnx) of every feature's ONNX model "
+        "in AI_ONNX_MODEL_DIR; AI_ONNX_INT8=1 makes the onnx backend use them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--calibration-dir',
+            help="Directory of representative input images (default: synthetic images; "
+                 "real photos give better int8 accuracy).",
+        )
+        parser.add_argument('--calibration-count', type=int, default=16, help="Images to calibrate with.")
+        parser.add_argument(
+            '--calibration-size',
+            type=int,
+            nargs=2,
+            default=[256, 192],
+            metavar=('WIDTH', 'HEIGHT'),
+            help="Calibration images are resized to this size.",
+        )
+        parser.add_argument(
+            '--format',
+            choices=['qoperator', 'qdq'],
+            default='qoperator',
+            help="int8 graph format: fused QLinear* operators, or Quantize/DequantizeLinear pairs.",
+        )
+        parser.add_argument('--force', action='store_true', help="Overwrite existing int8 copies.")
+
+    def handle(self, *args, **options):
+        try:
+            import onnxruntime.quantization  # noqa: F401
+        except ImportError:
+            raise CommandError("Quantizing needs the onnxruntime and onnx packages.")
+
+        directory = Path(settings.AI_ONNX_MODEL_DIR)
+        sources = [
+            (feature, directory / f"{feature.lower()}.onnx")
+            for feature in MODEL_LOADERS
+            if (directory / f"{feature.lower()}.onnx").is_file()
+        ]
+        if not sources:
+            raise CommandError(f"No <feature>.onnx models in {directory}.")
+
+        size = tuple(options['calibration_size'])
+        images = self._calibration_images(options['calibration_dir'], options['calibration_count'], size)
+        for feature, source in sources:
+            target = directory / f"{feature.lower()}.int8.onnx"
+            if target.exists() and not options['force']:
+                self.stdout.write(f"{feature}: {target.name} exists, skipped (--force to redo)")
+                continue
+            quantize(source, target, images, options['format'])
+            self.stdout.write(
+                f"{feature}: {source.stat().st_size / 1e6:.1f} MB -> {target.stat().st_size / 1e6:.1f} MB"
+            )
+
+    def _calibration_images(self, directory, count: int, size) -> list:
+        if not directory:
+            return [synthetic_image(*size, seed=seed) for seed in range(count)]
+        paths = sorted(
+            path for path in Path(directory).iterdir() if path.suffix.lower() in CALIBRATION_EXTENSIONS
+        )[:count]
+        if not paths:
+            raise CommandError(f"No images in {directory}.")
+        images = []
+        for path in paths:
+            with Image.open(path) as image:
+                images.append(image.convert('RGB').resize(size, Image.BICUBIC))
+        return images
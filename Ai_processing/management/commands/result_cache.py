@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from Ai_processing import cache
+
+
+class Command(BaseCommand):
+    help = "Show result cache statistics, or invalidate entries after a model change."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--invalidate',
+            action='store_true',
+            help="Drop entries produced by an outdated model version (see MODEL_VERSIONS).",
+        )
+        parser.add_argument(
+            '--feature',
+            help="With --invalidate, drop every entry for this feature.",
+        )
+        parser.add_argument(
+            '--evict',
+            action='store_true',
+            help="Trim the cache down to AI_RESULT_CACHE_MAX_ENTRIES.",
+        )
+
+    def handle(self, *args, **options):
+        if options['invalidate']:
+            deleted = cache.invalidate(options['feature'])
+            self.stdout.write(self.style.SUCCESS(f"Invalidated {deleted} cached result(s)"))
+        if options['evict']:
+            deleted = cache.evict(settings.AI_RESULT_CACHE_MAX_ENTRIES)
+            self.stdout.write(self.style.SUCCESS(f"Evicted {deleted} cached result(s)"))
+
+        for name, value in cache.stats().items():
+            self.stdout.write(f"{name}: {value}")
@@ -0,0 +1,80 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from Ai_processing import shm
+from Ai_processing.jobs import requeue_stale_jobs, work_forever
+from Ai_processing.registry import preload_models
+
+# Seconds between checks for workers that died
+SUPERVISE_INTERVAL = 1.0
+
+
+def _worker_main(poll_interval, stop_event):
+    # Each worker needs its own database connection
+    connections.close_all()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    work_forever(poll_interval, stop_event)
+
+
+class Command(BaseCommand):
+    help = (
+        "Start a pool of worker processes that run queued image processing jobs, "
+        "restarting any that die."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.AI_JOB_WORKERS,
+            help="Number of worker processes (default: AI_JOB_WORKERS).",
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.AI_JOB_POLL_INTERVAL,
+            help="Seconds to sleep when the queue is empty.",
+        )
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs(settings.AI_JOB_TIMEOUT)
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+        shm.sweep_dead()
+
+        # Load models once here so the forked workers share them
+        if settings.AI_PRELOAD_MODELS:
+            preload_models()
+
+        # Close the parent's connection so forked workers don't share the socket
+        connections.close_all()
+
+        ctx = multiprocessing.get_context('fork')
+        stop_event = ctx.Event()
+
+        def start_worker():
+            # Not daemonic: workers start their own process pool for tiled super-resolution,
+            # which daemonic processes may not do. They stop via stop_event and are joined below.
+            worker = ctx.Process(target=_worker_main, args=(options['poll_interval'], stop_event))
+            worker.start()
+            return worker
+
+        workers = [start_worker() for _ in range(max(1, options['workers']))]
+        self.stdout.write(self.style.SUCCESS(f"Started {len(workers)} processing worker(s)"))
+
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        try:
+            while not stop_event.wait(SUPERVISE_INTERVAL):
+                for index, worker in enumerate(workers):
+                    if not worker.is_alive() and not stop_event.is_set():
+                        # Its job, if any, is requeued once it goes stale
+                        self.stderr.write(f"Processing worker {worker.pid} exited with {worker.exitcode}; restarting")
+                        workers[index] = start_worker()
+        except KeyboardInterrupt:
+            stop_event.set()
+        for worker in workers:
+            worker.join()
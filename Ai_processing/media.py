@@ -0,0 +1,173 @@
+"""
+Serving files from MEDIA_ROOT.
+
+``serve_media`` replaces ``django.views.static.serve``. It sends a strong
+ETag and Last-Modified and answers ``If-None-Match`` / ``If-Modified-Since``
+with 304. It serves single byte ranges (206, honouring ``If-Range``).
+Stored names are never reused or rewritten, so a file's size and mtime
+identify its content. The ETag is ``"<mtime hex>-<size hex>"``, the same
+value nginx computes, so validators stay the same once nginx serves the
+file. Names that carry a random or content hash
+(AI_MEDIA_IMMUTABLE_PATTERN) are cached for a year as ``immutable``; other
+names for AI_MEDIA_MAX_AGE seconds.
+
+With AI_MEDIA_ACCEL set, the worker only answers the conditional request
+and then hands the file to the front proxy, so it never streams image
+bytes itself:
+
+- ``x-accel-redirect`` (nginx) redirects to AI_MEDIA_ACCEL_PREFIX + path,
+  an ``internal`` location aliasing MEDIA_ROOT.
+- ``x-sendfile`` (Apache mod_xsendfile, lighttpd) passes the absolute path.
+"""
+
+import mimetypes
+import os
+import re
+import stat
+from functools import lru_cache
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+STREAM_BLOCK = 64 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+@lru_cache(maxsize=1)
+def _immutable_pattern(pattern: str):
+    return re.compile(pattern)
+
+
+def cache_control(path: str) -> str:
+    if settings.AI_MEDIA_IMMUTABLE_PATTERN and _immutable_pattern(settings.AI_MEDIA_IMMUTABLE_PATTERN).search(path):
+        return f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return f"public, max-age={settings.AI_MEDIA_MAX_AGE}"
+
+
+def _etag(st) -> str:
+    return f'"{int(st.st_mtime):x}-{st.st_size:x}"'
+
+
+def _not_modified(request, etag: str, mtime: int) -> bool:
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        # If-None-Match uses the weak comparison, and wins over If-Modified-Since
+        tags = parse_etags(if_none_match)
+        return '*' in tags or any(tag.removeprefix('W/') == etag for tag in tags)
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and mtime <= since
+
+
+def parse_range(header, size: int):
+    """
+    ``(start, end)`` (inclusive) for a single ``Range: bytes=...`` header.
+
+    Returns None when there is no usable range (missing, malformed or
+    several ranges), meaning the whole file is sent, and ``(None, None)``
+    when the range can't be satisfied.
+    """
+    match = _RANGE.match((header or '').strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return None, None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return None, None
+    return start, end
+
+
+def _read_range(path: str, start: int, length: int):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length:
+            block = f.read(min(STREAM_BLOCK, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def serve_media(request, path):
+    """GET/HEAD a file under MEDIA_ROOT (see the module docstring)."""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404("File not found.")
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404("File not found.")
+
+    mtime = int(st.st_mtime)
+    etag = _etag(st)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(mtime),
+        'Cache-Control': cache_control(path),
+        'Accept-Ranges': 'bytes',
+    }
+
+    if _not_modified(request, etag, mtime):
+        response = HttpResponse(status=304)
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+
+    accel = settings.AI_MEDIA_ACCEL
+    if accel:
+        # The proxy sends the body and handles Range itself
+        response = HttpResponse(content_type=content_type)
+        if accel == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = quote(settings.AI_MEDIA_ACCEL_PREFIX + path)
+        else:
+            response['X-Sendfile'] = fullpath
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range.strip() == etag:
+        byte_range = parse_range(request.headers.get('Range'), st.st_size)
+
+    if byte_range == (None, None):
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{st.st_size}"
+    elif byte_range is not None:
+        start, end = byte_range
+        length = end - start + 1
+        body = () if request.method == 'HEAD' else _read_range(fullpath, start, length)
+        response = StreamingHttpResponse(body, status=206, content_type=content_type)
+        response['Content-Range'] = f"bytes {start}-{end}/{st.st_size}"
+        response['Content-Length'] = str(length)
+    elif request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = str(st.st_size)
+    else:
+        # FileResponse lets WSGI servers use sendfile for the whole file
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    for name, value in headers.items():
+        response[name] = value
+    return response
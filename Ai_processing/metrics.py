@@ -0,0 +1,220 @@
+"""
+Prometheus metrics, aggregated across every process on the node.
+
+gunicorn workers, job workers and batch pool processes each write their
+samples to memory-mapped files in PROMETHEUS_MULTIPROC_DIR, using
+prometheus_client's multiprocess mode. settings.py points that variable at
+AI_METRICS_DIR. ``metrics_view`` merges the files on every scrape, so
+scraping any worker shows the whole node without an external service.
+The directory should be emptied when the server starts, which
+entrypoint.sh does. gunicorn.conf.py drops the live gauges of workers that
+exit.
+
+Some node-wide gauges are cheaper to read at scrape time than to track:
+admission slots and queue places, and unfinished background jobs.
+
+Request durations cover the view and middleware. A streaming response is
+counted when it starts, not when its stream ends.
+"""
+
+import contextvars
+import hmac
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.http import HttpResponse
+
+os.makedirs(settings.AI_METRICS_DIR, exist_ok=True)
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily  # noqa: E402
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+REQUESTS = Counter(
+    'api_pix_http_requests_total', "HTTP requests by endpoint, method and status.",
+    ['endpoint', 'method', 'status'],
+)
+REQUEST_SECONDS = Histogram(
+    'api_pix_http_request_duration_seconds', "HTTP request latency by endpoint.",
+    ['endpoint'], buckets=LATENCY_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    'api_pix_db_queries_per_request', "Database queries run by one request, by endpoint.",
+    ['endpoint'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+PROCESSING_SECONDS = Histogram(
+    'api_pix_processing_seconds', "Time to run one feature on one image, by quality tier.",
+    ['feature', 'quality'], buckets=LATENCY_BUCKETS,
+)
+PROCESSING_RATE = Histogram(
+    'api_pix_processing_seconds_per_megapixel', "Processing time per megapixel of input, by feature and quality tier.",
+    ['feature', 'quality'], buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+STAGE_SECONDS = Histogram(
+    'api_pix_stage_seconds', "Time per stage of a process request (as in Server-Timing).",
+    ['stage'], buckets=LATENCY_BUCKETS,
+)
+UPLOAD_SECONDS = Histogram(
+    'api_pix_storage_upload_seconds', "Time to save one file to media storage.",
+    ['storage'], buckets=LATENCY_BUCKETS,
+)
+INFERENCE_IN_FLIGHT = Gauge(
+    'api_pix_inference_in_flight', "Images being processed right now, by feature.",
+    ['feature'], multiprocess_mode='livesum',
+)
+MICROBATCH_SIZE = Histogram(
+    'api_pix_microbatch_size', "Calls run together in one micro-batch.",
+    ['feature'], buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32),
+)
+MICROBATCH_FILL = Histogram(
+    'api_pix_microbatch_fill_ratio', "Micro-batch size over AI_MICROBATCH_MAX_SIZE.",
+    ['feature'], buckets=(0.125, 0.25, 0.5, 0.75, 1.0),
+)
+MICROBATCH_WAIT = Histogram(
+    'api_pix_microbatch_wait_seconds', "Time a call waited for its micro-batch to start.",
+    ['feature'], buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+RESULT_CACHE_LOOKUPS = Counter(
+    'api_pix_result_cache_lookups_total', "Result cache lookups by result (hit or miss).",
+    ['result'],
+)
+
+# Mutable [count] of the current request's queries; a list so the threads
+# sync_to_async runs code in (which get a copy of the context) add to it
+_queries = contextvars.ContextVar('db_queries', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def _install_query_counter(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_install_query_counter)
+
+
+def _start_counting():
+    # Connections opened before this module was imported missed the signal
+    for connection in connections.all(initialized_only=True):
+        _install_query_counter(None, connection)
+    counter = [0]
+    return counter, _queries.set(counter)
+
+
+class MetricsMiddleware:
+    """Count and time every request, and count its database queries, per endpoint."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self._acall(request)
+        counter, token = _start_counting()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _queries.reset(token)
+        _observe(request, response, time.perf_counter() - started, counter[0])
+        return response
+
+    async def _acall(self, request):
+        counter, token = _start_counting()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _queries.reset(token)
+        _observe(request, response, time.perf_counter() - started, counter[0])
+        return response
+
+
+def _observe(request, response, seconds: float, queries: int) -> None:
+    match = request.resolver_match
+    # The route name keeps the label set small (no ids or paths)
+    endpoint = match.view_name if match is not None else 'unmatched'
+    REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+    REQUEST_SECONDS.labels(endpoint).observe(seconds)
+    DB_QUERIES.labels(endpoint).observe(queries)
+
+
+class NodeCollector:
+    """Gauges read at scrape time: admission slots and queues, unfinished jobs."""
+
+    def collect(self):
+        from .admission import stats as admission_stats
+        from .models import ProcessingJob
+
+        admission = admission_stats()
+        yield GaugeMetricFamily(
+            'api_pix_admission_slots', "Inference slots on this node.", value=admission['slots'],
+        )
+        yield GaugeMetricFamily(
+            'api_pix_admission_running', "Inference slots in use on this node.", value=admission['running'],
+        )
+        queued = GaugeMetricFamily(
+            'api_pix_admission_queued', "Requests waiting for an inference slot on this node.",
+            labels=['priority'],
+        )
+        queued.add_metric(['standard'], admission['queued'])
+        queued.add_metric(['premium'], admission['queued_premium'])
+        yield queued
+
+        jobs = GaugeMetricFamily('api_pix_jobs', "Unfinished background jobs by status.", labels=['status'])
+        counts = dict.fromkeys(['PENDING', 'RUNNING'], 0)
+        grouped = (
+            ProcessingJob.objects.filter(status__in=counts)
+            .order_by().values_list('status').annotate(count=Count('pk'))
+        )
+        counts.update(grouped)
+        for job_status, count in counts.items():
+            jobs.add_metric([job_status], count)
+        yield jobs
+
+
+def _may_scrape(request) -> bool:
+    token = settings.AI_METRICS_TOKEN
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return True
+    from .progress import authenticated_user
+
+    user = authenticated_user(request)
+    return user is not None and user.is_staff
+
+
+def metrics_view(request):
+    """
+    GET /metrics
+
+    Prometheus text format for every process on this node. Scrapers send
+    ``Authorization: Bearer <AI_METRICS_TOKEN>``; otherwise the request must
+    come from a staff user (with their usual JWT).
+    """
+    if not _may_scrape(request):
+        return HttpResponse(status=401)
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(NodeCollector())
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
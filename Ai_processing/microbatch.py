@@ -0,0 +1,251 @@
+"""
+Micro-batching of model calls across concurrent requests.
+
+A model that also exposes ``predict_batch(images) -> images`` runs much
+faster on a batch than on one image at a time. ``infer`` hands every call
+for such a model to that feature's ``MicroBatcher``. This is a background
+thread that gathers pending calls for up to AI_MICROBATCH_MAX_WAIT_MS, or
+until AI_MICROBATCH_MAX_SIZE are waiting. It then groups them into size
+buckets (each side rounded up to AI_MICROBATCH_BUCKET_PX) and runs each
+bucket through the model in one call. Images in a bucket are edge-padded to
+the bucket size and the outputs cropped back. Each caller gets its own
+result, or the exception, through a Future. A caller waits for it until its
+request's deadline (see ``deadlines``), or AI_MICROBATCH_TIMEOUT without
+one; a call that has not started by then is cancelled. A batcher whose
+thread died is replaced by the next call, and the calls it left queued move
+to the new one.
+
+Models without ``predict_batch`` are called directly, with no added wait.
+Batchers live in each process; ``stats()`` reports this process's batch
+sizes, fill ratios and queue waits.
+"""
+
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from . import deadlines
+from .metrics import MICROBATCH_FILL, MICROBATCH_SIZE, MICROBATCH_WAIT
+from .registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+class _Pending:
+    __slots__ = ('model', 'image', 'future', 'queued_at')
+
+    def __init__(self, model, image):
+        self.model = model
+        self.image = image
+        self.future = Future()
+        self.queued_at = time.monotonic()
+
+
+def _bucket(image: Image.Image, step: int):
+    return (
+        image.mode,
+        math.ceil(image.width / step) * step,
+        math.ceil(image.height / step) * step,
+    )
+
+
+def _pad(image: Image.Image, width: int, height: int) -> Image.Image:
+    """Extend ``image`` to ``width`` x ``height`` by repeating its edge pixels."""
+    if image.size == (width, height):
+        return image
+    pixels = np.asarray(image)
+    pad = [(0, height - image.height), (0, width - image.width)] + [(0, 0)] * (pixels.ndim - 2)
+    return Image.fromarray(np.pad(pixels, pad, mode='edge'), mode=image.mode)
+
+
+def _crop(output: Image.Image, source: Image.Image, padded_size) -> Image.Image:
+    """Cut the region that belongs to ``source`` out of a padded output (which may be scaled)."""
+    scale_x = output.width / padded_size[0]
+    scale_y = output.height / padded_size[1]
+    box = (0, 0, round(source.width * scale_x), round(source.height * scale_y))
+    return output if box[2:] == output.size else output.crop(box)
+
+
+class MicroBatcher:
+    """Collects calls for one feature's model and runs them in batches."""
+
+    def __init__(self, name: str, max_size: int, max_wait: float, bucket_px: int):
+        self.name = name
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.bucket_px = bucket_px
+        self._queue = queue.SimpleQueue()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+        self.fill_total = 0.0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._thread = threading.Thread(target=self._run, name=f"microbatch-{name}", daemon=True)
+        self._thread.start()
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def submit(self, model, image: Image.Image) -> Future:
+        pending = _Pending(model, image)
+        self._queue.put(pending)
+        return pending.future
+
+    def take_over(self, other: 'MicroBatcher') -> None:
+        """Queue the calls a dead batcher left behind on this one."""
+        while True:
+            try:
+                self._queue.put(other._queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _collect(self) -> list:
+        first = self._queue.get()
+        batch = [first]
+        deadline = first.queued_at + self.max_wait
+        while len(batch) < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _record(self, batch, started: float) -> None:
+        waits = [started - pending.queued_at for pending in batch]
+        with self._stats_lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.largest = max(self.largest, len(batch))
+            self.fill_total += len(batch) / self.max_size
+            self.wait_total += sum(waits)
+            self.wait_max = max(self.wait_max, *waits)
+        MICROBATCH_SIZE.labels(self.name).observe(len(batch))
+        MICROBATCH_FILL.labels(self.name).observe(len(batch) / self.max_size)
+        for wait in waits:
+            MICROBATCH_WAIT.labels(self.name).observe(wait)
+
+    def _run(self) -> None:
+        while True:
+            # Calls whose caller gave up (timed out) are dropped
+            batch = [pending for pending in self._collect() if pending.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._run_batch(batch)
+            except BaseException as e:
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+                if not isinstance(e, Exception):
+                    # The thread ends here; _get_batcher starts a new one
+                    raise
+                logger.exception("Micro-batch of %s failed", self.name)
+
+    def _run_batch(self, batch) -> None:
+        self._record(batch, time.monotonic())
+        groups = {}
+        for pending in batch:
+            groups.setdefault(_bucket(pending.image, self.bucket_px), []).append(pending)
+        for (_, width, height), group in groups.items():
+            self._run_group(group, width, height)
+
+    def _run_group(self, group, width: int, height: int) -> None:
+        model = group[0].model
+        try:
+            if len(group) == 1:
+                results = [model(group[0].image)]
+            else:
+                padded = [_pad(pending.image, width, height) for pending in group]
+                outputs = model.predict_batch(padded)
+                results = [
+                    _crop(output, pending.image, (width, height))
+                    for output, pending in zip(outputs, group)
+                ]
+        except Exception as e:
+            for pending in group:
+                pending.future.set_exception(e)
+            return
+        logger.debug("Ran %s on a batch of %d (%dx%d)", self.name, len(group), width, height)
+        for pending, result in zip(group, results):
+            pending.future.set_result(result)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            batches = self.batches or 1
+            items = self.items or 1
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': self.items / batches,
+                'max_batch_size': self.largest,
+                'mean_fill_ratio': self.fill_total / batches,
+                'mean_wait_ms': self.wait_total / items * 1000,
+                'max_wait_ms': self.wait_max * 1000,
+            }
+
+
+def _get_batcher(name: str) -> MicroBatcher:
+    batcher = _batchers.get(name)
+    if batcher is None or not batcher.is_alive():
+        with _batchers_lock:
+            batcher = _batchers.get(name)
+            if batcher is None or not batcher.is_alive():
+                dead = batcher
+                batcher = _batchers[name] = MicroBatcher(
+                    name,
+                    settings.AI_MICROBATCH_MAX_SIZE,
+                    settings.AI_MICROBATCH_MAX_WAIT_MS / 1000,
+                    settings.AI_MICROBATCH_BUCKET_PX,
+                )
+                if dead is not None:
+                    logger.warning("Restarted the micro-batcher for %s", name)
+                    batcher.take_over(dead)
+    return batcher
+
+
+def _reset_after_fork() -> None:
+    # Batcher threads do not survive a fork; the child starts its own on demand
+    global _batchers_lock
+    _batchers.clear()
+    _batchers_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def infer(name: str, image: Image.Image) -> Image.Image:
+    """Run the model registered as ``name`` on ``image``, batched with concurrent calls if it can be."""
+    model = model_registry.get(name)
+    if settings.AI_MICROBATCH_MAX_SIZE <= 1 or not hasattr(model, 'predict_batch'):
+        return model(image)
+    deadlines.check('inference')
+    left = deadlines.remaining()
+    future = _get_batcher(name).submit(model, image)
+    try:
+        return future.result(timeout=settings.AI_MICROBATCH_TIMEOUT if left is None else left)
+    except TimeoutError:
+        future.cancel()
+        if left is not None:
+            raise deadlines.DeadlineExceeded('inference')
+        raise
+
+
+def stats() -> dict:
+    """Batching metrics per feature for this process."""
+    return {name: batcher.stats() for name, batcher in list(_batchers.items())}
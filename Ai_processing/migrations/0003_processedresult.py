@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Ai_processing', '0002_processingjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('feature', models.CharField(db_index=True, max_length=50)),
+                ('model_version', models.CharField(max_length=50)),
+                ('original_image', models.CharField(max_length=255)),
+                ('processed_image', models.CharField(max_length=255)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Ai_processing', '0003_processedresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='pipeline',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AlterField(
+            model_name='processedresult',
+            name='feature',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='processedresult',
+            name='model_version',
+            field=models.CharField(max_length=100),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Ai_processing', '0004_processingjob_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='options',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Ai_processing', '0005_processingjob_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='output',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Ai_processing', '0006_processingjob_output'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processedresult',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Ai_processing', '0007_processedresult_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='tiles_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processingjob',
+            name='tiles_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:51
+
+import Ai_processing.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Ai_processing', '0009_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='source_name',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='processingjob',
+            name='image',
+            field=models.FileField(blank=True, storage=Ai_processing.models.job_spool_storage, upload_to='inputs/'),
+        ),
+    ]
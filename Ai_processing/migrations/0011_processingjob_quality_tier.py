@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Ai_processing', '0010_processingjob_source_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='quality_tier',
+            field=models.CharField(default='balanced', max_length=10),
+        ),
+    ]
@@ -1,3 +1,8 @@
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
 # Create your models here.
@@ -10,9 +15,139 @@ class Ai_feature(models.Model):
         ('DE_BLUR', 'dE blur'),
         ('SHADOW_REMOVAL', 'Shadow removal'),
     ])
-    
+
     description = models.TextField(blank=True, null=True)
 
-    
+
+    def __str__(self):
+        return self.name
+
+
+def job_spool_storage():
+    """Local disk storage for job inputs, shared by the web and worker processes."""
+    return FileSystemStorage(location=settings.AI_JOB_SPOOL_DIR)
+
+
+class ProcessingJob(models.Model):
+    """
+    A queued request to process an image in the background.
+
+    The database table is the broker: the web process inserts PENDING rows and
+    the ``run_processing_workers`` command claims and runs them.
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='processing_jobs')
+    feature = models.CharField(max_length=50)  # last pipeline step
+    pipeline = models.JSONField(default=list)  # ordered feature names
+    options = models.JSONField(default=dict, blank=True)  # per-feature kwargs, e.g. BASIC_FILTER filters
+    output = models.JSONField(default=dict, blank=True)  # encoding spec; size and encode time added when done
+    quality_tier = models.CharField(max_length=10, default='balanced')  # fast, balanced or best
+    image = models.FileField(upload_to='inputs/', storage=job_spool_storage, blank=True)
+    # A direct upload already in media storage, processed instead of a spooled image
+    source_name = models.CharField(max_length=255, blank=True, db_index=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING', db_index=True)
+    stage = models.CharField(max_length=30, blank=True)  # e.g. decoding, processing, encoding, uploading
+    progress = models.PositiveSmallIntegerField(default=0)  # percent
+    tiles_done = models.PositiveIntegerField(default=0)  # tiled super-resolution only
+    tiles_total = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    history = models.OneToOneField(
+        'user_history.User_History',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='job',
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"{self.feature} job {self.id} - {self.status}"
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload of one large image.
+
+    The client PUTs the file in byte-range chunks, in order, then finalizes
+    the session into a processing request (see ``uploads.py``). The bytes
+    received so far are spooled to ``spool_name`` in the job spool.
+    """
+    STATUS_CHOICES = [
+        ('OPEN', 'Open'),
+        ('FINALIZED', 'Finalized'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()  # total bytes, announced up front
+    received = models.BigIntegerField(default=0)  # bytes stored so far, always a prefix of the file
+    sha256 = models.CharField(max_length=64, blank=True)  # optional whole-file checksum, checked on finalize
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='OPEN', db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Upload {self.id} - {self.received}/{self.size}"
+
+    @property
+    def spool_name(self) -> str:
+        return f"uploads/{self.id}.part"
+
+
+class ProcessedResult(models.Model):
+    """
+    Content-addressed cache of stored processing results.
+
+    ``key`` is a hash of the uploaded bytes, the feature, its parameters and
+    the model version, so a re-submitted image can reuse the stored files,
+    thumbnails included. Rows are evicted least-recently-used first; the
+    files themselves stay because history entries still point at them.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    feature = models.CharField(max_length=255, db_index=True)  # pipeline steps joined with "+"
+    model_version = models.CharField(max_length=100)
+    original_image = models.CharField(max_length=255)  # storage names
+    processed_image = models.CharField(max_length=255)
+    # Renditions of processed_image, as on User_History.derivatives
+    derivatives = models.JSONField(default=list, blank=True)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.feature} v{self.model_version} - {self.key[:12]}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    A client's ``Idempotency-Key`` for one processing request and, once it
+    succeeded, the response to replay (see ``idempotency.py``).
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # SHA-256 of the request the key was first used with
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # None while the request runs
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    locked_at = models.DateTimeField()  # when the running request claimed the key
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return f"{self.key} ({self.status_code or 'running'})"
@@ -0,0 +1,87 @@
+"""
+Server-Sent Events stream of a background job's progress.
+
+Workers record the stage, percent and tile counts on the ProcessingJob row
+(see ``jobs.py``); ``job_events`` polls that row and emits an event each
+time it changes. All database work goes through ``sync_to_async``, so under
+an ASGI server the event loop only ever waits on I/O, never on Pillow or a
+model: the processing itself runs in the job worker processes.
+"""
+
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .models import ProcessingJob
+
+PROGRESS_FIELDS = ('status', 'stage', 'progress', 'tiles_done', 'tiles_total')
+TERMINAL_EVENTS = {'COMPLETED': 'done', 'FAILED': 'failed'}
+
+
+def authenticated_user(request):
+    """Authenticate a plain Django request with the REST framework authenticators, or None."""
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except APIException:
+        return None
+    return user if user.is_authenticated else None
+
+
+def format_event(event: str, data) -> str:
+    """One SSE message."""
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def _snapshot(job_pk):
+    return ProcessingJob.objects.filter(pk=job_pk).values(*PROGRESS_FIELDS).first()
+
+
+async def job_events(job_pk, final_payload, poll_interval=None, heartbeat=None, timeout=None):
+    """
+    Yield SSE messages for a job until it finishes.
+
+    Sends a ``progress`` event whenever the status, stage, percent or tile
+    counts change, a comment line as a keep-alive when nothing changed for
+    ``heartbeat`` seconds, and finally ``done`` or ``failed`` carrying
+    ``final_payload()`` (a sync callable, run in a thread). Gives up with a
+    ``timeout`` event after ``timeout`` seconds.
+    """
+    poll_interval = settings.AI_PROGRESS_POLL_INTERVAL if poll_interval is None else poll_interval
+    heartbeat = settings.AI_PROGRESS_HEARTBEAT if heartbeat is None else heartbeat
+    timeout = settings.AI_JOB_TIMEOUT if timeout is None else timeout
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    last_sent = loop.time()
+    last = None
+
+    # Ask EventSource clients to reconnect after 2s if the connection drops
+    yield "retry: 2000\n\n"
+    while True:
+        snapshot = await sync_to_async(_snapshot)(job_pk)
+        if snapshot is None:
+            yield format_event('failed', {'error': "Job no longer exists."})
+            return
+        if snapshot['status'] in TERMINAL_EVENTS:
+            yield format_event(TERMINAL_EVENTS[snapshot['status']], await sync_to_async(final_payload)())
+            return
+
+        if snapshot != last:
+            last = snapshot
+            last_sent = loop.time()
+            yield format_event('progress', snapshot)
+        elif loop.time() - last_sent >= heartbeat:
+            last_sent = loop.time()
+            yield ": keep-alive\n\n"
+
+        if loop.time() >= deadline:
+            yield format_event('timeout', snapshot)
+            return
+        await asyncio.sleep(poll_interval)
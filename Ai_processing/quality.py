@@ -0,0 +1,166 @@
+"""
+Expected latency of every feature at every quality tier.
+
+Measured on this node: the ``api_pix_processing_seconds`` histogram, merged
+across all processes (see Ai_processing.metrics), gives the mean and an
+estimated 90th percentile per feature and tier. Those are per image, as
+clients actually sent them. ``api_pix_processing_seconds_per_megapixel``
+gives the size-independent rate that ``estimate`` uses to predict one
+image, and ``plan`` to pick a tier that fits a request's deadline. A tier
+nobody has used yet is estimated from the feature's balanced numbers and
+the tier's relative cost.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from prometheus_client import multiprocess
+
+from .backends import has_tier_model
+from .deadlines import DeadlineExceeded, remaining
+from .utils import QUALITY_STRATEGIES, QUALITY_TIERS, SUPER_RESOLUTION_SCALE, relative_cost
+
+LATENCY_HISTOGRAM = 'api_pix_processing_seconds'
+RATE_HISTOGRAM = 'api_pix_processing_seconds_per_megapixel'
+CACHE_KEY = 'ai_quality_tiers'
+RATES_CACHE_KEY = 'ai_quality_rates'
+# Reading every process's metrics file is cheap, but not free on each request
+CACHE_SECONDS = 30
+
+
+def _histograms() -> dict:
+    """
+    Histogram name -> (feature, tier) -> {'count', 'sum', 'buckets'}, where
+    buckets are (upper bound, cumulative count) pairs.
+    """
+    histograms = {LATENCY_HISTOGRAM: {}, RATE_HISTOGRAM: {}}
+    for metric in multiprocess.MultiProcessCollector(None).collect():
+        if metric.name not in histograms:
+            continue
+        for sample in metric.samples:
+            key = (sample.labels.get('feature'), sample.labels.get('quality'))
+            histogram = histograms[metric.name].setdefault(key, {'count': 0, 'sum': 0.0, 'buckets': []})
+            if sample.name.endswith('_bucket'):
+                histogram['buckets'].append((float(sample.labels['le']), sample.value))
+            elif sample.name.endswith('_count'):
+                histogram['count'] = sample.value
+            elif sample.name.endswith('_sum'):
+                histogram['sum'] = sample.value
+    return histograms
+
+
+def quantile(buckets, q: float):
+    """Estimate the ``q`` quantile from cumulative buckets, interpolating linearly like PromQL."""
+    buckets = sorted(buckets)
+    if not buckets or buckets[-1][1] == 0:
+        return None
+    rank = q * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float('inf'):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+def _mean(histograms: dict, feature: str, tier: str):
+    """(mean, estimated) for ``feature`` at ``tier``; (None, False) without any samples."""
+    histogram = histograms.get((feature, tier))
+    if histogram and histogram['count']:
+        return histogram['sum'] / histogram['count'], False
+    balanced = histograms.get((feature, 'balanced'))
+    if balanced and balanced['count']:
+        return balanced['sum'] / balanced['count'] * relative_cost(feature, tier), True
+    return None, False
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def tiers() -> dict:
+    """Strategy and expected latency (ms) of each feature at each tier."""
+    histograms = _histograms()
+    latencies, rates = histograms[LATENCY_HISTOGRAM], histograms[RATE_HISTOGRAM]
+    result = {}
+    for tier in QUALITY_TIERS:
+        features = {}
+        for feature, strategies in QUALITY_STRATEGIES.items():
+            histogram = latencies.get((feature, tier))
+            mean, estimated = _mean(latencies, feature, tier)
+            features[feature] = {
+                **strategies[tier],
+                'own_model': tier != 'balanced' and has_tier_model(feature, tier),
+                'relative_cost': relative_cost(feature, tier),
+                'samples': int(histogram['count']) if histogram else 0,
+                'estimated': estimated,
+                'mean_ms': _ms(mean),
+                'p90_ms': _ms(quantile(histogram['buckets'], 0.9)) if histogram and not estimated else None,
+                'ms_per_megapixel': _ms(_mean(rates, feature, tier)[0]),
+            }
+        result[tier] = features
+    return result
+
+
+def published() -> dict:
+    """``tiers()`` plus the default tier, cached for CACHE_SECONDS."""
+    data = cache.get(CACHE_KEY)
+    if data is None:
+        data = {'default': settings.AI_DEFAULT_QUALITY_TIER, 'tiers': tiers()}
+        cache.set(CACHE_KEY, data, CACHE_SECONDS)
+    return data
+
+
+def _rates() -> dict:
+    """``"<FEATURE>:<tier>"`` -> mean seconds per megapixel (None if unknown), cached."""
+    rates = cache.get(RATES_CACHE_KEY)
+    if rates is None:
+        histograms = _histograms()[RATE_HISTOGRAM]
+        rates = {
+            f"{feature}:{tier}": _mean(histograms, feature, tier)[0]
+            for feature in QUALITY_STRATEGIES
+            for tier in QUALITY_TIERS
+        }
+        cache.set(RATES_CACHE_KEY, rates, CACHE_SECONDS)
+    return rates
+
+
+def estimate(steps, tier: str, megapixels: float):
+    """Expected seconds to run ``steps`` at ``tier`` on an image this size, or None if unknown."""
+    rates = _rates()
+    total = 0.0
+    for feature in steps:
+        rate = rates.get(f"{feature}:{tier}")
+        if rate is None:
+            return None
+        total += rate * megapixels
+        if feature == 'SUPER_RESOLUTION':
+            # Later steps run on the upscaled image
+            megapixels *= SUPER_RESOLUTION_SCALE ** 2
+    return total
+
+
+def plan(steps, requested: str, megapixels: float):
+    """
+    The tier to run ``steps`` at within the current deadline, and whether it is below ``requested``.
+
+    Keeps ``requested`` when there is no deadline or no estimate for it.
+    Otherwise takes the best tier, down from ``requested``, whose estimate fits in the time
+    left minus AI_DEADLINE_HEADROOM (the share kept for encoding and upload).
+
+    Raises:
+        DeadlineExceeded: If not even the fastest tier is expected to finish in time.
+    """
+    left = remaining()
+    if left is None:
+        return requested, False
+    budget = left * (1 - settings.AI_DEADLINE_HEADROOM)
+    candidates = QUALITY_TIERS[:QUALITY_TIERS.index(requested) + 1]
+    for tier in reversed(candidates):
+        expected = estimate(steps, tier, megapixels)
+        if expected is None or expected <= budget:
+            return tier, tier != requested
+    raise DeadlineExceeded('planning')
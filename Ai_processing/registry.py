@@ -0,0 +1,143 @@
+"""
+Model registry: load each feature's model once per process.
+
+Models are loaded lazily on first use, or up front with ``preload_models``.
+Preloading in the gunicorn master (``--preload``) or in the job worker
+parent, before workers are forked, lets every worker share the weights
+copy-on-write instead of holding its own copy.
+
+When the loaded models exceed AI_MODEL_MEMORY_BUDGET_MB, the least recently
+used ones are dropped; preloaded models are pinned and never evicted.
+"""
+
+import gc
+import logging
+import resource
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _rss_bytes() -> int:
+    """Resident set size of this process, or 0 where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0
+    return pages * resource.getpagesize()
+
+
+class _Entry:
+    def __init__(self, loader):
+        self.loader = loader
+        self.model = None
+        self.loaded = False
+        self.pinned = False
+        self.load_seconds = None
+        self.resident_bytes = 0
+        self.uses = 0
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    def __init__(self, budget_bytes=None):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._budget_bytes = budget_bytes
+
+    @property
+    def budget_bytes(self) -> int:
+        if self._budget_bytes is not None:
+            return self._budget_bytes
+        return settings.AI_MODEL_MEMORY_BUDGET_MB * 1024 * 1024
+
+    def register(self, name: str, loader) -> None:
+        """Register ``loader``, a callable returning the model for ``name``."""
+        with self._lock:
+            self._entries[name] = _Entry(loader)
+
+    def get(self, name: str):
+        """Return the model for ``name``, loading it on first use."""
+        entry = self._entries.get(name)
+        if entry is None:
+            raise ValueError(f"No model registered for: {name}")
+        entry.uses += 1
+        entry.last_used = time.monotonic()
+        model = entry.model
+        if model is not None:
+            return model
+
+        with entry.lock:
+            if not entry.loaded:
+                self._load(name, entry)
+            model = entry.model
+        self._evict(keep=name)
+        return model
+
+    def _load(self, name: str, entry: _Entry) -> None:
+        rss_before = _rss_bytes()
+        started = time.perf_counter()
+        model = entry.loader()
+        entry.load_seconds = time.perf_counter() - started
+        # Prefer the model's own size report, fall back to the RSS growth
+        entry.resident_bytes = getattr(model, 'nbytes', None) or max(_rss_bytes() - rss_before, 0)
+        entry.model = model
+        entry.loaded = True
+        logger.info(
+            "Loaded model %s in %.3fs (%d bytes resident)",
+            name, entry.load_seconds, entry.resident_bytes,
+        )
+
+    def _evict(self, keep=None) -> None:
+        with self._lock:
+            loaded = [(n, e) for n, e in self._entries.items() if e.loaded]
+            total = sum(e.resident_bytes for _, e in loaded)
+            candidates = sorted(
+                ((n, e) for n, e in loaded if not e.pinned and n != keep),
+                key=lambda item: item[1].last_used,
+            )
+            for name, entry in candidates:
+                if total <= self.budget_bytes:
+                    break
+                with entry.lock:
+                    total -= entry.resident_bytes
+                    entry.model = None
+                    entry.loaded = False
+                logger.info("Evicted model %s to stay under the memory budget", name)
+
+    def preload(self, names=None) -> None:
+        """Load and pin ``names`` (all registered models by default)."""
+        for name in names or list(self._entries):
+            self.get(name)
+            self._entries[name].pinned = True
+        # Keep the loaded objects out of the garbage collector's way, so the
+        # collector doesn't touch (and un-share) their pages after a fork.
+        gc.collect()
+        gc.freeze()
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                'loaded': entry.loaded,
+                'pinned': entry.pinned,
+                'load_seconds': entry.load_seconds,
+                'resident_bytes': entry.resident_bytes,
+                'uses': entry.uses,
+            }
+            for name, entry in self._entries.items()
+        }
+
+
+model_registry = ModelRegistry()
+
+
+def preload_models() -> None:
+    """Load every registered model before workers are forked."""
+    # Importing utils registers the feature models
+    from . import utils  # noqa: F401
+    model_registry.preload()
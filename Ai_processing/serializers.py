@@ -1,5 +1,13 @@
+from django.conf import settings
 from rest_framework import serializers
 
+from .decoding import UploadRejected, open_upload
+from .encoding import OUTPUT_FORMATS, available_formats, default_output, negotiate_format
+from .filters import FILTER_RANGES
+from .models import ProcessingJob, UploadSession
+from .services import absolute_url
+from .utils import QUALITY_TIERS
+
 FEATURE_CHOICES = [
     ('SUPER_RESOLUTION', 'Super Resolution'),
     ('BASIC_FILTER', 'Basic Filter'),
@@ -8,7 +16,238 @@ FEATURE_CHOICES = [
     ('SHADOW_REMOVAL', 'Shadow Removal'),
 ]
 
+MAX_PIPELINE_STEPS = 5
+
+
+class FeaturePipelineField(serializers.ListField):
+    """
+    One feature or an ordered list of them.
+
+    Accepts a single value ("DE_NOISE"), a comma-separated string
+    ("DE_NOISE,SUPER_RESOLUTION"), a repeated form field or a JSON list,
+    and always returns a list of feature names.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('child', serializers.ChoiceField(choices=FEATURE_CHOICES))
+        kwargs.setdefault('allow_empty', False)
+        kwargs.setdefault('max_length', MAX_PIPELINE_STEPS)
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = [data]
+        if isinstance(data, (list, tuple)):
+            steps = []
+            for value in data:
+                if isinstance(value, str):
+                    steps.extend(step.strip() for step in value.split(',') if step.strip())
+                else:
+                    steps.append(value)
+            data = steps
+        return super().to_internal_value(data)
+
+
+class UploadedImageField(serializers.FileField):
+    """
+    Image upload validated in a single pass.
+
+    Enforces AI_MAX_UPLOAD_BYTES and AI_MAX_IMAGE_PIXELS from the file size
+    and image header only. The lazily opened PIL image is attached to the
+    returned file as ``.image``; decode it with ``decoding.decode_image``.
+    """
+
+    def to_internal_value(self, data):
+        upload = super().to_internal_value(data)
+        try:
+            upload.image = open_upload(upload)
+        except UploadRejected as e:
+            raise serializers.ValidationError(str(e), code=e.code)
+        return upload
+
+
+class FilterSpecSerializer(serializers.Serializer):
+    """Adjustments for BASIC_FILTER; omitted ones are left neutral."""
+
+    def get_fields(self):
+        return {
+            name: serializers.FloatField(required=False, min_value=low, max_value=high)
+            for name, (_, low, high) in FILTER_RANGES.items()
+        }
+
+
+class OutputEncodingSerializer(serializers.Serializer):
+    """
+    How to encode the processed image.
+
+    An explicit ``output_format`` wins over the request's ``Accept`` header
+    (e.g. ``Accept: application/json, image/webp``), which wins over the
+    AI_OUTPUT_FORMAT default. ``quality`` is for JPEG/WebP/AVIF and
+    ``compress_level`` for PNG.
+    """
+    output_format = serializers.ChoiceField(choices=list(OUTPUT_FORMATS), required=False)
+    quality = serializers.IntegerField(required=False, min_value=1, max_value=100)
+    compress_level = serializers.IntegerField(required=False, min_value=0, max_value=9)
+
+    def validate_output_format(self, value):
+        if value not in available_formats():
+            raise serializers.ValidationError(f"{value} output is not supported on this server.")
+        return value
+
+    def get_output(self, accept=None) -> dict:
+        """Encoding spec for ``encoding.encode_image``."""
+        output = default_output()
+        output_format = self.validated_data.get('output_format') or negotiate_format(accept)
+        if output_format:
+            output['format'] = output_format
+        for key in ('quality', 'compress_level'):
+            if key in self.validated_data:
+                output[key] = self.validated_data[key]
+        return output
+
+
+class QualityTierField(serializers.ChoiceField):
+    """Speed/quality tier of the processing (``quality`` is taken by the output encoding)."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('choices', list(QUALITY_TIERS))
+        kwargs.setdefault('required', False)
+        super().__init__(**kwargs)
+
+    def get_default(self):
+        return settings.AI_DEFAULT_QUALITY_TIER
+
+
+class ImageProcessSerializer(OutputEncodingSerializer):
+    image = UploadedImageField()
+    feature = FeaturePipelineField()
+    # fast, balanced or best; what each costs is published at /api/processing/quality-tiers/
+    quality_tier = QualityTierField()
+    # How long the client will wait, in ms; also accepted as the X-Deadline-Ms header
+    deadline_ms = serializers.IntegerField(required=False, min_value=1)
+    # "async" queues the work for the background workers and returns a job id
+    mode = serializers.ChoiceField(choices=['sync', 'async'], default='sync', required=False)
+    # BASIC_FILTER spec as a JSON object, e.g. {"brightness": 0.1, "contrast": 1.2}
+    filters = serializers.JSONField(required=False)
+
+    def validate_filters(self, value):
+        spec = FilterSpecSerializer(data=value)
+        spec.is_valid(raise_exception=True)
+        return spec.validated_data
+
+    def validate(self, attrs):
+        if attrs.get('filters') and 'BASIC_FILTER' not in attrs['feature']:
+            raise serializers.ValidationError({"filters": "filters can only be used with BASIC_FILTER."})
+        return attrs
+
+    def get_options(self) -> dict:
+        """Per-feature keyword arguments for run_pipeline."""
+        options = {}
+        if self.validated_data.get('filters'):
+            options['BASIC_FILTER'] = {'filters': dict(self.validated_data['filters'])}
+        return options
+
+
+class ProcessReferenceSerializer(ImageProcessSerializer):
+    """ImageProcessSerializer for a direct upload: ``reference`` replaces ``image``; always a job."""
+    image = None
+    mode = None
+    deadline_ms = None
+    reference = serializers.CharField()
+
+
+class BatchImageProcessSerializer(OutputEncodingSerializer):
+    """
+    Many images in one multipart request: repeat ``images`` and ``features``,
+    matched up by position. Each pair is validated on its own with
+    ImageProcessSerializer so a bad file only fails its own item. The quality
+    tier and output encoding apply to every image.
+    """
+    images = serializers.ListField(child=serializers.FileField(), allow_empty=False)
+    features = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+    quality_tier = QualityTierField()
+
+    def validate(self, attrs):
+        if len(attrs['images']) != len(attrs['features']):
+            raise serializers.ValidationError("images and features must have the same number of entries.")
+        if len(attrs['images']) > settings.AI_BATCH_MAX_IMAGES:
+            raise serializers.ValidationError(
+                f"A batch can contain at most {settings.AI_BATCH_MAX_IMAGES} images."
+            )
+        return attrs
+
+    def item_serializers(self):
+        """Return one ImageProcessSerializer per (image, feature) pair, already validated."""
+        items = []
+        for image, feature in zip(self.validated_data['images'], self.validated_data['features']):
+            item = ImageProcessSerializer(data={'image': image, 'feature': feature})
+            item.is_valid()
+            items.append(item)
+        return items
+
+
+class UploadSessionCreateSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+    # Optional SHA-256 of the whole file (hex), checked when the upload is finalized
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False)
+
+    def validate_size(self, value):
+        if value > settings.AI_MAX_UPLOAD_BYTES:
+            raise serializers.ValidationError(
+                f"Image file is too large (max {settings.AI_MAX_UPLOAD_BYTES} bytes).", code='too_large'
+            )
+        return value
+
+    def validate_sha256(self, value):
+        return value.lower()
+
+
+class DirectUploadTicketSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=255)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'filename', 'size', 'received', 'sha256', 'status', 'created_at', 'updated_at')
+        read_only_fields = fields
+
+
+class ProcessingJobSerializer(serializers.ModelSerializer):
+    original_image = serializers.SerializerMethodField()
+    processed_image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProcessingJob
+        fields = (
+            'id',
+            'feature',
+            'pipeline',
+            'status',
+            'stage',
+            'progress',
+            'tiles_done',
+            'tiles_total',
+            'error',
+            'output',
+            'quality_tier',
+            'original_image',
+            'processed_image',
+            'history',
+            'created_at',
+            'started_at',
+            'finished_at',
+        )
+        read_only_fields = fields
+
+    def _history_url(self, obj, field_name):
+        if obj.history is None:
+            return None
+        return absolute_url(self.context.get('request'), getattr(obj.history, field_name))
+
+    def get_original_image(self, obj):
+        return self._history_url(obj, 'image_uploaded')
 
-class ImageProcessSerializer(serializers.Serializer):
-    image = serializers.ImageField()
-    feature = serializers.ChoiceField(choices=FEATURE_CHOICES)
+    def get_processed_image(self, obj):
+        return self._history_url(obj, 'restored_image')
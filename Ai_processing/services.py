@@ -0,0 +1,279 @@
+"""
+Shared helpers for turning a processed image into a stored history entry.
+
+Used by the synchronous ``ProcessImageView`` and by the background job
+workers, so both paths store files and build URLs the same way.
+"""
+
+import os
+import tempfile
+import uuid
+from functools import partial
+
+from django.core.files.base import ContentFile, File
+from django.conf import settings
+from django.db import transaction
+from PIL import Image
+
+from user_history.models import User_History
+
+from .derivatives import derivative_uploads, render_derivatives, with_names
+from .encoding import default_output, encode_in_pool, get_encode_pool
+from .deadlines import check
+from .models import job_spool_storage
+from .storage import run_in_background, timed_save, upload_files
+from .tiling import process_tiled, should_tile
+from .timing import stage
+from .utils import SUPER_RESOLUTION_SCALE, run_at_quality, run_pipeline, timed_processing
+
+
+class OutputFormatUnavailable(Exception):
+    """A tiled result can only be PNG, but the request insisted on ``format``."""
+
+    def __init__(self, output_format: str):
+        self.format = output_format
+        super().__init__(
+            f"Images this large are only written as PNG, not {output_format}; "
+            f"leave out output_format or ask for png."
+        )
+
+
+def render_output(image: Image.Image, steps, options=None, output=None, progress=None, quality=None,
+                  require_format=False):
+    """
+    Run the pipeline at ``quality`` and encode the result as a file ready for storage.
+
+    ``output`` is an encoding spec (see ``encoding.py``); the encode runs on
+    the shared encode pool. When the last step is SUPER_RESOLUTION on a large
+    input, that step goes through the tiled engine and streams PNG into a
+    temporary file instead of building the full-size result in memory, so
+    tiled results are always PNG: transcoding would need the whole result in
+    memory after all. A tiled request for another format falls back to PNG
+    (the report's ``format`` says so), or with ``require_format`` (the client
+    named the format itself) raises OutputFormatUnavailable before any work.
+
+    With AI_DERIVATIVES_EAGER the thumbnail renditions are rendered from the
+    same in-memory result on another encode thread, alongside the main encode.
+
+    ``progress(stage, done=0, total=0)`` is called with ``'processing'``
+    (with tile counts when tiled) and ``'encoding'``.
+
+    Returns:
+        (File, report, renditions) where report holds the ``format`` actually
+        written, the encoded size in ``bytes``, the output ``width`` and
+        ``height`` and ``encode_ms`` (None when tiled, since encoding is
+        interleaved with processing there), and
+        renditions is the ``render_derivatives`` output for ``save_history``
+        (empty when tiled; those get theirs lazily).
+
+    Raises:
+        ValueError: If a feature is not recognized.
+        DeadlineExceeded: If the request's deadline passes before encoding.
+        OutputFormatUnavailable: See ``require_format``.
+    """
+    output = {**default_output(), **(output or {})}
+    quality = quality or settings.AI_DEFAULT_QUALITY_TIER
+    if progress is not None:
+        progress('processing')
+    if should_tile(image, steps):
+        if require_format and output['format'] != 'png':
+            raise OutputFormatUnavailable(output['format'])
+        with stage('inference'):
+            image = run_pipeline(image, steps[:-1], options, quality)
+            spooled = tempfile.TemporaryFile()
+            with timed_processing('SUPER_RESOLUTION', quality, image):
+                process_tiled(
+                    image, partial(run_at_quality, feature='SUPER_RESOLUTION', quality=quality), spooled,
+                    scale=SUPER_RESOLUTION_SCALE, compress_level=output['compress_level'],
+                    progress=progress and (lambda done, total: progress('processing', done, total)),
+                )
+        size = spooled.tell()
+        spooled.seek(0)
+        report = {
+            'format': 'png',
+            'bytes': size,
+            'width': image.width * SUPER_RESOLUTION_SCALE,
+            'height': image.height * SUPER_RESOLUTION_SCALE,
+            'encode_ms': None,
+        }
+        return File(spooled), report, []
+
+    with stage('inference'):
+        processed = run_pipeline(image, steps, options, quality)
+    check('encode')
+    if progress is not None:
+        progress('encoding')
+    thumbnails = None
+    if settings.AI_DERIVATIVES_EAGER:
+        thumbnails = get_encode_pool().submit(render_derivatives, processed)
+    with stage('encode'):
+        data, seconds = encode_in_pool(processed, output)
+    report = {
+        'format': output['format'],
+        'bytes': len(data),
+        'width': processed.width,
+        'height': processed.height,
+        'encode_ms': round(seconds * 1000, 1),
+    }
+    with stage('derivatives'):
+        renditions = thumbnails.result() if thumbnails else []
+    return ContentFile(data), report, renditions
+
+
+def _named(content, name: str) -> File:
+    if isinstance(content, bytes):
+        return ContentFile(content, name=name)
+    content.name = name
+    return content
+
+
+def _upload(field_name: str, filename: str, content):
+    """A ``(storage, name, content)`` item for ``upload_files``, named like the field would."""
+    field = User_History._meta.get_field(field_name)
+    return field.storage, field.generate_filename(None, filename), _named(content, filename)
+
+
+def _history_uploads(original, processed, extension: str, renditions=()):
+    """
+    ``upload_files`` items for one history row, and its derivatives entries.
+
+    The items are the original, the processed image and then one per
+    rendition; all names share a random id so they can be matched up in
+    storage.
+    """
+    unique_id = uuid.uuid4().hex[:12]
+    items = [
+        _upload('image_uploaded', f"original_{unique_id}.png", original),
+        _upload('restored_image', f"processed_{unique_id}.{extension}", processed),
+    ]
+    storage = User_History._meta.get_field('restored_image').storage
+    derivative_items, entries = derivative_uploads(storage, f"processed_{unique_id}", renditions)
+    return items + derivative_items, entries
+
+
+def save_histories(user, items, extension='png', quality=None) -> list:
+    """
+    Store the images for several results and create their User_History rows.
+
+    ``items`` is a list of ``(original, processed, steps)``; the images are
+    bytes or Files (an upload, or the result of ``render_output``), and Files
+    are handed to storage as they are. ``extension`` is the processed files',
+    from their output format. ``feature_used`` holds the last pipeline step
+    and ``pipeline`` all of them; ``quality`` is the tier they ran at.
+
+    All files are uploaded concurrently on the shared upload pool. The rows
+    are inserted with one bulk_create only after every upload succeeded.
+    """
+    uploads = []
+    for original, processed, _ in items:
+        uploads.extend(_history_uploads(original, processed, extension)[0])
+    with stage('upload'):
+        names = upload_files(uploads)
+    with stage('db'):
+        return User_History.objects.bulk_create([
+            User_History(
+                user=user,
+                image_uploaded=names[2 * index],
+                restored_image=names[2 * index + 1],
+                feature_used=steps[-1],
+                pipeline=steps,
+                quality_tier=quality or settings.AI_DEFAULT_QUALITY_TIER,
+            )
+            for index, (_, _, steps) in enumerate(items)
+        ])
+
+
+def save_history(user, original, processed, steps, extension='png',
+                 defer_original=False, on_stored=None, renditions=(), quality=None,
+                 stored_original=None) -> User_History:
+    """
+    Store the original and processed images and create the User_History row.
+
+    The uploads (including any thumbnail ``renditions`` from
+    ``render_output``) run concurrently and the row is created once all of
+    them are in storage. ``on_stored(history)`` runs in the same transaction
+    as the row's final write, e.g. to record the result in the cache.
+
+    With ``defer_original`` only the processed image and renditions are
+    uploaded before returning; the original is spooled to local disk and
+    uploaded on the upload pool afterwards, then filled into the row. Until
+    then ``image_uploaded`` is empty.
+
+    ``stored_original`` is the name of an original that is already in
+    storage (a direct upload); the row points at it and it is not uploaded
+    again.
+    """
+    uploads, entries = _history_uploads(original, processed, extension, renditions)
+    (storage, original_name, original_file), rest = uploads[0], uploads[1:]
+
+    if stored_original:
+        with stage('upload'):
+            processed_name, *derivative_names = upload_files(rest)
+        with stage('db'), transaction.atomic():
+            history = save_history_from_stored(
+                user, stored_original, processed_name, steps, with_names(entries, derivative_names), quality
+            )
+            if on_stored is not None:
+                on_stored(history)
+        return history
+
+    if not defer_original:
+        with stage('upload'):
+            original_name, processed_name, *derivative_names = upload_files(uploads)
+        with stage('db'), transaction.atomic():
+            history = save_history_from_stored(
+                user, original_name, processed_name, steps, with_names(entries, derivative_names), quality
+            )
+            if on_stored is not None:
+                on_stored(history)
+        return history
+
+    # The request's upload is closed (and its temp file removed) with the request
+    with stage('spool'):
+        spooled_name = job_spool_storage().save(f"deferred/{os.path.basename(original_name)}", original_file)
+    with stage('upload'):
+        processed_name, *derivative_names = upload_files(rest)
+    with stage('db'):
+        history = save_history_from_stored(
+            user, '', processed_name, steps, with_names(entries, derivative_names), quality
+        )
+    run_in_background(_store_deferred_original, history.pk, storage, original_name, spooled_name, on_stored)
+    return history
+
+
+def _store_deferred_original(history_pk, storage, original_name, spooled_name, on_stored):
+    spool = job_spool_storage()
+    # Already running on the upload pool, so save directly
+    with spool.open(spooled_name, 'rb') as spooled:
+        stored_name = timed_save(storage, original_name, File(spooled))
+    with transaction.atomic():
+        User_History.objects.filter(pk=history_pk).update(image_uploaded=stored_name)
+        history = User_History.objects.get(pk=history_pk)
+        if on_stored is not None:
+            on_stored(history)
+    spool.delete(spooled_name)
+
+
+def save_history_from_stored(user, original_name: str, processed_name: str, steps,
+                             derivatives=None, quality=None) -> User_History:
+    """Create a User_History row pointing at files that are already in storage."""
+    return User_History.objects.create(
+        user=user,
+        image_uploaded=original_name,
+        restored_image=processed_name,
+        feature_used=steps[-1],
+        pipeline=steps,
+        derivatives=derivatives or [],
+        quality_tier=quality or settings.AI_DEFAULT_QUALITY_TIER,
+    )
+
+
+def absolute_url(request, field):
+    """Return full URL for an image field, handling both Cloudinary and local storage."""
+    if not field:
+        return None
+    url = field.url
+    # Cloudinary already returns an absolute https:// URL
+    if url.startswith('http') or request is None:
+        return url
+    return request.build_absolute_uri(url)
@@ -0,0 +1,205 @@
+"""
+Shared-memory handoff of decoded images between processes.
+
+Pickling raw pixels to a pool worker and back copies every buffer several
+times and briefly doubles its memory. Instead, the pixels go into a
+segment, a file on tmpfs (AI_SHM_DIR, ``/dev/shm`` by default) that both
+sides ``mmap``. Only a ``SharedImage`` descriptor (path, mode, size) crosses
+the process boundary.
+
+Lifetimes are explicit. Every segment belongs to a ``lease``, and its file
+name starts with the owning process id and the lease id. Closing the lease
+deletes all of its segments, including results a pool worker created but
+never handed back because it crashed. Segments left behind by an owner
+that died (e.g. a killed web worker) are removed by ``sweep_dead``. It runs
+when a process pool is created, when gunicorn reaps a worker and when the
+job workers start. A segment of a live owner is never swept, however old;
+age (AI_SHM_MAX_AGE) only decides for names without an owner process id.
+
+Space for a segment is reserved up front, so a full tmpfs (Docker gives
+containers 64 MB by default) raises ``OSError`` rather than crashing the
+process on a page fault. Callers fall back to pickling in that case.
+"""
+
+import logging
+import mmap
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = '.seg'
+# Pixels are copied into a segment this many bytes at a time
+COPY_BLOCK = 4 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class SharedImage:
+    """Descriptor of an image held in a segment; cheap to pickle."""
+    path: str
+    mode: str
+    size: tuple
+
+    @property
+    def shape(self) -> tuple:
+        width, height = self.size
+        return (height, width, len(self.mode))
+
+
+def _directory() -> str:
+    directory = str(settings.AI_SHM_DIR)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def write_image(path: str, image: Image.Image) -> SharedImage:
+    """Copy ``image`` into a new segment at ``path``, a band of rows at a time."""
+    shared = SharedImage(path, image.mode, image.size)
+    height, width, bands = shared.shape
+    nbytes = height * width * bands
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        # Reserve the pages now: writing to a sparse file on a full tmpfs is a SIGBUS
+        os.posix_fallocate(fd, 0, max(nbytes, 1))
+        with mmap.mmap(fd, max(nbytes, 1)) as mapped:
+            rows = max(1, COPY_BLOCK // max(width * bands, 1))
+            for top in range(0, height, rows):
+                bottom = min(height, top + rows)
+                mapped[top * width * bands:bottom * width * bands] = image.crop((0, top, width, bottom)).tobytes()
+    except BaseException:
+        os.close(fd)
+        release(shared)
+        raise
+    os.close(fd)
+    return shared
+
+
+@contextmanager
+def pixels(shared: SharedImage):
+    """The segment's pixels as a read-only (height, width, bands) uint8 array, while mapped."""
+    with open(shared.path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    array = np.frombuffer(mapped, dtype=np.uint8, count=int(np.prod(shared.shape))).reshape(shared.shape)
+    try:
+        yield array
+    finally:
+        del array
+        try:
+            mapped.close()
+        except BufferError:
+            # The caller still holds the array; the mapping goes away with it
+            pass
+
+
+def crop(shared: SharedImage, box) -> Image.Image:
+    """A copy of ``box`` (left, upper, right, lower) from the segment's image."""
+    left, upper, right, lower = box
+    with pixels(shared) as array:
+        region = np.ascontiguousarray(array[upper:lower, left:right])
+    return Image.frombytes(shared.mode, (right - left, lower - upper), region)
+
+
+def release(shared: SharedImage) -> None:
+    """Delete a segment (mappings that are still open stay valid until closed)."""
+    try:
+        os.unlink(shared.path)
+    except FileNotFoundError:
+        pass
+
+
+class Lease:
+    """A group of segments deleted together; see ``lease``."""
+
+    def __init__(self):
+        self.prefix = f"{os.getpid()}-{uuid.uuid4().hex[:12]}-"
+        self.directory = str(settings.AI_SHM_DIR)
+
+    def share(self, image: Image.Image) -> SharedImage:
+        return write_image(new_path(_directory(), self.prefix), image)
+
+
+def new_path(directory: str, prefix: str) -> str:
+    return os.path.join(directory, f"{prefix}{uuid.uuid4().hex[:12]}{SUFFIX}")
+
+
+def share_result(directory: str, prefix: str, image: Image.Image) -> SharedImage:
+    """Pool worker side: put a result in a new segment of the caller's lease."""
+    return write_image(new_path(directory, prefix), image)
+
+
+def sweep(directory: str, prefix: str) -> int:
+    """Delete every segment whose name starts with ``prefix``."""
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        if name.startswith(prefix) and name.endswith(SUFFIX):
+            try:
+                os.unlink(os.path.join(directory, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+@contextmanager
+def lease():
+    """Segments created through the yielded ``Lease`` are deleted when the block exits."""
+    current = Lease()
+    try:
+        yield current
+    finally:
+        sweep(current.directory, current.prefix)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_dead() -> int:
+    """
+    Delete segments whose owner process has exited.
+
+    Segments whose name carries no owner process id are deleted once they
+    are older than AI_SHM_MAX_AGE.
+    """
+    directory = str(settings.AI_SHM_DIR)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    cutoff = time.time() - settings.AI_SHM_MAX_AGE
+    removed = 0
+    for name in names:
+        if not name.endswith(SUFFIX):
+            continue
+        owner = name.split('-', 1)[0]
+        path = os.path.join(directory, name)
+        try:
+            if owner.isdigit():
+                stale = not _alive(int(owner))
+            else:
+                stale = os.stat(path).st_mtime < cutoff
+            if stale:
+                os.unlink(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        logger.info("Removed %d orphaned shared-memory segment(s)", removed)
+    return removed
@@ -0,0 +1,222 @@
+"""
+Media uploads: a shared upload executor and a local stand-in for Cloudinary.
+
+``upload_files`` saves several files to storage at once on a thread pool
+shared by the whole process (``AI_UPLOAD_WORKERS`` threads), so the original
+and the processed image travel to Cloudinary in parallel instead of one after
+the other. The Cloudinary client's HTTP connection pool is sized to match, so
+every upload thread keeps its own warm HTTPS connection.
+
+``LocalMediaStorage`` is the media storage when CLOUDINARY_URL is not set.
+It writes to MEDIA_ROOT and can add an artificial per-upload latency
+(AI_LOCAL_STORAGE_LATENCY_MS) to behave like a remote store in tests and
+benchmarks.
+
+``presigned_upload`` describes a form POST that lets a client upload one
+file straight to the storage. For Cloudinary it is a signed upload to the
+Cloudinary API. ``LocalMediaStorage`` implements the same protocol with a
+signed token posted to its own receiving endpoint, which stores the file
+with ``save_new`` so each token writes one file.
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import cloudinary
+from cloudinary import uploader, utils
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import FileSystemStorage
+from django.db import close_old_connections
+from django.urls import reverse
+
+from .metrics import UPLOAD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+PRESIGNED_UPLOAD_SALT = 'Ai_processing.storage.presigned_upload'
+# How long Cloudinary accepts an upload signature after its timestamp
+CLOUDINARY_SIGNATURE_SECONDS = 3600
+
+
+class LocalMediaStorage(FileSystemStorage):
+    """FileSystemStorage with an optional simulated network latency per save."""
+
+    def _save(self, name, content):
+        latency_ms = settings.AI_LOCAL_STORAGE_LATENCY_MS
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+        return super()._save(name, content)
+
+    def save_new(self, name, content) -> str:
+        """
+        Save ``content`` as exactly ``name``, which must not exist yet.
+
+        The file is created with O_EXCL, so of concurrent calls for one name
+        exactly one succeeds; the others raise FileExistsError. (``save``
+        would store them under other names instead.)
+        """
+        latency_ms = settings.AI_LOCAL_STORAGE_LATENCY_MS
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'xb') as destination:
+            try:
+                for chunk in content.chunks():
+                    destination.write(chunk)
+            except BaseException:
+                os.unlink(path)
+                raise
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+        return name
+
+    def presigned_upload(self, name: str, expires_in: int, max_bytes: int, formats, image_format=None) -> dict:
+        """A form POST of ``file`` plus a signed token to the local receiving endpoint."""
+        token = signing.dumps({
+            'name': name,
+            'expires': int(time.time()) + expires_in,
+            'max_bytes': max_bytes,
+            'formats': list(formats),
+            'format': image_format,
+        }, salt=PRESIGNED_UPLOAD_SALT)
+        return {
+            'method': 'POST',
+            'url': reverse('ai_processing:direct_upload_local'),
+            'fields': {'token': token},
+            'file_field': 'file',
+            'name': name,
+            'format': image_format,
+        }
+
+    def verify_presigned(self, token: str) -> dict:
+        """
+        What a ``presigned_upload`` token allows: ``name``, ``max_bytes``,
+        ``formats`` and ``format``.
+
+        Raises:
+            signing.BadSignature: If the token was tampered with or has expired.
+        """
+        payload = signing.loads(token, salt=PRESIGNED_UPLOAD_SALT)
+        if payload['expires'] < time.time():
+            raise signing.SignatureExpired("Upload token has expired.")
+        return payload
+
+
+def presigned_upload(storage, name: str, expires_in: int, max_bytes: int, formats, image_format=None) -> dict:
+    """
+    How a client uploads ``name`` to ``storage`` directly.
+
+    The upload is only accepted for ``expires_in`` seconds and in one of
+    ``formats`` (Cloudinary's names, e.g. ``jpg``). Cloudinary has no signed
+    byte limit, so ``max_bytes`` is enforced there only when the object is
+    used (see ``direct_uploads``). With ``image_format`` the stored object
+    is in that format: Cloudinary converts the upload, the local stand-in
+    refuses other formats.
+
+    Returns ``method``, ``url`` (possibly relative to this site), form
+    ``fields`` to send along with the file in ``file_field``, the ``name``
+    the file will have in the storage and its ``format``. Cloudinary names
+    are public ids, which never have an extension.
+    """
+    if hasattr(storage, 'presigned_upload'):
+        return storage.presigned_upload(name, expires_in, max_bytes, formats, image_format)
+
+    # Cloudinary: a signed upload straight to its API. Cloudinary accepts a
+    # signature for an hour after its timestamp, so backdating the timestamp
+    # makes it expire after ``expires_in`` instead.
+    from cloudinary_storage import app_settings
+
+    config = cloudinary.config()
+    prefix = app_settings.PREFIX.strip('/')
+    public_id = '/'.join(filter(None, [prefix, os.path.splitext(name)[0]]))
+    expires_in = min(expires_in, CLOUDINARY_SIGNATURE_SECONDS)
+    params = {
+        'public_id': public_id,
+        'tags': storage.TAG,
+        'allowed_formats': ','.join(formats),
+        'timestamp': int(time.time()) - (CLOUDINARY_SIGNATURE_SECONDS - expires_in),
+    }
+    if image_format:
+        params['format'] = image_format
+    params['signature'] = utils.api_sign_request(params, config.api_secret)
+    params['api_key'] = config.api_key
+    return {
+        'method': 'POST',
+        'url': utils.cloudinary_api_url('upload', resource_type=storage.RESOURCE_TYPE),
+        'fields': params,
+        'file_field': 'file',
+        'name': public_id,
+        'format': image_format,
+    }
+
+
+def _size_connection_pool(size: int) -> None:
+    # The uploader's module-level urllib3 PoolManager keeps one connection
+    # per host by default; concurrent uploads would otherwise open (and
+    # throw away) a fresh TLS connection each time.
+    uploader._http = utils.get_http_connector(cloudinary.config(), {**cloudinary.CERT_KWARGS, 'maxsize': size})
+
+
+def get_upload_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _size_connection_pool(settings.AI_UPLOAD_WORKERS)
+        _pool = ThreadPoolExecutor(max_workers=settings.AI_UPLOAD_WORKERS, thread_name_prefix='upload')
+    return _pool
+
+
+def timed_save(storage, name, content) -> str:
+    """``storage.save``, timed into the upload latency metric."""
+    # __class__, not type(): default_storage is a lazy proxy
+    with UPLOAD_SECONDS.labels(storage.__class__.__name__).time():
+        return storage.save(name, content)
+
+
+def upload_files(items) -> list:
+    """
+    Save ``(storage, name, content)`` items concurrently on the upload pool.
+
+    ``content`` is a Django File. Returns the names the storage actually used,
+    in order. If any upload fails, the ones that succeeded are deleted again
+    and the first error is raised, so callers never see half a result.
+    """
+    pool = get_upload_pool()
+    futures = [
+        pool.submit(timed_save, storage, name, content)
+        for storage, name, content in items
+    ]
+    wait(futures)
+
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        for (storage, _, _), future in zip(items, futures):
+            if future.exception() is None:
+                storage.delete(future.result())
+        raise errors[0]
+    return [future.result() for future in futures]
+
+
+def _run_in_background(func, *args):
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("Background task %s failed", getattr(func, '__name__', func))
+    finally:
+        close_old_connections()
+
+
+def run_in_background(func, *args, pool=None) -> None:
+    """
+    Run ``func(*args)`` on ``pool`` (the upload pool by default) without waiting.
+
+    Errors are logged. Tasks that call ``upload_files`` themselves must use
+    another pool, since they would wait on the pool they are running on.
+    """
+    (pool or get_upload_pool()).submit(_run_in_background, func, *args)
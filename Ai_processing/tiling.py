@@ -0,0 +1,294 @@
+"""
+Tiled, memory-bounded image processing for large inputs.
+
+The input is cut into overlapping tiles, which run in parallel on the batch
+process pool. The input and the tile results travel through shared memory
+(see Ai_processing.shm); only small descriptors are pickled. Tiles are handled one horizontal band at a time: overlapping
+edges are feather-blended, and every output row that no later tile can touch
+is handed straight to a streaming PNG encoder. Peak memory is therefore set
+by the image width and AI_TILE_MEMORY_BUDGET_MB, not by the image height.
+
+Used for SUPER_RESOLUTION, where the output is many times larger than the
+input, but works with any per-tile function that scales both axes equally.
+"""
+
+import logging
+import struct
+import zlib
+from concurrent.futures import wait
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from . import shm
+from .batch import get_process_pool
+from .deadlines import check
+
+logger = logging.getLogger(__name__)
+
+MIN_TILE_SIZE = 64
+MAX_TILE_SIZE = 2048
+
+
+class PngStreamWriter:
+    """
+    Write an 8-bit PNG row by row.
+
+    Rows are Sub-filtered and fed through one zlib stream, so only the rows
+    passed to ``write_rows`` are ever held in memory.
+    """
+    COLOR_TYPES = {'L': 0, 'RGB': 2, 'RGBA': 6}
+
+    def __init__(self, fp, width: int, height: int, mode: str, compress_level: int = 6):
+        if mode not in self.COLOR_TYPES:
+            raise ValueError(f"Unsupported mode for streaming PNG: {mode}")
+        self.fp = fp
+        self.width = width
+        self.height = height
+        self.bands = len(mode)
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(compress_level)
+
+        fp.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, self.COLOR_TYPES[mode], 0, 0, 0))
+
+    def _chunk(self, kind: bytes, data: bytes) -> None:
+        self.fp.write(struct.pack('>I', len(data)))
+        self.fp.write(kind)
+        self.fp.write(data)
+        self.fp.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+    def write_rows(self, rows: np.ndarray) -> None:
+        """Append ``rows``, a uint8 array of shape (n, width, bands)."""
+        count = rows.shape[0]
+        flat = rows.reshape(count, self.width * self.bands)
+        filtered = np.empty((count, flat.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 1  # filter type: Sub
+        filtered[:, 1:self.bands + 1] = flat[:, :self.bands]
+        np.subtract(flat[:, self.bands:], flat[:, :-self.bands], out=filtered[:, self.bands + 1:])
+
+        data = self._compressor.compress(filtered.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+        self.rows_written += count
+
+    def close(self) -> None:
+        if self.rows_written != self.height:
+            raise ValueError(f"PNG expects {self.height} rows, got {self.rows_written}")
+        self._chunk(b'IDAT', self._compressor.flush())
+        self._chunk(b'IEND', b'')
+
+
+def _run_tile(func, mode, size, data):
+    """Process pool entry point: rebuild the tile, run ``func`` and return raw pixels."""
+    tile = Image.frombytes(mode, size, data)
+    result = func(tile)
+    if result.mode != mode:
+        result = result.convert(mode)
+    return result.size, result.tobytes()
+
+
+def _run_shared_tile(func, source, box, directory, prefix):
+    """
+    Process pool entry point: crop the tile from the shared input, run ``func``
+    and put the result in a segment of the caller's lease.
+    """
+    result = func(shm.crop(source, box))
+    if result.mode != source.mode:
+        result = result.convert(source.mode)
+    try:
+        return shm.share_result(directory, prefix, result)
+    except OSError:
+        # No room on the shared-memory filesystem; send the pixels back by value
+        return result.size, result.tobytes()
+
+
+def _share(lease, image: Image.Image):
+    """``image`` in a segment of ``lease``, or None to pass tiles by value."""
+    if lease is None:
+        return None
+    try:
+        return lease.share(image)
+    except OSError as e:
+        logger.warning("Shared memory unavailable (%s); passing tiles to the workers by value", e)
+        return None
+
+
+@contextmanager
+def _tile_pixels(result, bands: int):
+    """A tile result, shared or by value, as a (height, width, bands) uint8 array."""
+    if isinstance(result, shm.SharedImage):
+        try:
+            with shm.pixels(result) as pixels:
+                yield pixels
+        finally:
+            shm.release(result)
+        return
+    (tile_w, tile_h), data = result
+    yield np.frombuffer(data, dtype=np.uint8).reshape(tile_h, tile_w, bands)
+
+
+def _ramp(length: int, ramp: int, ramp_start: bool, ramp_end: bool) -> np.ndarray:
+    """1-D blend weights: linear ramps over the overlapping ends, 1 elsewhere."""
+    weights = np.ones(length, dtype=np.float32)
+    ramp = min(ramp, length)
+    if ramp <= 0:
+        return weights
+    rising = (np.arange(ramp, dtype=np.float32) + 0.5) / ramp
+    if ramp_start:
+        weights[:ramp] = np.minimum(weights[:ramp], rising)
+    if ramp_end:
+        weights[length - ramp:] = np.minimum(weights[length - ramp:], rising[::-1])
+    return weights
+
+
+def tile_size_for_budget(width: int, bands: int, scale: int, overlap: int, budget_bytes: int) -> int:
+    """
+    Pick the largest tile height whose band fits in ``budget_bytes``.
+
+    Per output pixel a band holds the uint8 tile results, a float32
+    accumulator and a float32 weight, i.e. about ``bands * 5 + 4`` bytes.
+    """
+    row_bytes = width * scale * (bands * 5 + 4)
+    band_rows = budget_bytes // max(row_bytes, 1) // scale
+    tile = int(band_rows) - 2 * overlap
+    return max(MIN_TILE_SIZE, 4 * overlap, min(tile, MAX_TILE_SIZE))
+
+
+def process_tiled(image: Image.Image, func, fp, scale: int = 1, tile_size=None,
+                  overlap=None, budget_bytes=None, compress_level: int = 6, progress=None):
+    """
+    Run ``func`` tile by tile over ``image`` and stream the result to ``fp`` as PNG.
+
+    Args:
+        image: PIL Image to process.
+        func: Module-level function taking and returning a PIL Image tile.
+            The output may be larger than the tile by an integer factor.
+        fp: Writable binary file object that receives the PNG.
+        scale: Expected size factor of ``func``; only used to plan memory,
+            the real factor is read from the first tile.
+        tile_size: Tile edge in input pixels; derived from the budget if None.
+        overlap: Input pixels shared between neighbouring tiles.
+        budget_bytes: Memory budget for one band of output.
+        compress_level: zlib level for the PNG stream.
+        progress: Optional callable ``progress(tiles_done, tiles_total)``.
+
+    Returns:
+        (width, height) of the written image.
+
+    Raises:
+        DeadlineExceeded: If the request's deadline passes; checked after every tile.
+    """
+    if image.mode not in PngStreamWriter.COLOR_TYPES:
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    image.load()
+
+    width, height = image.size
+    bands = len(image.mode)
+    overlap = settings.AI_TILE_OVERLAP if overlap is None else overlap
+    if budget_bytes is None:
+        budget_bytes = settings.AI_TILE_MEMORY_BUDGET_MB * 1024 * 1024
+    if tile_size is None:
+        tile_size = tile_size_for_budget(width, bands, scale, overlap, budget_bytes)
+    tile_size = max(tile_size, 2 * overlap + 1)
+
+    band_starts = list(range(0, height, tile_size))
+    column_starts = list(range(0, width, tile_size))
+    total = len(band_starts) * len(column_starts)
+    done = 0
+
+    pool = get_process_pool()
+    writer = None
+    out_scale = None
+    # Output rows still waiting for contributions from the next band
+    carry_start, carry_acc, carry_weight = 0, None, None
+
+    with (shm.lease() if settings.AI_SHM_ENABLED else nullcontext()) as lease:
+        # Workers crop their tiles from the shared input and return results the same way
+        source = _share(lease, image)
+        for band_index, by in enumerate(band_starts):
+            y0 = max(0, by - overlap)
+            y1 = min(height, by + tile_size + overlap)
+            is_last_band = band_index == len(band_starts) - 1
+
+            boxes = []
+            futures = []
+            for bx in column_starts:
+                x0 = max(0, bx - overlap)
+                x1 = min(width, bx + tile_size + overlap)
+                boxes.append((x0, x1))
+                if source is not None:
+                    futures.append(pool.submit(
+                        _run_shared_tile, func, source, (x0, y0, x1, y1), lease.directory, lease.prefix
+                    ))
+                else:
+                    tile = image.crop((x0, y0, x1, y1))
+                    futures.append(pool.submit(_run_tile, func, image.mode, tile.size, tile.tobytes()))
+
+            try:
+                for index, ((x0, x1), future) in enumerate(zip(boxes, futures)):
+                    with _tile_pixels(future.result(), bands) as pixels:
+                        tile_h, tile_w = pixels.shape[:2]
+                        tile_scale = tile_w // (x1 - x0)
+                        if out_scale is None:
+                            out_scale = tile_scale
+                            writer = PngStreamWriter(
+                                fp, width * out_scale, height * out_scale, image.mode, compress_level
+                            )
+                        if (tile_scale != out_scale or tile_w != (x1 - x0) * out_scale
+                                or tile_h != (y1 - y0) * out_scale):
+                            raise ValueError("Tile function must scale every tile by the same integer factor.")
+
+                        if index == 0:
+                            # First tile of the band: set up this band's accumulators
+                            band_rows = (y1 - y0) * out_scale
+                            acc = np.zeros((band_rows, width * out_scale, bands), dtype=np.float32)
+                            weight = np.zeros((band_rows, width * out_scale, 1), dtype=np.float32)
+                            if carry_acc is not None:
+                                offset = carry_start - y0 * out_scale
+                                acc[offset:offset + carry_acc.shape[0]] = carry_acc
+                                weight[offset:offset + carry_weight.shape[0]] = carry_weight
+
+                        ramp = 2 * overlap * out_scale
+                        wy = _ramp(tile_h, ramp, y0 > 0, y1 < height)
+                        wx = _ramp(tile_w, ramp, x0 > 0, x1 < width)
+                        tile_weight = (wy[:, None] * wx[None, :])[:, :, None]
+                        columns = slice(x0 * out_scale, x1 * out_scale)
+                        acc[:, columns] += pixels * tile_weight
+                        weight[:, columns] += tile_weight
+
+                    done += 1
+                    if progress is not None:
+                        progress(done, total)
+                    check('inference')
+            except BaseException:
+                # Drop the tiles not started yet, and let the running ones
+                # finish before the lease deletes their segments
+                for future in futures:
+                    future.cancel()
+                wait(futures)
+                raise
+
+            # Rows above the next band's first input row are final
+            final_rows = acc.shape[0] if is_last_band else (by + tile_size - overlap - y0) * out_scale
+            finished = acc[:final_rows] / np.maximum(weight[:final_rows], 1e-6)
+            writer.write_rows(np.clip(np.rint(finished), 0, 255).astype(np.uint8))
+
+            carry_start = (y0 * out_scale) + final_rows
+            carry_acc = acc[final_rows:].copy()
+            carry_weight = weight[final_rows:].copy()
+            del acc, weight, finished
+
+    writer.close()
+    return width * out_scale, height * out_scale
+
+
+def should_tile(image: Image.Image, steps) -> bool:
+    """Large inputs whose last step is SUPER_RESOLUTION go through the tiled engine."""
+    return (
+        bool(steps)
+        and steps[-1] == 'SUPER_RESOLUTION'
+        and image.width * image.height >= settings.AI_TILING_MIN_PIXELS
+    )
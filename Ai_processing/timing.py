@@ -0,0 +1,145 @@
+"""
+Per-stage timing of processing requests.
+
+A view method wrapped in ``timed_view`` gets a ``StageTimer`` for the
+duration of the request. Code anywhere below it marks stages with
+``with stage('encode'):`` (a no-op when no timer is active, e.g. in job
+workers). The timer travels in a context variable, so services don't need
+an extra argument. Stages are measured in the request's thread; work it
+hands to a pool counts toward the stage that waits for it.
+
+When the view returns, including with an error response such as a
+failed validation, the timings go out as a ``Server-Timing`` header and
+as one JSON log line on the ``Ai_processing.timing`` logger, together with
+whatever the view recorded with ``annotate`` (feature, input and output
+sizes). With AI_PROFILE_SAMPLE_RATE above 0, that fraction of requests also
+runs under cProfile and the stats are written to AI_PROFILE_DIR; the
+profile covers the request thread only.
+"""
+
+import contextvars
+import cProfile
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('stage_timer', default=None)
+# Only one cProfile profiler can be active per process at a time
+_profile_lock = threading.Lock()
+
+
+class StageTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.fields = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        # A stage entered more than once (e.g. per tile) is summed
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def header(self) -> str:
+        """``Server-Timing`` value, in ms, stages in the order they first ran."""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={self.total() * 1000:.1f}")
+        return ', '.join(parts)
+
+
+@contextmanager
+def stage(name: str):
+    """Time the ``with`` block as stage ``name`` of the current request, if any."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+def annotate(**fields) -> None:
+    """Add fields to the current request's timing log line."""
+    timer = _current.get()
+    if timer is not None:
+        timer.fields.update(fields)
+
+
+def _start_profile():
+    if random.random() >= settings.AI_PROFILE_SAMPLE_RATE:
+        return None
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler (e.g. a debugger) is already active
+        _profile_lock.release()
+        return None
+    return profiler
+
+
+def _stop_profile(profiler, view_name: str) -> str:
+    profiler.disable()
+    _profile_lock.release()
+    os.makedirs(settings.AI_PROFILE_DIR, exist_ok=True)
+    path = os.path.join(
+        settings.AI_PROFILE_DIR,
+        f"{view_name}-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.prof",
+    )
+    profiler.dump_stats(path)
+    return path
+
+
+def timed_view(view_name: str):
+    """Decorate a view method to time its stages, set Server-Timing and log the result."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            timer = StageTimer()
+            token = _current.set(timer)
+            profiler = _start_profile()
+            try:
+                response = method(self, request, *args, **kwargs)
+            except Exception as exc:
+                # Turn DRF errors (e.g. validation) into their response here, so
+                # rejected requests are timed and logged too; others re-raise
+                if not hasattr(self, 'handle_exception'):
+                    raise
+                response = self.handle_exception(exc)
+            finally:
+                _current.reset(token)
+                profile_path = _stop_profile(profiler, view_name) if profiler is not None else None
+
+            response['Server-Timing'] = timer.header()
+            for name, seconds in timer.stages.items():
+                STAGE_SECONDS.labels(name).observe(seconds)
+            logger.info(json.dumps({
+                'event': view_name,
+                'status': response.status_code,
+                'user_id': getattr(request.user, 'pk', None),
+                **timer.fields,
+                'stages_ms': {name: round(seconds * 1000, 1) for name, seconds in timer.stages.items()},
+                'total_ms': round(timer.total() * 1000, 1),
+                'profile': profile_path,
+            }, default=str))
+            return response
+        return wrapper
+    return decorator
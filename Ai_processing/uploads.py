@@ -0,0 +1,209 @@
+"""
+Resumable chunked uploads.
+
+A client creates an ``UploadSession`` for the file's size (and optionally
+its SHA-256). It then PUTs the bytes in order as byte-range chunks, each
+with a ``Content-Range`` and a ``Content-Digest: sha-256=:<base64>:``
+header, and finally finalizes the session into a processing request.
+
+Chunks are streamed from the request straight into the session's spool
+file in the job spool, 64 KB at a time and hashed on the way, so no chunk
+is held in memory. A chunk that fails its checksum, or arrives short, is cut
+off again, so the stored bytes are always a verified prefix of the file.
+After a dropped connection the client reads ``received`` from the session
+and continues from there. A chunk that was already stored in full is
+acknowledged again without being read.
+
+Each session's spool file is ``flock``-ed while a chunk is written or the
+session is finalized, so concurrent requests for one session get
+``UploadError('busy')`` instead of interleaving. Sessions idle for longer
+than AI_UPLOAD_SESSION_TTL are removed with their files by
+``expire_sessions``.
+"""
+
+import base64
+import binascii
+import fcntl
+import hashlib
+import os
+import re
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import File
+from django.utils import timezone
+
+from .models import UploadSession, job_spool_storage
+
+READ_BLOCK = 64 * 1024
+
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+_SHA256_DIGEST = re.compile(r'(?:^|,)\s*sha-256=:([A-Za-z0-9+/=]+):')
+
+
+class UploadError(ValueError):
+    """
+    A chunk or finalize request can't be accepted; ``code`` says why.
+
+    ``busy``, ``offset``, ``finalized`` and ``incomplete`` are conflicts with
+    the session's state; ``range``, ``digest``, ``checksum`` and ``short``
+    are problems with the request itself.
+    """
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+def parse_content_range(header, size: int):
+    """``(start, end)`` (inclusive) from a ``Content-Range: bytes start-end/size`` header."""
+    match = _CONTENT_RANGE.match((header or '').strip())
+    if match is None:
+        raise UploadError('range', "Content-Range must look like 'bytes <start>-<end>/<size>'.")
+    start, end, total = (int(value) for value in match.groups())
+    if total != size or start > end or end >= size:
+        raise UploadError('range', f"Content-Range does not fit an upload of {size} bytes.")
+    return start, end
+
+
+def parse_digest(header) -> bytes:
+    """The raw SHA-256 from a ``Content-Digest`` header (RFC 9530)."""
+    match = _SHA256_DIGEST.search(header or '')
+    if match is None:
+        raise UploadError('digest', "Content-Digest with a sha-256 value is required.")
+    try:
+        digest = base64.b64decode(match.group(1), validate=True)
+    except binascii.Error:
+        digest = b''
+    if len(digest) != 32:
+        raise UploadError('digest', "Content-Digest sha-256 value is not a base64 SHA-256.")
+    return digest
+
+
+def _spool_path(session: UploadSession) -> str:
+    return job_spool_storage().path(session.spool_name)
+
+
+def expire_sessions() -> int:
+    """Delete sessions idle for longer than AI_UPLOAD_SESSION_TTL, and their files."""
+    cutoff = timezone.now() - timedelta(seconds=settings.AI_UPLOAD_SESSION_TTL)
+    spool = job_spool_storage()
+    expired = list(UploadSession.objects.filter(updated_at__lt=cutoff))
+    for session in expired:
+        spool.delete(session.spool_name)
+    UploadSession.objects.filter(pk__in=[session.pk for session in expired]).delete()
+    return len(expired)
+
+
+def create_session(user, filename: str, size: int, sha256: str = '') -> UploadSession:
+    expire_sessions()
+    session = UploadSession.objects.create(user=user, filename=filename, size=size, sha256=sha256)
+    path = _spool_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return session
+
+
+@contextmanager
+def _locked(session: UploadSession):
+    """The session's spool file, open for writing and locked against other requests."""
+    try:
+        fd = os.open(_spool_path(session), os.O_RDWR)
+    except FileNotFoundError:
+        # Finalized (or expired) sessions have no spool file any more
+        raise UploadError('finalized', "This upload was already finalized.")
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError('busy', "Another request is using this upload.")
+        session.refresh_from_db(fields=['received', 'status'])
+        if session.status != 'OPEN':
+            raise UploadError('finalized', "This upload was already finalized.")
+        yield fd
+    finally:
+        os.close(fd)
+
+
+def write_chunk(session: UploadSession, stream, start: int, end: int, digest: bytes) -> int:
+    """
+    Store bytes ``start``..``end`` of the file from ``stream``.
+
+    Returns how many bytes of the file are now stored.
+
+    Raises:
+        UploadError: If the chunk does not continue the stored bytes, arrives
+            short, fails its checksum, or the session is busy or finalized.
+    """
+    with _locked(session) as fd:
+        received = session.received
+        if end < received:
+            # A retry of a chunk that was stored but not acknowledged
+            return received
+        if start != received:
+            raise UploadError('offset', f"Expected a chunk starting at byte {received}.")
+
+        remaining = end - start + 1
+        hasher = hashlib.sha256()
+        os.lseek(fd, start, os.SEEK_SET)
+        try:
+            while remaining:
+                block = stream.read(min(READ_BLOCK, remaining))
+                if not block:
+                    raise UploadError('short', "The request body is shorter than its Content-Range.")
+                hasher.update(block)
+                os.write(fd, block)
+                remaining -= len(block)
+            if hasher.digest() != digest:
+                raise UploadError('checksum', "The chunk does not match its Content-Digest.")
+        except BaseException:
+            # Keep only the verified prefix
+            os.ftruncate(fd, received)
+            raise
+
+        received = end + 1
+        UploadSession.objects.filter(pk=session.pk).update(received=received, updated_at=timezone.now())
+        session.received = received
+        return received
+
+
+@contextmanager
+def assembled_file(session: UploadSession):
+    """
+    The complete uploaded file, as a Django File, while the session stays locked.
+
+    Raises:
+        UploadError: If bytes are missing, the whole-file SHA-256 given at
+            creation does not match, or the session is busy or finalized.
+    """
+    with _locked(session):
+        if session.received != session.size:
+            raise UploadError('incomplete', f"Only {session.received} of {session.size} bytes were uploaded.")
+        path = _spool_path(session)
+        if session.sha256:
+            hasher = hashlib.sha256()
+            with open(path, 'rb') as f:
+                while block := f.read(READ_BLOCK):
+                    hasher.update(block)
+            if hasher.hexdigest() != session.sha256:
+                raise UploadError('checksum', "The uploaded file does not match its sha256.")
+        with open(path, 'rb') as f:
+            yield File(f, name=session.filename)
+
+
+def finish(session: UploadSession) -> None:
+    """Mark the session finalized and delete its spool file."""
+    UploadSession.objects.filter(pk=session.pk).update(status='FINALIZED', updated_at=timezone.now())
+    session.status = 'FINALIZED'
+    job_spool_storage().delete(session.spool_name)
+
+
+def discard(session: UploadSession) -> None:
+    """Abandon the session: delete it and its spool file."""
+    if session.status == 'FINALIZED':
+        session.delete()
+        return
+    with _locked(session):
+        job_spool_storage().delete(session.spool_name)
+        session.delete()
@@ -1,9 +1,33 @@
 from django.urls import path
 
-from .views import ProcessImageView
+from .views import (
+    BatchProcessImageView,
+    DirectUploadReceiveView,
+    DirectUploadTicketView,
+    ModelRegistryView,
+    ProcessImageView,
+    ProcessingJobEventsView,
+    ProcessingJobStatusView,
+    ProcessReferenceView,
+    QualityTiersView,
+    UploadSessionCreateView,
+    UploadSessionFinalizeView,
+    UploadSessionView,
+)
 
 app_name = "ai_processing"
 
 urlpatterns = [
     path("process/", ProcessImageView.as_view(), name="process_image"),
+    path("process/batch/", BatchProcessImageView.as_view(), name="process_batch"),
+    path("process/reference/", ProcessReferenceView.as_view(), name="process_reference"),
+    path("jobs/<uuid:pk>/", ProcessingJobStatusView.as_view(), name="job_status"),
+    path("jobs/<uuid:pk>/events/", ProcessingJobEventsView.as_view(), name="job_events"),
+    path("uploads/", UploadSessionCreateView.as_view(), name="upload_create"),
+    path("uploads/<uuid:pk>/", UploadSessionView.as_view(), name="upload_session"),
+    path("uploads/<uuid:pk>/finalize/", UploadSessionFinalizeView.as_view(), name="upload_finalize"),
+    path("direct-uploads/", DirectUploadTicketView.as_view(), name="direct_upload"),
+    path("direct-uploads/local/", DirectUploadReceiveView.as_view(), name="direct_upload_local"),
+    path("quality-tiers/", QualityTiersView.as_view(), name="quality_tiers"),
+    path("models/", ModelRegistryView.as_view(), name="model_registry"),
 ]
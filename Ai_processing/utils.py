@@ -4,54 +4,117 @@ Image processing utilities.
 Each function takes a PIL Image and returns a processed PIL Image.
 Currently all functions return the image UNCHANGED (pass-through).
 Replace each one with your actual AI model inference call.
+
+Models are fetched from ``model_registry`` so they are loaded once per
+process; register the real loader in MODEL_LOADERS below. With
+AI_INFERENCE_BACKEND=onnx, a feature that has an ONNX model file runs that
+on ONNX Runtime instead (see Ai_processing.backends). Calls go through
+``microbatch.infer``: a model that also has ``predict_batch(images)`` gets
+concurrent requests for its feature batched into one call.
+
+Every feature runs at a quality tier, ``fast``, ``balanced`` (the default)
+or ``best``; QUALITY_STRATEGIES says what each tier costs.
 """
 
+import time
+from contextlib import contextmanager
+from io import BytesIO
+
+import numpy as np
+from django.conf import settings
 from PIL import Image
 
+from .backends import has_tier_model, loader
+from .encoding import encode_image
+from .filters import apply_filters
+from .deadlines import check
+from .metrics import INFERENCE_IN_FLIGHT, PROCESSING_RATE, PROCESSING_SECONDS
+from .microbatch import infer
+from .registry import model_registry
 
-def apply_super_resolution(image: Image.Image) -> Image.Image:
+
+def _load_passthrough_model():
+    """
+    Placeholder loader: the "model" returns the image unchanged.
+    TODO: Replace with loaders that read your model weights.
+    """
+    return lambda image: image
+
+
+# Feature name -> callable that loads and returns the Python model
+MODEL_LOADERS = {
+    'SUPER_RESOLUTION': _load_passthrough_model,
+    'DE_NOISE': _load_passthrough_model,
+    'DE_BLUR': _load_passthrough_model,
+    'SHADOW_REMOVAL': _load_passthrough_model,
+}
+
+QUALITY_TIERS = ('fast', 'balanced', 'best')
+
+for _name, _loader in MODEL_LOADERS.items():
+    model_registry.register(_name, loader(_name, _loader))
+    # A tier's own model, when it has a file (see backends and model_name)
+    for _tier in ('fast', 'best'):
+        if has_tier_model(_name, _tier):
+            model_registry.register(f"{_name}:{_tier}", loader(_name, _loader, _tier))
+
+
+def model_name(feature: str, quality: str = 'balanced') -> str:
+    """Registry name of the model ``feature`` runs at ``quality``."""
+    if quality != 'balanced' and has_tier_model(feature, quality):
+        return f"{feature}:{quality}"
+    return feature
+
+
+# Output size factor of apply_super_resolution; used to plan tiling memory
+SUPER_RESOLUTION_SCALE = 1
+
+
+def apply_super_resolution(image: Image.Image, quality: str = 'balanced') -> Image.Image:
     """
     Placeholder for super-resolution AI model.
     Currently: returns image unchanged.
     TODO: Replace with your actual super-resolution model call.
     """
-    return image
+    return infer(model_name('SUPER_RESOLUTION', quality), image)
 
 
-def apply_basic_filter(image: Image.Image) -> Image.Image:
+def apply_basic_filter(image: Image.Image, filters=None) -> Image.Image:
     """
-    Placeholder for basic filter processing.
-    Currently: returns image unchanged.
-    TODO: Replace with your actual filter logic.
+    Brightness, contrast, gamma, saturation, sharpen and white balance
+    in a single vectorized pass (see Ai_processing.filters).
+    Without a filter spec the image is returned unchanged.
     """
-    return image
+    if not filters:
+        return image
+    return apply_filters(image, filters)
 
 
-def apply_denoise(image: Image.Image) -> Image.Image:
+def apply_denoise(image: Image.Image, quality: str = 'balanced') -> Image.Image:
     """
     Placeholder for denoising AI model.
     Currently: returns image unchanged.
     TODO: Replace with your actual denoising model call.
     """
-    return image
+    return infer(model_name('DE_NOISE', quality), image)
 
 
-def apply_deblur(image: Image.Image) -> Image.Image:
+def apply_deblur(image: Image.Image, quality: str = 'balanced') -> Image.Image:
     """
     Placeholder for deblurring AI model.
     Currently: returns image unchanged.
     TODO: Replace with your actual deblurring model call.
     """
-    return image
+    return infer(model_name('DE_BLUR', quality), image)
 
 
-def apply_shadow_removal(image: Image.Image) -> Image.Image:
+def apply_shadow_removal(image: Image.Image, quality: str = 'balanced') -> Image.Image:
     """
     Placeholder for shadow removal AI model.
     Currently: returns image unchanged.
     TODO: Replace with your actual shadow removal model call.
     """
-    return image
+    return infer(model_name('SHADOW_REMOVAL', quality), image)
 
 
 # Dispatcher — maps feature name to processing function
@@ -64,21 +127,196 @@ PROCESSING_FUNCTIONS = {
 }
 
 
-def process_image(image: Image.Image, feature: str) -> Image.Image:
+# Bump a feature's version whenever its model changes; cached results
+# produced by an older version are then ignored (see Ai_processing.cache).
+MODEL_VERSIONS = {
+    'SUPER_RESOLUTION': '1',
+    'BASIC_FILTER': '1',
+    'DE_NOISE': '1',
+    'DE_BLUR': '1',
+    'SHADOW_REMOVAL': '1',
+}
+
+
+# Longest input side each feature can make use of; None means full resolution.
+# JPEG uploads bigger than this are decoded at a reduced scale (draft mode),
+# so the result is that much smaller too. Super-resolution and deblurring
+# work on fine detail and always get every pixel; shadows are smooth, so
+# shadow removal gains nothing past a few megapixels.
+FEATURE_INPUT_MAX_SIDE = {
+    'SUPER_RESOLUTION': None,
+    'BASIC_FILTER': 8192,
+    'DE_NOISE': 4096,
+    'DE_BLUR': None,
+    'SHADOW_REMOVAL': 2048,
+}
+
+
+# What each quality tier does per feature:
+#   input_scale: run the model at this fraction of the resolution and
+#     upsample its result to the full-resolution size
+#   passes: 2 also runs the model on the mirrored image and averages the two
+#     (self-ensemble), for roughly twice the cost
+# A tier with a model of its own (see backends) uses it on top of this.
+# Model time is roughly proportional to pixels, so a tier costs about
+# passes * input_scale ** 2 times the balanced tier (see relative_cost).
+_FAST = {'input_scale': 0.5, 'passes': 1}
+_BALANCED = {'input_scale': 1, 'passes': 1}
+_BEST = {'input_scale': 1, 'passes': 2}
+
+QUALITY_STRATEGIES = {
+    'SUPER_RESOLUTION': {'fast': _FAST, 'balanced': _BALANCED, 'best': _BEST},
+    # One vectorized pass already; no cheaper or better way to run it
+    'BASIC_FILTER': {'fast': _BALANCED, 'balanced': _BALANCED, 'best': _BALANCED},
+    'DE_NOISE': {'fast': _FAST, 'balanced': _BALANCED, 'best': _BEST},
+    'DE_BLUR': {'fast': _FAST, 'balanced': _BALANCED, 'best': _BEST},
+    'SHADOW_REMOVAL': {'fast': _FAST, 'balanced': _BALANCED, 'best': _BEST},
+}
+
+# Images are not run at reduced resolution when that would make their short side smaller
+QUALITY_MIN_SIDE = 64
+
+
+def relative_cost(feature: str, quality: str) -> float:
+    """Rough processing time of ``feature`` at ``quality`` over its time at ``balanced``."""
+    strategy = QUALITY_STRATEGIES[feature][quality]
+    return strategy['passes'] * strategy['input_scale'] ** 2
+
+
+def input_max_side(steps):
+    """Longest input side the whole pipeline needs, or None for full resolution."""
+    sides = [FEATURE_INPUT_MAX_SIDE.get(feature) for feature in steps]
+    if not sides or None in sides:
+        return None
+    return max(sides)
+
+
+def _average(first: Image.Image, second: Image.Image) -> Image.Image:
+    """
+    The pixel-wise mean of two images of the same size, in ``first``'s mode.
+
+    Palette and bilevel images come back as RGB(A), since their values can't
+    be averaged. Image.blend only handles 8-bit modes, so 32-bit integer,
+    16-bit and float images are averaged in NumPy.
+    """
+    if first.mode in ('1', 'P', 'PA'):
+        first = first.convert('RGBA' if first.has_transparency_data else 'RGB')
+    second = second.convert(first.mode)
+    if first.mode.startswith(('I', 'F')):
+        pixels = np.asarray(first)
+        mean = (pixels.astype(np.float64) + np.asarray(second)) / 2
+        if pixels.dtype.kind != 'f':
+            mean = np.rint(mean)
+        return Image.fromarray(mean.astype(pixels.dtype))
+    return Image.blend(first, second, 0.5)
+
+
+def run_at_quality(image: Image.Image, feature: str, quality: str, **options) -> Image.Image:
+    """
+    Run ``feature``'s function with the QUALITY_STRATEGIES entry for ``quality``.
+
+    The result has the size the function gives at full resolution, so this
+    can stand in for it anywhere, including per tile.
+    """
+    strategy = QUALITY_STRATEGIES[feature][quality]
+    func = PROCESSING_FUNCTIONS[feature]
+    if feature in MODEL_LOADERS:
+        options['quality'] = quality
+
+    source = image
+    scale = strategy['input_scale']
+    if scale < 1 and min(image.size) * scale >= QUALITY_MIN_SIDE:
+        source = image.resize((round(image.width * scale), round(image.height * scale)), Image.BOX)
+
+    result = func(source, **options)
+    if strategy['passes'] > 1:
+        mirrored = func(source.transpose(Image.FLIP_LEFT_RIGHT), **options).transpose(Image.FLIP_LEFT_RIGHT)
+        result = _average(result, mirrored)
+
+    if source is not image:
+        size = (
+            round(result.width * image.width / source.width),
+            round(result.height * image.height / source.height),
+        )
+        result = result.resize(size, Image.LANCZOS)
+    return result
+
+
+@contextmanager
+def timed_processing(feature: str, quality: str, image: Image.Image):
+    """Track the ``with`` block as ``feature`` running on ``image``: in flight, then time and time per megapixel."""
+    with INFERENCE_IN_FLIGHT.labels(feature).track_inprogress():
+        started = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - started
+    PROCESSING_SECONDS.labels(feature, quality).observe(seconds)
+    PROCESSING_RATE.labels(feature, quality).observe(seconds / max(image.width * image.height / 1e6, 1e-6))
+
+
+def process_image(image: Image.Image, feature: str, quality: str = None, **options) -> Image.Image:
     """
     Dispatch image processing based on the selected feature.
 
     Args:
         image: PIL Image to process.
         feature: One of SUPER_RESOLUTION, BASIC_FILTER, DE_NOISE, DE_BLUR, SHADOW_REMOVAL.
+        quality: One of QUALITY_TIERS; AI_DEFAULT_QUALITY_TIER when omitted.
+        **options: Extra keyword arguments for the feature's function.
 
     Returns:
         Processed PIL Image.
 
     Raises:
-        ValueError: If the feature is not recognized.
+        ValueError: If the feature or quality tier is not recognized.
     """
-    func = PROCESSING_FUNCTIONS.get(feature)
-    if func is None:
+    if feature not in PROCESSING_FUNCTIONS:
         raise ValueError(f"Unknown feature: {feature}")
-    return func(image)
+    quality = quality or settings.AI_DEFAULT_QUALITY_TIER
+    if quality not in QUALITY_TIERS:
+        raise ValueError(f"Unknown quality tier: {quality}")
+    with timed_processing(feature, quality, image):
+        return run_at_quality(image, feature, quality, **options)
+
+
+def run_pipeline(image: Image.Image, steps, options=None, quality=None) -> Image.Image:
+    """
+    Run several features in order on the same in-memory image.
+
+    The output of each step is passed straight to the next one, so the image
+    is decoded once and encoded once no matter how many steps there are.
+
+    Args:
+        image: PIL Image to process.
+        steps: Ordered list of feature names.
+        options: Optional dict of feature name -> keyword arguments for it,
+            e.g. {'BASIC_FILTER': {'filters': {...}}}.
+        quality: Quality tier every step runs at.
+
+    Returns:
+        Processed PIL Image.
+
+    Raises:
+        ValueError: If any feature or the quality tier is not recognized.
+        DeadlineExceeded: If the request's deadline passes between steps.
+    """
+    options = options or {}
+    for feature in steps:
+        # Stops here once the request's deadline (if any) has passed
+        check('inference')
+        image = process_image(image, feature, quality, **options.get(feature, {}))
+    return image
+
+
+def process_image_bytes(data: bytes, steps, options=None, output=None, quality=None) -> bytes:
+    """
+    Decode, run the pipeline and encode an image in one call.
+
+    Works on plain bytes so it can run in a separate worker process.
+    ``output`` is an encoding spec (see ``encoding.py``), PNG by default.
+
+    Raises:
+        ValueError: If a feature is not recognized.
+    """
+    image = Image.open(BytesIO(data))
+    processed = run_pipeline(image, steps, options, quality)
+    return encode_image(processed, output)
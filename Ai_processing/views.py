@@ -1,17 +1,46 @@
-import uuid
-from io import BytesIO
-
-from django.core.files.base import ContentFile
-from PIL import Image
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views import View
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from user_history.models import User_History
-
-from .serializers import ImageProcessSerializer
-from .utils import process_image
+from . import cache, deadlines, direct_uploads, microbatch, quality, uploads
+from .admission import AdmissionRejected, admission
+from .batch import process_batch
+from .deadlines import DeadlineExceeded
+from .idempotency import idempotent
+from .decoding import UploadRejected, decode_image, open_upload
+from .encoding import extension, format_from_name
+from .jobs import enqueue_job
+from .models import ProcessingJob, UploadSession
+from .progress import authenticated_user, job_events
+from .registry import model_registry
+from .serializers import (
+    BatchImageProcessSerializer,
+    DirectUploadTicketSerializer,
+    ImageProcessSerializer,
+    ProcessingJobSerializer,
+    ProcessReferenceSerializer,
+    UploadSessionCreateSerializer,
+    UploadSessionSerializer,
+)
+from .services import (
+    OutputFormatUnavailable,
+    absolute_url,
+    render_output,
+    save_histories,
+    save_history,
+    save_history_from_stored,
+)
+from .timing import annotate, stage, timed_view
+from .utils import input_max_side
 
 
 class ProcessImageView(APIView):
@@ -20,71 +49,627 @@ class ProcessImageView(APIView):
 
     Accepts a multipart/form-data request with:
       - image: the uploaded image file
-      - feature: one of SUPER_RESOLUTION, BASIC_FILTER, DE_NOISE, DE_BLUR, SHADOW_REMOVAL
+      - feature: one of SUPER_RESOLUTION, BASIC_FILTER, DE_NOISE, DE_BLUR, SHADOW_REMOVAL,
+        or an ordered list of them (repeated field or comma-separated) to run as a pipeline
+      - mode (optional): "sync" (default) or "async"
+      - filters (optional): JSON object of BASIC_FILTER adjustments
+        (brightness, contrast, gamma, saturation, sharpen, white_balance)
+      - output_format (optional): png, jpeg, webp or avif; otherwise negotiated
+        from the Accept header (e.g. "application/json, image/webp"), then AI_OUTPUT_FORMAT.
+        Tiled super-resolution (large inputs) only writes PNG: a negotiated or default
+        format falls back to it (``output_format`` vs ``requested_output_format`` in the
+        response), an explicit other output_format gets 406
+      - quality (optional): 1-100 for jpeg/webp/avif
+      - compress_level (optional): 0-9 for png
+      - quality_tier (optional): fast, balanced or best (default AI_DEFAULT_QUALITY_TIER);
+        see GET /api/processing/quality-tiers/ for what each does and costs
+      - deadline_ms (optional, or the X-Deadline-Ms header): how long the client will wait
+        (default AI_DEFAULT_DEADLINE_MS; sync mode only)
 
-    Returns URLs for the original and processed images + saves to user history.
+    In sync mode, returns URLs for the original and processed images + saves to user history,
+    along with the output format, encoded size in bytes and encode time in ms.
+    A node runs at most AI_ADMISSION_SLOTS sync requests at once; others wait briefly
+    (users with an active PREMIUM subscription first) or get 503 with Retry-After.
+    Every response carries a Server-Timing header with the time spent in each stage
+    (cache, queue, decode, inference, encode, upload, db, ...).
+    With a deadline, a cheaper quality tier is used when the requested one is not
+    expected to finish in time (``degraded`` in the response), and the work stops
+    with 504 once the deadline passes; nothing is stored then.
+    With an Idempotency-Key header, a retry with the same key gets the first
+    successful response back (Idempotent-Replayed: true) instead of processing
+    again; a retry sent while the first request still runs waits for its result.
+    In async mode, queues a background job and returns its id right away (202);
+    poll GET /api/processing/jobs/<job_id>/ for progress and the final URLs, or
+    stream them from GET /api/processing/jobs/<job_id>/events/.
     """
     permission_classes = [IsAuthenticated]
 
+    @timed_view('process_image')
+    @idempotent
     def post(self, request):
-        serializer = ImageProcessSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        return self.process(request, request.data)
 
-        uploaded_image = serializer.validated_data['image']
-        feature = serializer.validated_data['feature']
+    def process(self, request, data):
+        serializer = ImageProcessSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
 
-        # Open the uploaded image with Pillow
         try:
-            pil_image = Image.open(uploaded_image)
-        except Exception:
+            deadline_ms = (
+                serializer.validated_data.get('deadline_ms')
+                or deadlines.parse_header(request.headers.get(deadlines.HEADER))
+                or settings.AI_DEFAULT_DEADLINE_MS
+            )
+        except ValueError:
             return Response(
-                {"error": "Invalid image file. Could not open the image."},
+                {"error": f"{deadlines.HEADER} must be a positive whole number of milliseconds."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+        if serializer.validated_data.get('mode') == 'async':
+            # Nobody is waiting on the response of a background job
+            deadline_ms = None
+        annotate(deadline_ms=deadline_ms or None)
+
+        try:
+            with deadlines.deadline(deadline_ms):
+                return self._process(request, serializer)
+        except DeadlineExceeded as e:
+            annotate(deadline_stage=e.stage)
+            return Response({
+                "error": "The deadline passed before the image was processed.",
+                "stage": e.stage,
+                "deadline_ms": deadline_ms,
+            }, status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+    def queued(self, request, job):
+        """The 202 response for a job that was just queued."""
+        status_url = request.build_absolute_uri(
+            reverse('ai_processing:job_status', kwargs={'pk': job.pk})
+        )
+        events_url = request.build_absolute_uri(
+            reverse('ai_processing:job_events', kwargs={'pk': job.pk})
+        )
+        return Response({
+            "message": "Image queued for processing",
+            "job_id": job.pk,
+            "status": job.status,
+            "status_url": status_url,
+            "events_url": events_url,
+        }, status=status.HTTP_202_ACCEPTED)
+
+    def _process(self, request, serializer):
+        uploaded_image = serializer.validated_data['image']
+        steps = serializer.validated_data['feature']
+        options = serializer.get_options()
+        output = serializer.get_output(request.headers.get('Accept'))
+        requested_tier = tier = serializer.validated_data['quality_tier']
+        degraded = False
+        annotate(
+            feature=cache.pipeline_name(steps),
+            mode=serializer.validated_data.get('mode') or 'sync',
+            quality_tier=tier,
+            input_bytes=uploaded_image.size,
+        )
+
+        if serializer.validated_data.get('mode') == 'async':
+            job = enqueue_job(request.user, uploaded_image, steps, options, output, tier)
+            return self.queued(request, job)
+
+        # --- Reuse a stored result for an identical upload ---
+        with stage('cache'):
+            cache_key = cache.cache_key(
+                uploaded_image, steps, {'options': options, 'output': output, 'quality_tier': tier}
+            )
+            cached = cache.lookup(cache_key)
+        if cached is not None:
+            with stage('db'):
+                # The renditions are shared too, so the new row needs no lazy generation
+                history = save_history_from_stored(
+                    request.user, cached.original_image, cached.processed_image, steps,
+                    derivatives=cached.derivatives, quality=tier,
+                )
+            report = {'format': format_from_name(cached.processed_image), 'bytes': None, 'encode_ms': None}
+        else:
+            # Decode and process only while holding one of the node's inference slots;
+            # a saturated node answers 503 instead of queueing without bound
+            try:
+                with admission(request.user):
+                    # Decode the image the serializer already opened (header only so far)
+                    deadlines.check('decode')
+                    try:
+                        with stage('decode'):
+                            pil_image = decode_image(uploaded_image.image, input_max_side(steps))
+                    except Exception:
+                        return Response(
+                            {"error": "Invalid image file. Could not open the image."},
+                            status=status.HTTP_400_BAD_REQUEST,
+                        )
+
+                    # Under a deadline, drop to a cheaper tier if the requested one would miss it
+                    tier, degraded = quality.plan(steps, tier, pil_image.width * pil_image.height / 1e6)
+                    annotate(quality_tier=tier, degraded=degraded)
+
+                    # Run every step on the decoded image, in memory (large super-resolution is tiled),
+                    # then encode on the encode pool
+                    try:
+                        processed_file, report, renditions = render_output(
+                            pil_image, steps, options, output, quality=tier,
+                            require_format='output_format' in serializer.validated_data,
+                        )
+                    except OutputFormatUnavailable as e:
+                        return Response(
+                            {"error": str(e), "output_formats": ['png']},
+                            status=status.HTTP_406_NOT_ACCEPTABLE,
+                        )
+                    except ValueError as e:
+                        return Response(
+                            {"error": str(e)},
+                            status=status.HTTP_400_BAD_REQUEST,
+                        )
+                    annotate(input_width=pil_image.width, input_height=pil_image.height)
+            except AdmissionRejected as e:
+                return Response(
+                    {"error": "Server is busy, please retry later.", "reason": e.reason},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': str(e.retry_after)},
+                )
+
+            # --- Store both images and create the User_History record ---
+            # Both uploads run concurrently (the original optionally after the response);
+            # the upload itself goes to storage, no copy of the original bytes.
+            # A degraded result is not what cache_key asked for, so it is not cached
+            deadlines.check('upload')
+            history = save_history(
+                request.user, uploaded_image, processed_file, steps, extension(report),
+                defer_original=settings.AI_DEFER_ORIGINAL_UPLOAD,
+                renditions=renditions,
+                quality=tier,
+                on_stored=None if degraded else lambda stored: cache.store(
+                    cache_key, steps, stored.image_uploaded.name, stored.restored_image.name, stored.derivatives
+                ),
+            )
+
+        annotate(
+            cached=cached is not None,
+            output_format=report['format'],
+            output_bytes=report['bytes'],
+            output_width=report.get('width'),
+            output_height=report.get('height'),
+        )
+        return Response({
+            "message": "Image processed successfully",
+            "feature_used": history.feature_used,
+            "pipeline": steps,
+            "quality_tier": tier,
+            "requested_quality_tier": requested_tier,
+            "degraded": degraded,
+            "original_image": absolute_url(request, history.image_uploaded),
+            "processed_image": absolute_url(request, history.restored_image),
+            "history_id": history.id,
+            "cached": cached is not None,
+            "output_format": report['format'],
+            "requested_output_format": output['format'],
+            "encoded_bytes": report['bytes'],
+            "encode_ms": report['encode_ms'],
+        }, status=status.HTTP_200_OK)
+
+
+class BatchProcessImageView(APIView):
+    """
+    POST /api/processing/process/batch/
+
+    Accepts a multipart/form-data request with repeated fields:
+      - images: the uploaded image files
+      - features: one feature (or comma-separated pipeline) per image, in the same order
+      - output_format, quality, compress_level, quality_tier (optional): as for /process/, for every image
+
+    Images are processed concurrently on a process pool, their files are
+    uploaded concurrently on the upload pool and all history rows are written
+    with a single bulk_create. Returns one result per image; an
+    invalid image or feature only fails its own entry.
+    The batch waits for one admission slot like one /process/ request (503
+    with Retry-After when the node is saturated), takes more slots if they
+    are free, and keeps one image in flight per slot held.
+    Honors Idempotency-Key like /process/.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @idempotent
+    def post(self, request):
+        serializer = BatchImageProcessSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        output = serializer.get_output(request.headers.get('Accept'))
+        tier = serializer.validated_data['quality_tier']
+
+        results = [None] * len(serializer.validated_data['images'])
+        pending = []  # (index, original bytes, pipeline steps)
+        for index, item in enumerate(serializer.item_serializers()):
+            if item.errors:
+                results[index] = {"index": index, "status": "error", "error": item.errors}
+                continue
+            uploaded_image = item.validated_data['image']
+            uploaded_image.seek(0)
+            pending.append((index, uploaded_image.read(), item.validated_data['feature']))
 
-        # Process the image
+        # --- Process in parallel, one image in flight per inference slot held ---
         try:
-            processed_pil = process_image(pil_image, feature)
-        except ValueError as e:
+            wanted = max(1, min(len(pending), settings.AI_BATCH_WORKERS))
+            with admission(request.user, slots=wanted) as slots:
+                outputs = process_batch([(data, steps) for _, data, steps in pending], output, tier, slots)
+        except AdmissionRejected as e:
             return Response(
-                {"error": str(e)},
-                status=status.HTTP_400_BAD_REQUEST,
+                {"error": "Server is busy, please retry later.", "reason": e.reason},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(e.retry_after)},
             )
 
-        # --- Save the original uploaded image as a Django file ---
-        unique_id = uuid.uuid4().hex[:12]
-        original_name = f"original_{unique_id}.png"
+        succeeded = []  # (index, (original bytes, processed bytes, steps))
+        for (index, original_bytes, steps), result in zip(pending, outputs):
+            if isinstance(result, Exception):
+                results[index] = {"index": index, "status": "error", "error": str(result) or "Processing failed."}
+                continue
+            succeeded.append((index, (original_bytes, result, steps)))
+
+        # --- Upload every file concurrently, then one INSERT for all successful items ---
+        histories = save_histories(request.user, [item for _, item in succeeded], extension(output), tier)
+
+        for (index, _), history in zip(succeeded, histories):
+            results[index] = {
+                "index": index,
+                "status": "ok",
+                "feature_used": history.feature_used,
+                "pipeline": history.pipeline,
+                "quality_tier": history.quality_tier,
+                "original_image": absolute_url(request, history.image_uploaded),
+                "processed_image": absolute_url(request, history.restored_image),
+                "history_id": history.id,
+                "output_format": output['format'],
+            }
 
-        # Reset file pointer and save original
-        uploaded_image.seek(0)
-        original_content = ContentFile(uploaded_image.read(), name=original_name)
+        return Response({
+            "message": "Batch processed",
+            "processed": len(histories),
+            "failed": len(results) - len(histories),
+            "results": results,
+        }, status=status.HTTP_200_OK)
 
-        # --- Save the processed image as a Django file ---
-        processed_buffer = BytesIO()
-        processed_pil.save(processed_buffer, format='PNG')
-        processed_buffer.seek(0)
 
-        processed_name = f"processed_{unique_id}.png"
-        processed_content = ContentFile(processed_buffer.read(), name=processed_name)
+class ProcessingJobStatusView(APIView):
+    """
+    GET /api/processing/jobs/<job_id>/
 
-        # --- Create User_History record ---
-        history = User_History.objects.create(
+    Returns the status, current stage and progress of a background job.
+    Once the job is COMPLETED the response also carries the image URLs.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        job = get_object_or_404(
+            ProcessingJob.objects.select_related('history'),
+            pk=pk,
             user=request.user,
-            image_uploaded=original_content,
-            restored_image=processed_content,
-            feature_used=feature,
         )
+        serializer = ProcessingJobSerializer(job, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class ProcessingJobEventsView(View):
+    """
+    GET /api/processing/jobs/<job_id>/events/
+
+    Server-Sent Events (text/event-stream) for a background job: a "progress"
+    event whenever the stage (decoding, decoded, processing, encoding,
+    uploading), percent or tiles done/total change, then "done" with the same
+    body as the status endpoint, or "failed". Authenticate with the usual
+    Authorization: Bearer header.
+
+    The view is async and only touches the database from threads, so served by
+    the ASGI application (API/asgi.py) an open stream holds no worker thread.
+    """
+
+    async def get(self, request, pk):
+        user = await sync_to_async(authenticated_user)(request)
+        if user is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+        if not await ProcessingJob.objects.filter(pk=pk, user=user).aexists():
+            return JsonResponse({"detail": "No ProcessingJob matches the given query."}, status=404)
+
+        def final_payload():
+            job = ProcessingJob.objects.select_related('history').get(pk=pk)
+            return ProcessingJobSerializer(job, context={'request': request}).data
 
-        # --- Build full absolute URLs for the images ---
-        orig_url = history.image_uploaded.url
-        proc_url = history.restored_image.url
-        original_url = orig_url if orig_url.startswith('http') else request.build_absolute_uri(orig_url)
-        processed_url = proc_url if proc_url.startswith('http') else request.build_absolute_uri(proc_url)
+        response = StreamingHttpResponse(job_events(pk, final_payload), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Let nginx pass events through as they are written
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
+
+class UploadSessionCreateView(APIView):
+    """
+    POST /api/processing/uploads/
+
+    Starts a resumable upload for a large image. JSON body:
+      - filename: original file name
+      - size: total size in bytes (at most AI_MAX_UPLOAD_BYTES)
+      - sha256 (optional): hex SHA-256 of the whole file, checked on finalize
+
+    Returns the session (201) with its upload_url, finalize_url and a
+    suggested chunk_size. Sessions idle for AI_UPLOAD_SESSION_TTL seconds expire.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = UploadSessionCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session = uploads.create_session(request.user, **serializer.validated_data)
         return Response({
-            "message": "Image processed successfully",
-            "feature_used": feature,
-            "original_image": original_url,
-            "processed_image": processed_url,
-            "history_id": history.id,
+            **UploadSessionSerializer(session).data,
+            "chunk_size": settings.AI_UPLOAD_CHUNK_SIZE,
+            "upload_url": request.build_absolute_uri(
+                reverse('ai_processing:upload_session', kwargs={'pk': session.pk})
+            ),
+            "finalize_url": request.build_absolute_uri(
+                reverse('ai_processing:upload_finalize', kwargs={'pk': session.pk})
+            ),
+        }, status=status.HTTP_201_CREATED)
+
+
+# HTTP status for each uploads.UploadError code
+UPLOAD_ERROR_STATUS = {
+    'busy': status.HTTP_409_CONFLICT,
+    'offset': status.HTTP_409_CONFLICT,
+    'finalized': status.HTTP_409_CONFLICT,
+    'incomplete': status.HTTP_409_CONFLICT,
+    'range': status.HTTP_400_BAD_REQUEST,
+    'digest': status.HTTP_400_BAD_REQUEST,
+    'checksum': status.HTTP_400_BAD_REQUEST,
+    'short': status.HTTP_400_BAD_REQUEST,
+}
+
+
+def _upload_error(session, error):
+    return Response(
+        {"error": str(error), "code": error.code, "received": session.received},
+        status=UPLOAD_ERROR_STATUS[error.code],
+    )
+
+
+class UploadSessionView(APIView):
+    """
+    GET /api/processing/uploads/<upload_id>/
+    PUT /api/processing/uploads/<upload_id>/
+    DELETE /api/processing/uploads/<upload_id>/
+
+    GET returns the session; ``received`` is where the next chunk starts,
+    so a client resumes from there after a dropped connection.
+
+    PUT stores one chunk. The raw bytes are the body, with headers
+      - Content-Range: bytes <start>-<end>/<size> (end inclusive; start must equal received)
+      - Content-Digest: sha-256=:<base64 SHA-256 of the chunk>:
+    and the response holds the new ``received`` count. Re-sending a chunk
+    that was already stored is acknowledged without rewriting it. A chunk
+    out of order, or a second request while one is in progress, gets 409.
+
+    DELETE abandons the upload.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+        return Response(UploadSessionSerializer(session).data, status=status.HTTP_200_OK)
+
+    def put(self, request, pk):
+        session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+        try:
+            start, end = uploads.parse_content_range(request.headers.get('Content-Range'), session.size)
+            digest = uploads.parse_digest(request.headers.get('Content-Digest'))
+            content_length = request.headers.get('Content-Length')
+            if content_length and int(content_length) != end - start + 1:
+                raise uploads.UploadError('range', "Content-Length does not match Content-Range.")
+            # Read the body as a stream; request.data would buffer it
+            received = uploads.write_chunk(session, request.stream, start, end, digest)
+        except uploads.UploadError as e:
+            return _upload_error(session, e)
+        return Response({
+            "received": received,
+            "size": session.size,
+            "complete": received == session.size,
+        }, status=status.HTTP_200_OK)
+
+    def delete(self, request, pk):
+        session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+        try:
+            uploads.discard(session)
+        except uploads.UploadError as e:
+            return _upload_error(session, e)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadSessionFinalizeView(ProcessImageView):
+    """
+    POST /api/processing/uploads/<upload_id>/finalize/
+
+    Processes a fully uploaded session exactly like POST /api/processing/process/,
+    with the same fields except ``image`` (feature, mode, filters, output_format, ...),
+    and returns the same response. The assembled file goes straight from the
+    spool into the pipeline. Returns 409 while bytes are missing; if the
+    request fails (e.g. a bad feature), the upload is kept and can be finalized again.
+    """
+
+    @timed_view('process_image')
+    @idempotent
+    def post(self, request, pk):
+        session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+        try:
+            with uploads.assembled_file(session) as assembled:
+                data = request.data.copy()
+                data['image'] = assembled
+                response = self.process(request, data)
+                if status.is_success(response.status_code):
+                    uploads.finish(session)
+        except uploads.UploadError as e:
+            return _upload_error(session, e)
+        return response
+
+
+class DirectUploadTicketView(APIView):
+    """
+    POST /api/processing/direct-uploads/
+
+    Issues a short-lived ticket to upload one image straight to the media
+    storage, so its bytes never pass through this server. JSON body:
+      - filename: original file name
+
+    Returns (201):
+      - upload: ``method``, ``url``, form ``fields`` and ``file_field``;
+        POST the fields plus the file (as ``file_field``) to ``url`` as
+        multipart/form-data within ``expires_in`` seconds. ``format`` is
+        the format the stored image will have (from the filename's
+        extension), or null when any image format is accepted
+      - reference: pass it to POST /api/processing/process/reference/
+      - process_url: that endpoint's URL
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = DirectUploadTicketSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ticket = direct_uploads.issue_ticket(request.user, serializer.validated_data['filename'])
+        ticket['upload']['url'] = request.build_absolute_uri(ticket['upload']['url'])
+        ticket['process_url'] = request.build_absolute_uri(reverse('ai_processing:process_reference'))
+        return Response(ticket, status=status.HTTP_201_CREATED)
+
+
+class DirectUploadReceiveView(APIView):
+    """
+    POST /api/processing/direct-uploads/local/
+
+    The upload target of tickets issued while media is stored locally
+    (no CLOUDINARY_URL); it stands in for the Cloudinary upload API.
+    multipart/form-data with the ticket's ``token`` and the ``file``.
+    The token authorizes the upload, so no login is needed. Each token
+    uploads one file (409 once it exists), like Cloudinary only in the
+    ticket's formats, or its one ``format`` when it has one (415), and up
+    to its size (413).
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        if not hasattr(default_storage, 'verify_presigned'):
+            return Response({"error": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            ticket = default_storage.verify_presigned(request.data.get('token', ''))
+        except signing.BadSignature as e:
+            return Response({"error": str(e) or "Invalid upload token."}, status=status.HTTP_403_FORBIDDEN)
+        name = ticket['name']
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "No file was sent."}, status=status.HTTP_400_BAD_REQUEST)
+        if upload.size > ticket['max_bytes']:
+            return Response(
+                {"error": f"Image file is too large (max {ticket['max_bytes']} bytes)."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        try:
+            image_format = open_upload(upload, max_bytes=ticket['max_bytes']).format
+        except UploadRejected as e:
+            if e.code != 'invalid_image':
+                return Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            image_format = None
+        allowed = [ticket['format']] if ticket.get('format') else ticket['formats']
+        if image_format not in {direct_uploads.FORMATS.get(key) for key in allowed}:
+            return Response(
+                {"error": f"Upload an image in one of these formats: {', '.join(allowed)}."},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            )
+        try:
+            stored = default_storage.save_new(name, upload)
+        except FileExistsError:
+            return Response({"error": "This ticket was already used."}, status=status.HTTP_409_CONFLICT)
+        return Response({"name": stored, "bytes": upload.size}, status=status.HTTP_201_CREATED)
+
+
+DIRECT_UPLOAD_ERROR_STATUS = {
+    'invalid': status.HTTP_400_BAD_REQUEST,
+    'missing': status.HTTP_404_NOT_FOUND,
+    'too_large': status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+}
+
+
+class ProcessReferenceView(ProcessImageView):
+    """
+    POST /api/processing/process/reference/
+
+    Queues a background job for an image uploaded with a direct-upload
+    ticket, with the same fields as POST /api/processing/process/ except
+    that ``reference`` (from the ticket) replaces ``image`` and there is no
+    ``mode`` or deadline. Returns the async response (202 with the job id).
+    The job reads the uploaded object from storage, and the history entry
+    keeps it as its original. Returns 400 for an invalid or expired
+    reference, 404 if nothing was uploaded for it, 413 if the object is
+    larger than AI_MAX_UPLOAD_BYTES (it is deleted) and 409 if it already
+    has a job that did not fail. The job fails if the object is not an
+    image in an accepted format.
+    """
+
+    @timed_view('process_reference')
+    @idempotent
+    def post(self, request):
+        serializer = ProcessReferenceSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            payload = direct_uploads.resolve(request.user, serializer.validated_data['reference'])
+        except direct_uploads.DirectUploadError as e:
+            return Response({"error": str(e)}, status=DIRECT_UPLOAD_ERROR_STATUS[e.code])
+        jobs = ProcessingJob.objects.filter(user=request.user, source_name=payload['name'])
+        if jobs.exclude(status='FAILED').exists():
+            return Response(
+                {"error": "This upload has already been queued for processing."},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        steps = serializer.validated_data['feature']
+        tier = serializer.validated_data['quality_tier']
+        annotate(feature=cache.pipeline_name(steps), mode='async', quality_tier=tier)
+        job = enqueue_job(
+            request.user, None, steps, serializer.get_options(),
+            serializer.get_output(request.headers.get('Accept')), tier,
+            source_name=payload['name'],
+        )
+        return self.queued(request, job)
+
+
+class QualityTiersView(APIView):
+    """
+    GET /api/processing/quality-tiers/
+
+    For every quality tier and feature: how it runs (input_scale, passes,
+    whether the tier has a model of its own), its cost relative to balanced
+    and its expected latency on this node (mean_ms, p90_ms over ``samples``
+    images). Tiers without samples get a mean estimated from balanced
+    (``estimated``: true). Refreshed every 30 seconds.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(quality.published(), status=status.HTTP_200_OK)
+
+
+class ModelRegistryView(APIView):
+    """
+    GET /api/processing/models/
+
+    Admin only. Reports, for this worker process, which models are loaded,
+    how long each took to load and roughly how much memory it holds, plus
+    micro-batching metrics per feature (batch size, fill ratio, queue wait).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            "budget_bytes": model_registry.budget_bytes,
+            "models": model_registry.stats(),
+            "microbatching": microbatch.stats(),
         }, status=status.HTTP_200_OK)
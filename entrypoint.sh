@@ -15,5 +15,33 @@ python manage.py migrate --noinput
 # Collect static files
 python manage.py collectstatic --noinput
 
+# Fresh directory for the metrics every process writes (see Ai_processing/metrics.py)
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/api_pix_metrics}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Start background workers for async processing jobs (AI_JOB_WORKERS=0 disables them).
+# The command restarts workers that die; this loop restarts the command itself.
+if [ "${AI_JOB_WORKERS:-2}" -gt 0 ]; then
+    (
+        while true; do
+            python manage.py run_processing_workers || true
+            echo "run_processing_workers exited; restarting in 5s" >&2
+            sleep 5
+        done
+    ) &
+fi
+
 # Start Gunicorn using Railway PORT
-exec gunicorn API.wsgi:application --bind 0.0.0.0:${PORT:-8000} --workers 3
+# AI_PRELOAD_MODELS=1 loads the models in the master before the workers fork
+GUNICORN_PRELOAD=""
+if [ "${AI_PRELOAD_MODELS:-0}" = "1" ]; then
+    GUNICORN_PRELOAD="--preload"
+fi
+# Plain sync workers by default; SERVER_INTERFACE=asgi serves the app with uvicorn
+# workers so open job progress streams don't each tie up a worker
+if [ "${SERVER_INTERFACE:-wsgi}" = "asgi" ]; then
+    exec gunicorn API.asgi:application --bind 0.0.0.0:${PORT:-8000} --workers 3 \
+        --worker-class uvicorn_worker.UvicornWorker $GUNICORN_PRELOAD
+fi
+exec gunicorn API.wsgi:application --bind 0.0.0.0:${PORT:-8000} --workers 3 $GUNICORN_PRELOAD
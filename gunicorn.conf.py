@@ -0,0 +1,20 @@
+"""
+gunicorn reads this file from the working directory; the command-line flags
+in entrypoint.sh still apply on top of it.
+"""
+
+import os
+
+
+def child_exit(server, worker):
+    # Forget the exited worker's live gauges (in-flight inference) in /metrics
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+    # Delete the shared-memory segments a crashed worker left behind
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'API.settings')
+    try:
+        from Ai_processing import shm
+        shm.sweep_dead()
+    except Exception:
+        server.log.exception("Could not sweep shared-memory segments of worker %s", worker.pid)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_history', '0002_user_history_feature_used'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user_history',
+            name='pipeline',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_history', '0003_user_history_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user_history',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
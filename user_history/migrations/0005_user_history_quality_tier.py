@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_history', '0004_user_history_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user_history',
+            name='quality_tier',
+            field=models.CharField(choices=[('fast', 'Fast'), ('balanced', 'Balanced'), ('best', 'Best')], default='balanced', max_length=10),
+        ),
+    ]
@@ -17,6 +17,16 @@ class User_History(models.Model):
         ],
         default='BASIC_FILTER',
     )
+    # Every feature applied, in order (feature_used is the last one)
+    pipeline = models.JSONField(default=list, blank=True)
+    # Thumbnail renditions of restored_image: [{size, width, height, name}], smallest first
+    derivatives = models.JSONField(default=list, blank=True)
+    # Speed/quality trade-off the pipeline ran at (see Ai_processing.utils.QUALITY_STRATEGIES)
+    quality_tier = models.CharField(
+        max_length=10,
+        choices=[('fast', 'Fast'), ('balanced', 'Balanced'), ('best', 'Best')],
+        default='balanced',
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
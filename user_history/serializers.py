@@ -1,11 +1,15 @@
 from rest_framework import serializers
 
+from Ai_processing.derivatives import request_derivatives, srcset
+
 from .models import User_History
 
 
 class UserHistorySerializer(serializers.ModelSerializer):
     image_uploaded = serializers.SerializerMethodField()
     restored_image = serializers.SerializerMethodField()
+    # e.g. "https://.../processed_x_128.webp 128w, .../processed_x_512.webp 512w"
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = User_History
@@ -13,7 +17,10 @@ class UserHistorySerializer(serializers.ModelSerializer):
             'id',
             'image_uploaded',
             'restored_image',
+            'srcset',
             'feature_used',
+            'pipeline',
+            'quality_tier',
             'created_at',
         )
         read_only_fields = fields
@@ -36,3 +43,10 @@ class UserHistorySerializer(serializers.ModelSerializer):
 
     def get_restored_image(self, obj):
         return self._absolute_url(obj.restored_image, self.context.get('request'))
+
+    def get_srcset(self, obj):
+        """Thumbnail renditions of restored_image; requested in the background if missing."""
+        if not obj.derivatives:
+            request_derivatives(obj)
+            return None
+        return srcset(obj, self.context.get('request'))
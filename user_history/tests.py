@@ -1,3 +1,69 @@
-from django.test import TestCase
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from users.models import User
+
+from .models import User_History
+
+
+class UserHistoryApiTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, root, ignore_errors=True)
+        storage = override_settings(
+            MEDIA_ROOT=root,
+            STORAGES={
+                'default': {'BACKEND': 'Ai_processing.storage.LocalMediaStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+        )
+        storage.enable()
+        cls.addClassCleanup(storage.disable)
+        super().setUpClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', username='owner', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create(self, user=None, **fields):
+        history = User_History(user=user or self.user, feature_used='DE_NOISE', pipeline=['DE_NOISE'], **fields)
+        history.image_uploaded.save('original.png', ContentFile(b'original'), save=False)
+        history.restored_image.save('processed.png', ContentFile(b'processed'), save=False)
+        history.save()
+        return history
+
+    def test_srcset_lists_the_renditions(self):
+        history = self.create(derivatives=[
+            {'size': 128, 'width': 128, 'height': 96, 'name': 'user_history/derivatives/p_128.webp'},
+            {'size': 512, 'width': 512, 'height': 384, 'name': 'user_history/derivatives/p_512.webp'},
+        ])
+        response = self.client.get(reverse('user_history:history_detail', args=[history.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data['srcset'],
+            'http://testserver/media/user_history/derivatives/p_128.webp 128w, '
+            'http://testserver/media/user_history/derivatives/p_512.webp 512w',
+        )
+
+    def test_srcset_is_empty_until_renditions_exist(self):
+        history = self.create()
+        # As if generation were already scheduled, so none starts in the background
+        cache.set(f"derivatives-pending:{history.pk}", 1)
+        response = self.client.get(reverse('user_history:history_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data[0]['srcset'])
+
+    def test_other_users_history_is_hidden(self):
+        other = User.objects.create_user(email='other@example.com', username='other', password='x')
+        history = self.create(user=other)
+        response = self.client.get(reverse('user_history:history_detail', args=[history.pk]))
+        self.assertEqual(response.status_code, 404)